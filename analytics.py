@@ -0,0 +1,194 @@
+# 銷售統計 (增量維護)
+# 每筆訂單新增 / 修改時只更新它對各統計表的貢獻，數據戰情室直接讀取彙總結果；
+# 第一次使用 (或失效後) 才從完整的訂單資料計算，尚未計算時的增量更新只記下訂單編號。商品分類在讀取時才查詢，Products 修改分類後不需要重新計算。
+
+import threading
+
+import pandas as pd
+
+from order_items import parse_items
+
+
+def _num(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value
+
+
+def _month(order_time):
+    ts = pd.to_datetime(order_time, errors="coerce")
+    return None if pd.isna(ts) else ts.strftime("%Y-%m")
+
+
+class SalesRollups:
+    def __init__(self, category_of=None):
+        # category_of(product_name) -> 分類名稱
+        self.category_of = category_of or (lambda name: "Unknown")
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._generation = 0  # invalidate() 時增加：計算期間失效的結果不算完成
+        self._missed = set()  # 尚未計算時略過的訂單編號 (計算完成後重新套用)
+        self._reset()
+
+    def _reset(self):
+        self._orders = {}  # order_id -> 該訂單的貢獻
+        self.revenue = 0.0
+        self.dealers = {}
+        self.months = {}
+        self.brands = {}
+        self.products = {}  # (product, brand) -> [qty, subtotal]
+        self.built_at = None
+
+    # --- 單筆訂單的貢獻 ---
+    def _contribution(self, order, items=None, month=False):
+        # items: [(brand, name, qty, subtotal)]；省略時以 order_items.parse_items 解析 (與明細表相同)
+        if items is None:
+            try:
+                items = [(brand, name, qty, sub) for _, name, _, brand, qty, _, sub in parse_items(order.get("Items_Json") or "{}")]
+            except Exception:
+                items = []
+        return {
+            "total": _num(order.get("Total")),
+            "dealer": str(order.get("Customer_Name", "")),
+            "month": _month(order.get("Order_Time")) if month is False else month,
+            "items": items,
+        }
+
+    @staticmethod
+    def _bump(table, key, amount):
+        value = table.get(key, 0) + amount
+        if abs(value) < 1e-9:
+            table.pop(key, None)
+        else:
+            table[key] = value
+
+    def _add(self, c, sign):
+        self.revenue += sign * c["total"]
+        self._bump(self.dealers, c["dealer"], sign * c["total"])
+        if c["month"] is not None:
+            self._bump(self.months, c["month"], sign * c["total"])
+        for brand, name, qty, sub in c["items"]:
+            self._bump(self.brands, brand, sign * sub)
+            key = (name, brand)
+            qty_sub = self.products.get(key, [0, 0])
+            qty_sub = [qty_sub[0] + sign * qty, qty_sub[1] + sign * sub]
+            if qty_sub == [0, 0]:
+                self.products.pop(key, None)
+            else:
+                self.products[key] = qty_sub
+
+    # --- 增量更新 ---
+    def apply_order(self, order):
+        # 新增或修改訂單 (order 為整筆訂單的 dict)；尚未計算時只記下訂單編號
+        order_id = str(order.get("Order_ID"))
+        if self._skip(order_id):
+            return
+        c = self._contribution(order)
+        with self._lock:
+            old = self._orders.get(order_id)
+            if old is not None:
+                self._add(old, -1)
+            self._add(c, +1)
+            self._orders[order_id] = c
+
+    def remove_order(self, order_id):
+        if self._skip(str(order_id)):
+            return
+        with self._lock:
+            old = self._orders.pop(str(order_id), None)
+            if old is not None:
+                self._add(old, -1)
+
+    def _skip(self, order_id):
+        with self._lock:
+            if self.built_at is None:
+                self._missed.add(order_id)
+                return True
+            return False
+
+    # --- 完整計算 ---
+    def invalidate(self):
+        # 統計可能與訂單不一致 (例如其他程序修改了訂單)：下次使用時重新計算
+        with self._lock:
+            self._generation += 1
+            self.built_at = None
+
+    def ensure_built(self, load):
+        # 尚未計算或已失效時才完整計算一次 (同時間只有一個呼叫端計算)；load() -> (orders, line_items)
+        # 回傳計算期間略過、需要以最新內容重新套用的訂單編號
+        with self._build_lock:
+            if self.built_at is not None:
+                return []
+            with self._lock:
+                generation = self._generation
+            orders, line_items = load()
+            self.rebuild(orders, line_items, generation=generation)
+            with self._lock:
+                missed, self._missed = self._missed, set()
+            return sorted(missed)
+
+    def rebuild(self, orders, line_items=None, generation=None):
+        # 從完整訂單資料重新計算；line_items 為 order_items 的明細表 (可省略)
+        # generation: 讀取 orders 當時的版本，計算期間又失效時結果照樣換上，但仍標記為需要重新計算
+        by_order = {}
+        if line_items is not None and not line_items.empty:
+            for rec in line_items[["Order_ID", "Brand", "Name", "Qty", "Subtotal"]].itertuples(index=False):
+                by_order.setdefault(rec.Order_ID, []).append((rec.Brand, rec.Name, int(rec.Qty), int(rec.Subtotal)))
+        months = pd.to_datetime(orders["Order_Time"], errors="coerce").dt.strftime("%Y-%m") if "Order_Time" in orders.columns else None
+        contributions = {}
+        for pos, order in enumerate(orders.to_dict("records")):
+            order_id = str(order.get("Order_ID"))
+            items = by_order.get(order_id, []) if line_items is not None else None
+            month = months.iloc[pos] if months is not None else None
+            contributions[order_id] = self._contribution(order, items, None if pd.isna(month) else month)
+        with self._lock:
+            self._reset()
+            for order_id, c in contributions.items():
+                self._add(c, +1)
+                self._orders[order_id] = c
+            if generation is None or generation == self._generation:
+                self.built_at = pd.Timestamp.now()
+
+    # --- 讀取 ---
+    def kpis(self):
+        with self._lock:
+            count = len(self._orders)
+            revenue = int(self.revenue)
+        return revenue, count, int(revenue / count) if count else 0
+
+    def _series(self, table, sort_by_value=True, top=None):
+        with self._lock:
+            s = pd.Series(dict(table), dtype="float64")
+        s = s.sort_values(ascending=False) if sort_by_value else s.sort_index()
+        return s.head(top) if top else s
+
+    def dealer_sales(self, top=10):
+        return self._series(self.dealers, top=top)
+
+    def monthly_sales(self):
+        return self._series(self.months, sort_by_value=False)
+
+    def brand_sales(self):
+        return self._series(self.brands)
+
+    def _category(self, name):
+        return self.category_of(name) or "Unknown"
+
+    def category_sales(self):
+        with self._lock:
+            products = list(self.products.items())
+        categories = {}
+        for (name, _), (_, sub) in products:
+            category = self._category(name)
+            categories[category] = categories.get(category, 0) + sub
+        return self._series(categories)
+
+    def top_products(self, top=20):
+        with self._lock:
+            rows = [(n, b, q, s) for (n, b), (q, s) in self.products.items()]
+        df = pd.DataFrame(rows, columns=["Product", "Brand", "Qty", "Subtotal"])
+        df = df.sort_values("Subtotal", ascending=False).head(top).reset_index(drop=True)
+        df.insert(2, "Category", [self._category(name) for name in df["Product"]])
+        return df
@@ -2,12 +2,30 @@ import streamlit as st
 import pandas as pd
 from streamlit_gsheets import GSheetsConnection
 from datetime import datetime
+import html
+import io
 import json
+import os
 import time
-import random
+
+from analytics import SalesRollups
+from catalog import CatalogIndex, parse_allowed_brands
+from image_cache import ImageCache, ImageServer, local_drive_fetcher, url_fetcher
+from mailer import SmtpOutbox
+from order_ids import OrderIdAllocator, normalize_order_id
+from order_items import OrderItemsCache
+from perf import InstrumentedBackend, PerfMonitor
+from pricing import PricingEngine, order_total, priced_items
+from order_store import OrderStore, OrderSyncWorker
+from scheduler import RequestScheduler, ScheduledBackend, is_rate_limited
+from schema import apply_schema, missing_required
+from sheet_sync import DeltaSync, changed_fields
+from snapshots import Snapshot
+from storage import SheetsBackend, open_local_backend
+from users import LoginGuard, UserDirectory
+from write_queue import WriteBehindQueue
 
 # Email 相關模組
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -19,9 +37,64 @@ st.set_page_config(
 )
 
 # Google Sheets 連線
-conn = st.connection("gsheets", type=GSheetsConnection)
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1nuIdMqrRKhWIbuqsz0eVwKYr24HLDDdV7CNn_SPiSYI/edit"
 
+# 本地訂單資料庫 (背景同步回 Sheet)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+ORDER_DB_PATH = os.path.join(DATA_DIR, "orders.db")
+
+# 資料來源 (可在 secrets.toml 的 [storage] 區段覆寫，例如 backend = "csv", path = "staging/")
+# backend: sheets (預設) / csv / parquet / sqlite
+STORAGE_SETTINGS = {
+    "backend": "sheets",
+    "spreadsheet": SHEET_URL,
+    "path": os.path.join(DATA_DIR, "sheets"),
+    # Google Sheets 請求配額 (全站共用)：每分鐘 API 請求數與可累積的額度
+    # (以實際請求計算：一次讀取約 3 次、整表覆寫約 6 次；由快取回應的讀取不計。
+    # burst 讓啟動時同時載入的幾個分頁不必排隊，仍在每分鐘配額之內)
+    "per_minute": 60,
+    "burst": 30,
+}
+
+# 商品圖片快取 (可在 secrets.toml 的 [images] 區段覆寫)
+# drive_dir: 測試用，以本地資料夾 (<檔案ID>.jpg) 代替 Google Drive
+# port / public_url: 啟動獨立的圖片服務 (長效快取標頭)；未設定時由 Streamlit 直接提供本地檔案
+IMAGE_SETTINGS = {
+    "enabled": True,
+    "path": os.path.join(DATA_DIR, "images"),
+    "budget_mb": 500,
+    "drive_dir": "",
+    "port": 0,
+    "public_url": "",
+    "secret": "",
+}
+IMAGE_SIZES = {"tile": 320, "main": 1000}
+
+# 同系列商品每頁顯示數量 (每列 3 個；可在 secrets.toml 以 related_page_size 覆寫)
+RELATED_PAGE_SIZE = 9
+
+# 延遲寫入 (可在 secrets.toml 的 [writes] 區段覆寫)
+# window: 同一分頁的修改等幾秒合併成一次寫入；timeout: 需要確認寫入時最多等幾秒
+WRITE_SETTINGS = {
+    "window": 1.0,
+    "timeout": 30,
+}
+
+# 效能紀錄 (可在 secrets.toml 的 [perf] 區段覆寫)
+# capacity: 記憶體中保留最近幾筆事件；log_path: 另外以 JSON Lines 寫入檔案 (未設定時只送到 logging)
+PERF_SETTINGS = {
+    "capacity": 5000,
+    "log_path": "",
+}
+
+# 訂單編號 (可在 secrets.toml 的 [orders] 區段覆寫)
+# node_id: 這台主機的代號 (英數字)；多台主機同時運作時請各自設定不同值，未設定時每次啟動隨機產生
+# pull_interval: 每幾秒從 Sheet 讀回 Orders (取得直接在 Sheet 上的修改與其他主機的訂單)
+ORDER_SETTINGS = {
+    "node_id": "",
+    "pull_interval": 60,
+}
+
 # B2B 基礎規則
 TAX_RATE = 0.05
 SHIPPING_FEE = 125
@@ -29,6 +102,17 @@ SHIPPING_FEE = 125
 # 定義管理員帳號
 ADMIN_USERS = ["admin", "bluebulous", "test@test.com"] 
 
+# Email 設定 (可在 secrets.toml 的 [smtp] 區段覆寫，例如改用本地測試 SMTP)
+SENDER_EMAIL = "bluebulous.official@gmail.com"
+SMTP_SETTINGS = {
+    "host": "smtp.gmail.com",
+    "port": 587,
+    "username": SENDER_EMAIL,
+    "password": "mjzm yfwj nbxz nefj",
+    "use_tls": True,
+    "per_minute": 20,
+}
+
 # --- 2. CSS 樣式 ---
 st.markdown(
     """
@@ -154,6 +238,15 @@ st.markdown(
     .badge-done { background-color: #2c3e50; }
     .badge-unpaid { background-color: #c0392b; }
 
+    /* 同系列商品縮圖：固定比例的佔位框，圖片進入畫面才載入 */
+    .tile-img {
+        aspect-ratio: 1 / 1;
+        background-color: #f0f0f0;
+        border-radius: 4px;
+        overflow: hidden;
+    }
+    .tile-img img { width: 100%; height: 100%; object-fit: cover; }
+
     /* === 🛒 購物車專用微調 (關鍵修正) === */
     /* 1. 強制讓 Number Input 顯示為固定寬度 (120px) */
     div[data-testid="stVerticalBlockBorderWrapper"] div[data-testid="stNumberInput"] {
@@ -197,111 +290,347 @@ st.markdown(
 
 # --- 3. 輔助函數 ---
 
-@st.cache_data(ttl=3600)
-def get_products_data():
-    max_retries = 5 
-    for attempt in range(max_retries):
-        try:
-            df = conn.read(spreadsheet=SHEET_URL, worksheet="Products")
-            df.columns = df.columns.str.strip()
-            # 資料清洗
-            if 'Size' in df.columns:
-                df['Size'] = df['Size'].astype(str).str.strip()
-            if 'Name' in df.columns:
-                df['Name'] = df['Name'].astype(str).str.strip()
-            if 'Color' in df.columns:
-                df['Color'] = df['Color'].astype(str).str.strip()
-            if 'Category' in df.columns:
-                df['Category'] = df['Category'].astype(str).str.strip()
-            if 'Brand' in df.columns:
-                df['Brand'] = df['Brand'].astype(str).str.strip()
-                
-            df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            return df
-        except Exception as e:
-            if "429" in str(e) or "Quota exceeded" in str(e):
-                wait_time = (2 ** attempt) + random.random()
-                if attempt < max_retries - 1:
-                    time.sleep(wait_time) 
-                    continue
-            st.error(f"無法讀取產品資料 (請稍後再試): {e}")
-            return pd.DataFrame()
-    return pd.DataFrame()
+@st.cache_resource
+def get_perf():
+    # 頁面區塊耗時與每次資料來源讀寫 (管理員後台「效能」分頁)
+    settings = dict(PERF_SETTINGS)
+    settings.update(_secret_section("perf"))
+    return PerfMonitor(capacity=int(settings["capacity"]), log_path=settings["log_path"] or None)
+
+def perf_section(name):
+    return get_perf().section(name)
+
+@st.cache_resource
+def get_storage():
+    # 所有分頁的讀寫都經過這個後端 (每次讀寫都記錄耗時)
+    settings = dict(STORAGE_SETTINGS)
+    settings.update(_secret_section("storage"))
+    if settings["backend"] == "sheets":
+        # 所有 Sheets 請求經過同一個排程器：限流、同分頁讀取合併、寫入優先
+        scheduler = RequestScheduler(per_minute=int(settings["per_minute"]), burst=int(settings["burst"]))
+        backend = ScheduledBackend(SheetsBackend(st.connection("gsheets", type=GSheetsConnection), settings["spreadsheet"]), scheduler)
+    else:
+        backend = open_local_backend(settings["backend"], settings["path"])
+    return InstrumentedBackend(backend, get_perf())
+
+# 以下函式可能在背景執行緒執行：失敗時拋出例外 (保留舊快照)，不可使用 st.* 元件
+def _fetch(worksheet):
+    return lambda: get_storage().read(worksheet, ttl=0)
+
+def _build_catalog(raw):
+    # 資料清洗 (依 schema 一次完成：去空白、類別欄位、價格轉整數) 並建立產品索引
+    df = apply_schema(raw, "Products")
+    if df.empty:
+        raise ValueError("Products 沒有資料")
+    return CatalogIndex(df)
+
+def _build_brand_rules(raw):
+    df = apply_schema(raw, "BrandRules")
+    rules = {}
+    for row in df.to_dict('records'):
+        rules[row['Brand']] = {
+            'wholesale_threshold': int(row['Wholesale_Threshold']),
+            'shipping_threshold': int(row['Shipping_Threshold']),
+            'discount_rate': float(row['Discount'])
+        }
+    return rules, df
+
+def _build_users(raw):
+    df = apply_schema(raw, "Users")
+    missing = missing_required(df, "Users")
+    if missing:
+        raise ValueError(f"Users 缺少欄位: {missing}")
+    get_sheet_sync().prime("Users", df)
+    return UserDirectory(df)
+
+def _build_announcement(df):
+    if not df.empty and 'Message' in df.columns:
+        return str(df.iloc[0]['Message'])
+    return ""
+
+@st.cache_resource
+def get_snapshots():
+    # 產品、品牌規則、公告：立即回應最後一次成功的快照，過期後由背景執行緒重新載入再整份置換；
+    # 各自有版本號，來源內容沒變時不重建
+    background = lambda: get_storage().background()
+    return {
+        "Products": Snapshot("Products", _fetch("Products"), _build_catalog, max_age=3600, background=background),
+        "BrandRules": Snapshot("BrandRules", _fetch("BrandRules"), _build_brand_rules, max_age=3600, background=background),
+        "Announcements": Snapshot("Announcements", _fetch("Announcements"), _build_announcement, max_age=600, background=background),
+        "Users": Snapshot("Users", _fetch("Users"), _build_users, max_age=600, background=background),
+    }
+
+def refresh_snapshot(name, min_interval=0):
+    # 只重新載入指定的資料集；回傳內容是否有變 (失敗時保留舊快照)
+    try:
+        return get_snapshots()[name].refresh(min_interval)
+    except Exception as e:
+        print(f"Snapshot Refresh Error ({name}): {e}")
+        return False
+
+def refresh_snapshot_later(name, min_interval=0):
+    # 在背景重新載入指定的資料集，不等待結果
+    try:
+        return get_snapshots()[name].refresh_later(min_interval)
+    except Exception as e:
+        print(f"Snapshot Refresh Error ({name}): {e}")
+        return False
+
+def get_catalog_index():
+    # 產品索引與各權限的目錄 (價格已轉為數字)，所有 session 共用
+    return get_snapshots()["Products"].get()
+
+@st.cache_resource
+def get_pricing_engine():
+    return PricingEngine(TAX_RATE, SHIPPING_FEE)
+
+def get_user_directory():
+    # 以 Username 索引的使用者目錄 (所有 session 共用)
+    return get_snapshots()["Users"].get()
+
+@st.cache_resource
+def get_login_guard():
+    return LoginGuard()
+
+def _flush_users(directory):
+    # 寫入時才取目錄的最新內容：同一段時間內多位使用者的修改一次寫入 (只寫入變動的儲存格)
+    sync = get_sheet_sync()
+    merges = sync.merges
+    try:
+        _write_sheet("Users", directory.to_dataframe())
+    except Exception:
+        get_snapshots()["Users"].invalidate()
+        raise
+    if sync.merges != merges:
+        # 合併到其他程序的修改：目錄在背景重新載入
+        get_snapshots()["Users"].invalidate()
+
+def update_user(username, fields, base=None, wait=True):
+    # 就地修改使用者資料並排入 Users 寫入佇列；找不到使用者回傳 False
+    # base: 畫面上顯示的資料列，有提供時只寫入實際修改的欄位
+    # wait: 等到確認寫入 Sheet 才回傳 (寫入失敗拋出例外)；False 時背景寫入
+    directory = get_user_directory()
+    if not directory.update(username, fields, base=base):
+        return False
+    pending = get_write_queue().submit("Users", lambda: _flush_users(directory), key=id(directory))
+    if wait:
+        pending.wait(float(get_write_settings()["timeout"]))
+    return True
 
-@st.cache_data(ttl=3600)
 def get_brand_rules():
     try:
-        df = conn.read(spreadsheet=SHEET_URL, worksheet="BrandRules")
-        df.columns = df.columns.str.strip()
-        df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-        
-        rules = {}
-        for _, row in df.iterrows():
-            rules[row['Brand']] = {
-                'wholesale_threshold': int(row['Wholesale_Threshold']),
-                'shipping_threshold': int(row['Shipping_Threshold']),
-                'discount_rate': float(row['Discount'])
-            }
-        return rules, df
+        return get_snapshots()["BrandRules"].get()
     except Exception as e:
         default_df = pd.DataFrame([{"Brand": "default", "Wholesale_Threshold": 10000, "Shipping_Threshold": 10000, "Discount": 0.7}])
         return {"default": {"wholesale_threshold": 10000, "shipping_threshold": 10000, "discount_rate": 0.7}}, default_df
 
+def _read_sheet(worksheet):
+    # 直接讀取 Sheet，失敗時拋出例外 (不回傳空表，避免被誤當成沒有資料)
+    return apply_schema(get_storage().read(worksheet, ttl=0), worksheet)
+
+def _write_sheet_full(worksheet, df):
+    get_storage().update(worksheet, df)
+
+def _write_sheet_ranges(worksheet, ranges, n_rows):
+    # 只寫入有變動的儲存格 (一次 batch update)
+    get_storage().update_cells(worksheet, ranges, n_rows)
+
+def get_write_settings():
+    settings = dict(WRITE_SETTINGS)
+    settings.update(_secret_section("writes"))
+    return settings
+
+@st.cache_resource
+def get_write_queue():
+    # 所有延遲寫入共用一個佇列 (依分頁合併)
+    return WriteBehindQueue(window=float(get_write_settings()["window"]))
+
+@st.cache_resource
+def get_sheet_sync():
+    # Orders / Users 可能有多個程序同時寫入：以主鍵做三方合併後才寫入
+    return DeltaSync(_write_sheet_full, _write_sheet_ranges, read=_read_sheet, keys={"Orders": "Order_ID", "Users": "Username"})
+
+def _write_sheet(worksheet, df):
+    return get_sheet_sync().write(worksheet, df)
+
+@st.cache_resource
+def get_order_store():
+    # 不同資料來源使用各自的本地訂單資料庫，避免測試副本與正式資料混在一起
+    key = get_storage().key
+    store = OrderStore(ORDER_DB_PATH if key == "sheets" else os.path.join(DATA_DIR, f"orders-{key}.db"))
+    if not store.is_seeded():
+        # 第一次啟動：從 Sheet 匯入既有訂單 (同時存成合併基準)
+        store.seed(_read_sheet("Orders"))
+    return store
+
+def _push_orders(df):
+    # 與 Sheet 目前內容合併後寫入；回傳合併結果 (其他程序的訂單會套用回本地)
+    # 合併基準取自本地資料庫 (上次同步的內容)，程序重新啟動或寫入失敗後仍然正確
+    sync = get_sheet_sync()
+    base = get_order_store().sheet_base()
+    if base is not None:
+        sync.prime("Orders", base)
+    sync.write("Orders", df)
+    return sync.snapshot("Orders")
+
+def _pull_orders():
+    # 背景定期讀取 (低優先順序，不佔用頁面請求的額度)
+    with get_storage().background():
+        return _read_sheet("Orders")
+
+def _orders_changed_elsewhere():
+    # Sheet 上的修改套用到本地後，統計下次使用時重新計算
+    get_sales_rollups().invalidate()
+
+@st.cache_resource
+def get_order_sync():
+    settings = dict(ORDER_SETTINGS)
+    settings.update(_secret_section("orders"))
+    return OrderSyncWorker(get_order_store(), _push_orders, queue=get_write_queue(), pull=_pull_orders,
+                           pull_interval=float(settings["pull_interval"]), on_change=_orders_changed_elsewhere).start()
+
+def _product_category(name):
+    try:
+        return get_catalog_index().category_of(name) or "Unknown"
+    except Exception:
+        return "Unknown"
+
+@st.cache_resource
+def get_sales_rollups():
+    # 銷售統計 (數據戰情室第一次使用時才完整計算，之後隨訂單寫入增量更新)
+    # 結帳等寫入路徑只做增量更新：尚未計算時只記下訂單編號，不會在這裡讀取全部訂單
+    return SalesRollups(category_of=_product_category)
+
+def _load_rollup_source():
+    orders = get_data("Orders")
+    return orders, get_order_items(orders).table
+
+def built_sales_rollups():
+    # 數據戰情室使用：尚未計算 (或已失效) 時完整計算，再補上計算期間略過的訂單
+    rollups = get_sales_rollups()
+    _rollup_orders(rollups.ensure_built(_load_rollup_source))
+    return rollups
+
+def _rollup_orders(order_ids):
+    try:
+        store = get_order_store()
+        rollups = get_sales_rollups()
+        for order_id in order_ids:
+            rec = store.get(order_id)
+            if rec is not None:
+                rollups.apply_order(rec)
+            else:
+                rollups.remove_order(order_id)
+    except Exception as e:
+        print(f"Rollup Error: {e}")
+
+def save_order(order_data):
+    # 新增單筆訂單 (只寫本地，背景同步)
+    get_order_store().append(order_data)
+    get_order_sync().notify()
+    _rollup_orders([order_data['Order_ID']])
+
+def patch_order(order_id, fields, base=None):
+    # 修改單筆訂單的部分欄位 (fields 可為函式：依最新資料計算要修改的欄位，衝突重試時重新計算)
+    updated = get_order_store().update(order_id, fields, base=base)
+    if updated:
+        get_order_sync().notify()
+        _rollup_orders([order_id])
+    return updated
+
+def patch_orders(updates):
+    # 一次修改多筆訂單 (單一交易，背景合併同步)
+    updated = get_order_store().update_many(updates)
+    if updated:
+        get_order_sync().notify()
+        _rollup_orders(updated)
+    return updated
+
 def get_data(worksheet, ttl=0):
-    max_retries = 5
-    for attempt in range(max_retries):
+    if worksheet == "Orders":
         try:
-            df = conn.read(spreadsheet=SHEET_URL, worksheet=worksheet, ttl=ttl)
-            df.columns = df.columns.str.strip()
-            df = df.apply(lambda x: x.str.strip() if x.dtype == "object" else x)
-            return df
+            get_order_sync()  # 確保背景同步已啟動 (定期讀回 Sheet 上的修改)
+            return apply_schema(get_order_store().to_dataframe(), "Orders")
         except Exception as e:
-            if "429" in str(e) or "Quota exceeded" in str(e):
-                wait_time = (2 ** attempt) + random.random()
-                if attempt < max_retries - 1:
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    st.error(f"⚠️ 系統繁忙 (Google API 流量限制)，請稍後再試。")
-                    return pd.DataFrame()
-            else:
-                return pd.DataFrame()
-    return pd.DataFrame()
+            st.error(f"⚠️ 無法載入訂單資料，請稍後再試。 ({e})")
+            return pd.DataFrame()
+    # 流量限制 (429) 由 get_storage() 的排程器統一排隊與退避
+    try:
+        df = apply_schema(get_storage().read(worksheet, ttl=ttl), worksheet)
+        if ttl == 0:
+            get_sheet_sync().prime(worksheet, df)
+        return df
+    except Exception as e:
+        if is_rate_limited(e):
+            st.error(f"⚠️ 系統繁忙 (Google API 流量限制)，請稍後再試。")
+        return pd.DataFrame()
+
+@st.cache_resource
+def get_order_items_cache():
+    return OrderItemsCache()
+
+def get_order_items(orders):
+    # 訂單明細表 (以 Orders 內容雜湊快取，各頁面共用)
+    return get_order_items_cache().get(orders)
 
 def update_data(worksheet, df):
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            conn.update(spreadsheet=SHEET_URL, worksheet=worksheet, data=df)
-            if worksheet == "Products":
-                get_products_data.clear()
-            if worksheet == "BrandRules":
-                get_brand_rules.clear()
-            if worksheet == "Announcements": # [新增] 清除公告快取
-                get_announcement.clear()
-            return 
-        except Exception as e:
-            if "429" in str(e):
-                wait_time = (2 ** attempt) + 2
-                if attempt == 0:
-                    st.warning("系統繁忙，正在排隊寫入資料...")
-                time.sleep(wait_time)
-            else:
-                st.error(f"儲存失敗: {e}")
-                return
+    if worksheet == "Orders":
+        get_order_store().replace_all(df)
+        get_order_sync().notify()
+        get_sales_rollups().invalidate() # 整表寫入後重新計算統計
+        return
+    try:
+        _write_sheet(worksheet, df)
+    except Exception as e:
+        if is_rate_limited(e):
+            st.error("⚠️ 系統繁忙 (Google API 流量限制)，儲存失敗，請稍後再試。")
+        else:
+            st.error(f"儲存失敗: {e}")
+        return
+    if worksheet in ("Products", "BrandRules", "Announcements"): # 重新載入快照
+        refresh_snapshot(worksheet)
 
 # [新增] 讀取公告函式
-@st.cache_data(ttl=600)
 def get_announcement():
     try:
-        df = conn.read(spreadsheet=SHEET_URL, worksheet="Announcements")
-        if not df.empty and 'Message' in df.columns:
-            return str(df.iloc[0]['Message'])
-        return ""
+        return get_snapshots()["Announcements"].get()
     except:
         return ""
 
-def convert_drive_url(url):
+def _format_age(seconds):
+    if seconds is None:
+        return "尚未載入"
+    if seconds < 60:
+        return "剛剛"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} 分鐘前"
+    return f"{seconds / 3600:.1f} 小時前"
+
+def snapshot_status():
+    # 管理員查看各快照的新舊程度
+    parts = []
+    for name, snap in get_snapshots().items():
+        text = f"{name} v{snap.version} {_format_age(snap.age())}"
+        if snap.refreshing:
+            text += " (更新中…)"
+        elif snap.last_error:
+            text += " (⚠️ 更新失敗)"
+        parts.append(text)
+    return " · ".join(parts)
+
+def write_queue_status():
+    # 管理員查看延遲寫入佇列：待寫入筆數、從修改到寫入完成的時間、合併效果
+    parts = []
+    for name, stat in sorted(get_write_queue().stats().items()):
+        text = f"{name} 待寫入 {stat['depth']} 筆"
+        if stat['flushes']:
+            text += f"，{stat['submitted']} 次修改 / {stat['flushes']} 次寫入，平均 {stat['avg_latency']:.1f} 秒"
+        if stat['errors']:
+            text += f" (⚠️ 失敗 {stat['errors']} 次)"
+        parts.append(text)
+    return " · ".join(parts) or "尚無寫入"
+
+def convert_drive_url(url, width=1000):
     if pd.isna(url) or not isinstance(url, str): 
         return None
     url = url.strip()
@@ -315,9 +644,134 @@ def convert_drive_url(url):
     except Exception:
         return None
     if file_id:
-        return f"https://drive.google.com/thumbnail?id={file_id}&sz=w1000"
+        return f"https://drive.google.com/thumbnail?id={file_id}&sz=w{width}"
     return url if url.startswith('http') else None
 
+@st.cache_resource
+def get_image_service():
+    # (圖片快取, 圖片服務)；停用時回傳 (None, None)
+    settings = dict(IMAGE_SETTINGS)
+    settings.update(_secret_section("images"))
+    if not settings["enabled"]:
+        return None, None
+    fetch = url_fetcher()
+    if settings["drive_dir"]:
+        fetch = local_drive_fetcher(settings["drive_dir"], fallback=fetch)
+    cache = ImageCache(settings["path"], IMAGE_SIZES, fetch, budget_bytes=int(settings["budget_mb"]) * 2**20)
+    server = None
+    if int(settings["port"]):
+        server = ImageServer(cache, port=int(settings["port"]), public_url=settings["public_url"] or None,
+                             secret=settings["secret"] or None).start()
+    return cache, server
+
+def product_image(url, size="main"):
+    # 商品圖片：有快取時使用本地縮圖 (或圖片服務網址)；尚未快取時先用 Drive 對應尺寸的縮圖，並在背景下載
+    source = convert_drive_url(url, IMAGE_SIZES["main"])
+    if not source:
+        return None
+    try:
+        cache, server = get_image_service()
+        if cache is None:
+            return convert_drive_url(url, IMAGE_SIZES[size])
+        if server is not None:
+            return server.url_for(source, size)
+        cached = cache.cached(source, size)
+        if cached:
+            return cached
+        cache.prefetch(source)
+    except Exception as e:
+        print(f"Image Cache Error: {e}")
+    return convert_drive_url(url, IMAGE_SIZES[size])
+
+LOGISTICS_OPTIONS = ["待處理", "處理中", "已出貨", "已部分出貨", "已完成"]
+PAYMENT_OPTIONS = ["未付款", "已付款"]
+
+def split_status(status_str):
+    # 訂單狀態字串 -> (物流狀態, 金流狀態)
+    status_str = str(status_str)
+    logistics = "待處理"
+    if "已完成" in status_str: logistics = "已完成"
+    elif "已部分出貨" in status_str: logistics = "已部分出貨"
+    elif "已出貨" in status_str: logistics = "已出貨"
+    elif "處理中" in status_str: logistics = "處理中"
+    payment = "已付款" if "已付款" in status_str else "未付款"
+    return logistics, payment
+
+def parse_tracking_table(source):
+    # 貼上的文字或上傳的 CSV -> DataFrame[Order_ID, Tracking_Number]
+    if hasattr(source, "read"):
+        source = source.read()
+    if isinstance(source, bytes):
+        source = source.decode("utf-8-sig")
+    source = str(source or "").strip()
+    if not source:
+        return pd.DataFrame(columns=["Order_ID", "Tracking_Number"])
+    df = pd.read_csv(io.StringIO(source), sep=None, engine="python", header=None, dtype=str, skipinitialspace=True)
+    if df.shape[1] < 2:
+        raise ValueError("每一列需要「訂單編號」與「物流單號」兩個欄位")
+    df = df.iloc[:, :2]
+    df.columns = ["Order_ID", "Tracking_Number"]
+    df = df.dropna().apply(lambda x: x.str.strip())
+    df['Order_ID'] = df['Order_ID'].map(normalize_order_id)
+    df = df[(df['Order_ID'] != "") & (df['Order_ID'] != "ORDER_ID")]
+    return df.drop_duplicates("Order_ID", keep="last").reset_index(drop=True)
+
+def notify_order_updates(order_ids):
+    # 批次更新後，把通知信一起排入寄信佇列
+    store = get_order_store()
+    queued = 0
+    for order_id in order_ids:
+        rec = store.get(order_id)
+        if not rec:
+            continue
+        try:
+            items = json.loads(rec.get('Items_Json') or "{}")
+        except Exception:
+            items = {}
+        if send_order_email(rec, items, is_update=True):
+            queued += 1
+    return queued
+
+def order_sync_label(synced):
+    # 歷史訂單頁顯示訂單是否已寫入 Google Sheet
+    if synced:
+        return "☁️ 已同步"
+    if get_order_sync().last_error:
+        return "⚠️ 訂單已保存，同步暫時失敗，系統會自動重試"
+    return "⏳ 訂單已保存，正在同步…"
+
+def order_status_icon(status_str):
+    status_str = str(status_str)
+    icon = ""
+    if "已完成" in status_str: icon += "✅"
+    elif "已出貨" in status_str: icon += "🚚"
+    elif "處理中" in status_str: icon += "⏳"
+    if "未付款" in status_str: icon += "🔴"
+    elif "已付款" in status_str: icon += "💰"
+    return icon
+
+def filter_orders(orders, query="", logistics=(), payment=(), dealers=(), brands=(), date_from=None, date_to=None, order_items=None):
+    # 依條件過濾訂單 (向量化；品牌條件使用訂單明細表)
+    mask = pd.Series(True, index=orders.index)
+    if query:
+        mask &= orders['Order_ID'].astype(str).str.contains(query.strip(), case=False, regex=False)
+    if logistics or payment:
+        parts = orders['Status'].map(split_status)
+        if logistics: mask &= parts.map(lambda p: p[0] in logistics)
+        if payment: mask &= parts.map(lambda p: p[1] in payment)
+    if dealers:
+        mask &= orders['Customer_Name'].isin(dealers)
+    order_day = orders['Order_Time'].astype(str).str[:10]
+    if date_from is not None:
+        mask &= order_day >= date_from.strftime("%Y-%m-%d")
+    if date_to is not None:
+        mask &= order_day <= date_to.strftime("%Y-%m-%d")
+    if brands:
+        if order_items is None:
+            order_items = get_order_items(orders)
+        mask &= orders['Order_ID'].astype(str).isin(order_items.orders_with_brands(brands))
+    return orders[mask]
+
 def display_status_badges(status_str):
     if pd.isna(status_str): return ""
     badges_html = ""
@@ -332,12 +786,34 @@ def display_status_badges(status_str):
         badges_html += f'<span class="status-badge {css_class}">{p}</span>'
     return badges_html
 
-def send_order_email(order_data, cart_items, is_update=False):
-    SMTP_SERVER = "smtp.gmail.com"
-    SMTP_PORT = 587
-    SENDER_EMAIL = "bluebulous.official@gmail.com"
-    SENDER_PASSWORD = "mjzm yfwj nbxz nefj"
+def _secret_section(name):
+    try:
+        return dict(st.secrets.get(name, {}))
+    except Exception:
+        return {}
 
+def get_related_page_size():
+    try:
+        return max(1, int(st.secrets.get("related_page_size", RELATED_PAGE_SIZE)))
+    except Exception:
+        return RELATED_PAGE_SIZE
+
+@st.cache_resource
+def get_order_id_allocator():
+    # 訂單編號在本機產生 (不需讀取 Orders)：時間 + 主機代號 + 序號
+    settings = dict(ORDER_SETTINGS)
+    settings.update(_secret_section("orders"))
+    return OrderIdAllocator(settings["node_id"] or None)
+
+@st.cache_resource
+def get_outbox():
+    # 全站共用一個寄信佇列與 SMTP 連線
+    settings = dict(SMTP_SETTINGS)
+    settings.update(_secret_section("smtp"))
+    return SmtpOutbox(**settings).start()
+
+def send_order_email(order_data, cart_items, is_update=False):
+    # 只負責組信並放入寄信佇列，實際寄送由背景執行緒處理
     msg = MIMEMultipart()
     msg['From'] = SENDER_EMAIL
     msg['To'] = order_data['Email']
@@ -409,11 +885,7 @@ def send_order_email(order_data, cart_items, is_update=False):
     
     msg.attach(MIMEText(html_content, 'html'))
     try:
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SENDER_EMAIL, SENDER_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        get_outbox().enqueue(msg)
         return True
     except Exception as e:
         print(f"Email Error: {e}") 
@@ -421,6 +893,421 @@ def send_order_email(order_data, cart_items, is_update=False):
 
 # --- 4. 頁面邏輯 ---
 
+def bulk_order_actions(all_orders, page_orders):
+    with st.expander("📋 批次操作 (多筆訂單)"):
+        # 選項只列出目前頁面的訂單 (加上已選取、在其他頁的訂單)，不隨訂單總數增加
+        selected = st.session_state.get('bulk_order_ids', [])
+        shown = page_orders
+        if selected:
+            shown = pd.concat([all_orders[all_orders['Order_ID'].isin(selected)], page_orders]).drop_duplicates('Order_ID')
+        labels = {
+            row['Order_ID']: f"{row['Order_ID']} | {row['Customer_Name']} | {row['Status']}"
+            for row in shown[['Order_ID', 'Customer_Name', 'Status']].to_dict('records')
+        }
+        st.markdown("#### 批次更新狀態")
+        st.caption("可選擇目前頁面的訂單；換頁後已選取的訂單會保留")
+        selected_ids = st.multiselect("選擇訂單", list(labels.keys()), format_func=lambda x: labels.get(x, x), key="bulk_order_ids")
+        keep = "(不變更)"
+        b1, b2, b3 = st.columns([1, 1, 1], vertical_alignment="bottom")
+        bulk_logi = b1.selectbox("物流狀態", [keep] + LOGISTICS_OPTIONS, key="bulk_logi")
+        bulk_pay = b2.selectbox("金流狀態", [keep] + PAYMENT_OPTIONS, key="bulk_pay")
+        bulk_notify = b3.checkbox("寄送通知信", value=True, key="bulk_notify")
+
+        if st.button("💾 套用到選取的訂單", type="primary", disabled=not selected_ids, key="bulk_apply"):
+            if bulk_logi == keep and bulk_pay == keep:
+                st.warning("請選擇要變更的狀態")
+            else:
+                def new_status(rec):
+                    # 依寫入當下的最新狀態計算 (只替換選擇的那一半)
+                    logi, pay = split_status(rec.get('Status', ""))
+                    if bulk_logi != keep: logi = bulk_logi
+                    if bulk_pay != keep: pay = bulk_pay
+                    return {'Status': f"{logi}, {pay}"}
+                updates = {order_id: new_status for order_id in selected_ids}
+                try:
+                    updated = patch_orders(updates)
+                    st.success(f"已更新 {len(updated)} 筆訂單")
+                    if bulk_notify and updated:
+                        st.toast(f"{notify_order_updates(updated)} 封通知信已排入寄送佇列", icon="📧")
+                    time.sleep(1)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"批次更新失敗: {e}")
+
+        st.divider()
+        st.markdown("#### 匯入物流單號")
+        st.caption("每列一筆：訂單編號, 物流單號 (可直接從 Excel 貼上，或上傳 CSV)")
+        t1, t2 = st.columns([1, 1])
+        pasted = t1.text_area("貼上資料", height=120, key="bulk_track_text")
+        uploaded = t2.file_uploader("上傳 CSV", type=["csv", "txt"], key="bulk_track_file")
+        mark_shipped = st.checkbox("同時將物流狀態設為「已出貨」", value=True, key="bulk_track_ship")
+        try:
+            track_df = parse_tracking_table(uploaded if uploaded is not None else pasted)
+        except Exception as e:
+            track_df = None
+            st.error(f"資料格式錯誤: {e}")
+
+        if track_df is not None and not track_df.empty:
+            # 以全部訂單比對 (不是目前頁面的選項)，其他頁的訂單也能匯入
+            known = set(all_orders['Order_ID'])
+            unknown = track_df[~track_df['Order_ID'].isin(known)]
+            track_df = track_df[track_df['Order_ID'].isin(known)]
+            if not unknown.empty:
+                st.warning(f"找不到以下訂單，將略過: {', '.join(unknown['Order_ID'])}")
+            st.dataframe(track_df, use_container_width=True, hide_index=True)
+            if st.button(f"💾 匯入 {len(track_df)} 筆物流單號", type="primary", disabled=track_df.empty, key="bulk_track_apply"):
+                def with_tracking(tracking):
+                    def change(rec):
+                        fields = {'Tracking_Number': tracking}
+                        if mark_shipped:
+                            logi, pay = split_status(rec.get('Status', ""))
+                            if logi not in ("已完成", "已部分出貨"): logi = "已出貨"
+                            fields['Status'] = f"{logi}, {pay}"
+                        return fields
+                    return change
+                updates = {order_id: with_tracking(tracking) for order_id, tracking in zip(track_df['Order_ID'], track_df['Tracking_Number'])}
+                try:
+                    updated = patch_orders(updates)
+                    st.success(f"已匯入 {len(updated)} 筆物流單號")
+                    if bulk_notify and updated:
+                        st.toast(f"{notify_order_updates(updated)} 封通知信已排入寄送佇列", icon="📧")
+                    time.sleep(1)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"匯入失敗: {e}")
+
+def paginate(df, key, page_sizes=(10, 20, 50, 100)):
+    # 分頁控制，回傳目前頁面的資料
+    if df.empty:
+        return df
+    p1, p2, p3 = st.columns([1, 1, 2], vertical_alignment="bottom")
+    page_size = p1.selectbox("每頁筆數", page_sizes, index=1 if len(page_sizes) > 1 else 0, key=f"{key}_page_size")
+    n_pages = max(1, -(-len(df) // page_size))
+    page = p2.number_input("頁數", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_page")
+    page = min(int(page), n_pages)
+    p3.caption(f"第 {page} / {n_pages} 頁，共 {len(df)} 筆")
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size]
+
+def tile_image(src):
+    if not src:
+        st.markdown("<div style='height: 150px; background-color: #f0f0f0; display: flex; align-items: center; justify-content: center; color: #666;'>No Image</div>", unsafe_allow_html=True)
+    elif src.startswith("http"):
+        # 網址圖片交給瀏覽器延遲載入 (畫面外的先顯示佔位框)
+        st.markdown(f"<div class='tile-img'><img src='{html.escape(src)}' loading='lazy' decoding='async'></div>", unsafe_allow_html=True)
+    else:
+        st.image(src, use_container_width=True)
+
+def _set_related_page(page):
+    st.session_state.related_page = page
+
+def related_products_grid(catalog, names, category, page_size=None):
+    # 同系列商品分頁顯示：每次只產生一頁的圖片與按鈕，重跑成本與分類大小無關
+    if not names:
+        return
+    page_size = page_size or get_related_page_size()
+    if st.session_state.get('related_category') != category:
+        st.session_state.related_category = category
+        st.session_state.related_page = 0
+    n_pages = -(-len(names) // page_size)
+    page = min(st.session_state.get('related_page', 0), n_pages - 1)
+    page_names = names[page * page_size:(page + 1) * page_size]
+    for i in range(0, len(page_names), 3):
+        cols = st.columns(3)
+        for idx, other_prod in enumerate(page_names[i:i+3]):
+            row = catalog.first_row(other_prod)
+            with cols[idx]:
+                with st.container(border=True):
+                    tile_image(product_image(row['Image_URL'], "tile"))
+                    if st.button(f" {other_prod}", key=f"view_{other_prod}", use_container_width=True):
+                        st.session_state.current_product_name = other_prod
+                        st.rerun()
+    if n_pages > 1:
+        c1, c2, c3 = st.columns([1, 2, 1], vertical_alignment="center")
+        c1.button("◀", key="related_prev", disabled=page == 0, use_container_width=True,
+                  on_click=_set_related_page, args=(page - 1,))
+        c2.caption(f"第 {page + 1} / {n_pages} 頁，共 {len(names)} 項")
+        c3.button("▶", key="related_next", disabled=page >= n_pages - 1, use_container_width=True,
+                  on_click=_set_related_page, args=(page + 1,))
+
+def order_filters(orders, order_items=None):
+    with st.expander("🔍 篩選訂單", expanded=True):
+        f1, f2, f3 = st.columns(3)
+        query = f1.text_input("訂單編號搜尋", key="order_filter_query")
+        logistics = f2.multiselect("物流狀態", LOGISTICS_OPTIONS, key="order_filter_logi")
+        payment = f3.multiselect("金流狀態", PAYMENT_OPTIONS, key="order_filter_pay")
+        f4, f5, f6 = st.columns(3)
+        dealers = f4.multiselect("經銷商", sorted(orders['Customer_Name'].dropna().astype(str).unique()), key="order_filter_dealer")
+        try:
+            brand_options = sorted(get_catalog_index().df['Brand'].dropna().astype(str).unique())
+        except Exception:
+            brand_options = []
+        brands = f5.multiselect("品牌", brand_options, key="order_filter_brand")
+        dates = f6.date_input("訂單日期區間", value=(), key="order_filter_dates")
+    date_from = dates[0] if len(dates) > 0 else None
+    date_to = dates[1] if len(dates) > 1 else date_from
+    return filter_orders(orders, query, logistics, payment, dealers, brands, date_from, date_to, order_items)
+
+def _rerun_cart(*extra):
+    # 購物車變動：只重繪購物車與側邊欄數量 (不重新執行整頁)
+    st.rerun(["cart", "cart_badge", *extra])
+
+def _add_to_cart(p_id, p_name, p_spec, p_w, p_r, q_key, p_brand):
+    qty = st.session_state[q_key]
+    if qty <= 0: return
+    if p_id in st.session_state.cart:
+        st.session_state.cart[p_id]['qty'] += qty
+    else:
+        st.session_state.cart[p_id] = {
+            "id": p_id, "name": p_name, "spec": p_spec,
+            "wholesale_price": int(p_w), "retail_price": int(p_r),
+            "brand": p_brand, "qty": qty
+        }
+    st.toast(f"已加入 {p_name} x {qty}", icon="🛒")
+    st.session_state[q_key] = 1
+    _rerun_cart("variants")
+
+def _set_cart_qty(item_id):
+    new_val = st.session_state[f"cart_qty_{item_id}"]
+    if item_id in st.session_state.cart:
+        st.session_state.cart[item_id]['qty'] = new_val
+    _rerun_cart()
+
+def _remove_from_cart(item_id):
+    st.session_state.cart.pop(item_id, None)
+    _rerun_cart()
+
+def _color_changed():
+    st.session_state.color_changed = True
+
+@st.fragment(key="cart_badge")
+def cart_badge():
+    # 側邊欄的購物車數量
+    if st.session_state.cart:
+        total_qty = sum(item['qty'] for item in st.session_state.cart.values())
+        st.info(f"🛒 購物車內有 {total_qty} 件商品")
+        if st.button("前往結帳 (查看詳情)", type="primary", use_container_width=True):
+             st.toast("請往下滑動查看完整購物車", icon="👇")
+    else:
+        st.caption("🛒 購物車是空的")
+
+@st.fragment(key="variants")
+def variant_selector(catalog, current_name):
+    # 商品規格選擇 (選尺寸數量、加入購物車只重繪這一塊與購物車)
+    brand = catalog.variants(current_name).iloc[0]['Brand']
+    with st.container(border=True):
+        st.markdown(f"<div style='font-size: 20px; font-weight: bold; margin-bottom: 10px;'>{current_name}</div>", unsafe_allow_html=True)
+        st.caption(f"Brand: {brand}")
+        st.markdown("---")
+        available_colors = catalog.colors(current_name)
+        selected_color = st.selectbox("顏色", available_colors, key=f"color_sel_{current_name}", on_change=_color_changed)
+        if st.session_state.pop('color_changed', False):
+            st.rerun() # 主圖跟著顏色換：整頁重新執行
+        variants = catalog.sizes(current_name, selected_color)
+        st.markdown("<br>", unsafe_allow_html=True)
+        h1, h2, h3, h4, h5 = st.columns([1.2, 2.2, 1.5, 1.5, 1.5], vertical_alignment="center")
+        h1.markdown("**尺寸**")
+        h2.markdown("**數量**")
+        h3.markdown("**批發價**\n(未稅)")
+        h4.markdown("**零售價**\n(含稅)")
+        h5.markdown("") 
+
+        for i, (_, sku) in enumerate(variants.iterrows()):
+            c_row = st.container()
+            c1, c2, c3, c4, c5 = c_row.columns([1.2, 2.2, 1.5, 1.5, 1.5], vertical_alignment="center")
+            with c1: st.markdown(f"<div style='font-weight:bold;'>{str(sku['Size'])}</div>", unsafe_allow_html=True)
+            with c2:
+                qty_key = f"qty_input_{sku['Product_ID']}_{selected_color}_{i}"
+                st.number_input("Qty", min_value=1, value=1, step=1, key=qty_key, label_visibility="collapsed")
+            with c3: st.markdown(f"<div style='color:#ff5500; font-weight:bold;'>${int(sku['Wholesale_Price'])}</div>", unsafe_allow_html=True)
+            with c4: st.markdown(f"<div style='color:#666;'>${int(sku['Retail_Price'])}</div>", unsafe_allow_html=True)
+            with c5:
+                st.button("ADD", key=f"add_{sku['Product_ID']}_{selected_color}_{i}", type="primary", use_container_width=True,
+                    on_click=_add_to_cart,
+                    args=(sku['Product_ID'], current_name, f"{selected_color} / {str(sku['Size'])}", sku['Wholesale_Price'], sku['Retail_Price'], qty_key, brand))
+
+@st.fragment(key="cart")
+def cart_panel(user):
+    # 購物車欄位 (修改數量、移除、結帳)；購物車操作只重繪這一塊與側邊欄數量
+    with st.container(border=True):
+        st.markdown("<h3 style='font-size: 20px; font-weight: bold;'>🛒 購物車</h3>", unsafe_allow_html=True)
+        st.divider()
+        if st.session_state.cart:
+            BRAND_RULES, _ = get_brand_rules()
+            # 計價 (每次重算，比快取查詢便宜)
+            with perf_section("shop.cart_pricing"):
+                quote = get_pricing_engine().quote(st.session_state.cart, BRAND_RULES)
+
+            for data in quote['brands']:
+                b_name = data['brand']
+                d_rate = data['discount_rate']
+                w_threshold = data['wholesale_threshold']
+
+                if data['is_wholesale_qualified']:
+                    msg = f"**{b_name}** | 小計 ${data['raw_wholesale_total']} (已達門檻 ${w_threshold}) ➝ **批發價**"
+                    if data['is_shipping_qualified']: msg += " | 🚚 免運"
+                    st.success(msg, icon="✅")
+                else:
+                    msg = f"**{b_name}** | 小計 ${data['raw_wholesale_total']} (未達門檻 ${w_threshold}) ➝ **零售{int(d_rate*10)}折**"
+                    if data['is_shipping_qualified']: msg += " | 🚚 免運"
+                    st.warning(msg, icon="⚠️")
+
+                for item in data['items']:
+                    # [關鍵修正] 使用 [2.5, 1.5, 0.5, 1.2] 的比例，確保有足夠空間顯示按鈕
+                    c_name, c_qty, c_del, c_price = st.columns([2.5, 1.5, 0.5, 1.2], vertical_alignment="center")
+
+                    with c_name:
+                        # Product Name and Spec (Color/Size)
+                        st.markdown(f"<div style='line-height:1.2; font-weight:bold;'>{item['name']}</div><div style='color:#cccccc; font-size:12px; margin-top:2px;'>{item['spec']}</div>", unsafe_allow_html=True)
+
+                    with c_qty:
+                        # 這裡的寬度現在夠大了，按鈕應該會出現
+                        st.number_input(
+                            "Qty",
+                            min_value=1,
+                            value=int(item['qty']),
+                            step=1,
+                            key=f"cart_qty_{item['id']}",
+                            label_visibility="collapsed",
+                            on_change=_set_cart_qty,
+                            args=(item['id'],)
+                        )
+
+                    with c_del:
+                        # Delete Button
+                        st.button("✖", key=f"cart_del_{item['id']}", type="secondary", help="移除此商品",
+                            on_click=_remove_from_cart, args=(item['id'],))
+
+                    with c_price:
+                        # Price
+                        st.markdown(f"<div style='text-align:right; font-weight:bold;'>${item['final_subtotal']}</div>", unsafe_allow_html=True)
+                st.divider()
+
+            is_order_free_shipping = quote['free_shipping']
+            grand_total_subtotal = quote['subtotal']
+            grand_total_tax = quote['tax']
+            shipping = quote['shipping']
+            grand_total = quote['total']
+            if is_order_free_shipping:
+                shipping_msg = "✅ 符合免運資格"
+            else:
+                shipping_msg = f"運費 ${SHIPPING_FEE}"
+
+            r1, r2 = st.columns(2)
+            r1.text("小計 (Subtotal)")
+            r2.text(f"${grand_total_subtotal}")
+            r1.text("稅金 (Tax)")
+            r2.text(f"${grand_total_tax}")
+            r1.text("運費 (Shipping)")
+            r2.text(shipping_msg)
+            r1.markdown("#### 總計(含稅)")
+            r2.markdown(f"#### ${grand_total}")
+
+            if is_order_free_shipping: st.info("🎉 訂單已享免運優惠！")
+            else: st.warning(f"⚠️ 全單未達免運標準，需付運費 ${SHIPPING_FEE}")
+
+            is_editing = st.session_state.get('editing_order_id') is not None
+            if is_editing:
+                btn_text = "💾 確認修改並儲存 (Admin Update)"
+                client_name = st.session_state.get('editing_customer_info', {}).get('Customer_Name', 'Unknown')
+                st.warning(f"🔧 正在修改客戶 [{client_name}] 的訂單：{st.session_state.editing_order_id}")
+            else: 
+                # 結帳前 Email 輸入框
+                st.markdown("---")
+
+                default_checkout_email = str(user.get('Contact_Email', '')).replace('nan', '')
+                if not default_checkout_email and "@" in str(user['Username']):
+                    default_checkout_email = user['Username']
+
+                contact_email_input = st.text_input("📧 接收訂單通知 Email (必填)", value=default_checkout_email, help="訂單確認信將寄送至此信箱")
+
+                btn_text = "CHECKOUT / 送出訂單"
+
+            # 按鈕啟用邏輯
+            disable_btn = (not is_editing) and (not contact_email_input)
+
+            # 送出時發現價格規則已更新：顯示新的金額，讓經銷商確認後再送出
+            price_notice = st.session_state.pop('price_notice', None)
+            if price_notice: st.warning(price_notice)
+            # 按下按鈕的這次重跑會先以目前的快照重算金額；比對的是上一次畫面上顯示給經銷商的總計
+            seen_total = st.session_state.get('cart_seen_total', grand_total)
+            st.session_state.cart_seen_total = grand_total
+
+            if st.button(btn_text, type="primary", use_container_width=True, disabled=disable_btn):
+                # 送出前在伺服器端以目前的規則快照重新計價，同時在背景重新讀取 BrandRules (不在結帳時等待 Sheet)
+                latest_rules, _ = get_brand_rules()
+                checked = get_pricing_engine().verify(st.session_state.cart, latest_rules)
+                refresh_snapshot_later("BrandRules", min_interval=5)
+                if checked['total'] != seen_total:
+                    # 金額與畫面上的不同：不送出，保留購物車，重新顯示新的金額
+                    st.session_state.price_notice = (
+                        f"⚠️ 價格規則已更新，訂單金額已重新計算：小計 ${checked['subtotal']}、稅金 ${checked['tax']}、"
+                        f"運費 ${checked['shipping']}，總計 ${checked['total']} (原為 ${seen_total})。請確認後再次送出"
+                    )
+                    st.rerun()
+                if is_editing:
+                    order_id = st.session_state.editing_order_id
+                    saved_info = st.session_state.get('editing_customer_info', {})
+                    c_name = saved_info.get('Customer_Name', user['Dealer_Name'])
+                    c_email = saved_info.get('Email', user['Username']) # Edit mode uses old email
+                    c_phone = saved_info.get('Phone', user['Phone'])
+                    c_status = "賣方已修改"
+                else:
+                    order_id = get_order_id_allocator().next()
+                    c_name = user['Dealer_Name']
+                    c_email = contact_email_input # Use input email
+                    c_phone = user['Phone']
+                    c_status = "待處理"
+
+                    # 自動更新使用者 Email
+                    try:
+                        if c_email != str(user.get('Contact_Email', '')):
+                            if update_user(user['Username'], {'Contact_Email': c_email}, wait=False):
+                                st.session_state['user']['Contact_Email'] = c_email
+                    except: pass 
+
+                grand_total_subtotal, grand_total_tax = checked['subtotal'], checked['tax']
+                shipping, grand_total = checked['shipping'], checked['total']
+                final_cart_data = priced_items(checked)
+                order_data = {
+                    "Order_ID": order_id, "Order_Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "Customer_Name": c_name, "Email": c_email, "Phone": c_phone,
+                    "Items_Json": json.dumps(final_cart_data, ensure_ascii=False),
+                    "Subtotal": grand_total_subtotal, "Tax": grand_total_tax, 
+                    "Shipping": shipping, "Total": grand_total, "Status": c_status,
+                    "Extra_Discount": 0 
+                }
+                if 'Tracking_Number' not in order_data: order_data['Tracking_Number'] = ""
+                if 'Admin_Note' not in order_data: order_data['Admin_Note'] = ""
+
+                # 訂單只寫入本地資料庫就回應；Sheet 同步與寄信都在背景進行
+                try:
+                    if is_editing:
+                        # 修改品項不動物流單號與備註 (保留管理員最新的內容)
+                        edit_fields = {k: v for k, v in order_data.items() if k not in ('Tracking_Number', 'Admin_Note')}
+                        if not patch_order(order_id, edit_fields):
+                            st.error("找不到原始訂單")
+                            st.stop()
+                        st.session_state.checkout_notice = f"訂單 {order_id} 修改完成！"
+                        if send_order_email(order_data, final_cart_data, is_update=True):
+                            st.toast("📧 通知信已排入寄送佇列", icon="✅")
+                        else: st.toast("信件寄送失敗", icon="⚠️")
+                    else:
+                        save_order(order_data)
+                        st.session_state.checkout_notice = f"訂單 {order_id} 已送出！可在「歷史訂單」查看同步狀態"
+                        if send_order_email(order_data, final_cart_data):
+                            st.toast("📧 確認信已排入寄送佇列", icon="✅")
+                        else: st.toast("訂單已成立，但信件寄送失敗", icon="⚠️")
+
+                    st.session_state.cart = {}
+                    st.session_state.editing_order_id = None
+                    st.session_state.editing_customer_info = None
+                    if user['Username'] in ADMIN_USERS: st.session_state.page = 'admin_orders'
+                    else: st.session_state.page = 'shop'
+                    st.rerun()
+                except Exception as e: st.error(f"訂單處理失敗: {e}")
+        else: st.info("購物車是空的")
+
 def main_app(user):
     if 'cart' not in st.session_state: st.session_state.cart = {}
     if 'page' not in st.session_state: st.session_state.page = 'shop'
@@ -433,27 +1320,27 @@ def main_app(user):
         st.info(f"📢 **公告：** {announcement}", icon="📢")
 
     try:
-        df_products = get_products_data()
-        
-        if df_products.empty:
-            st.error("無法載入產品資料，請檢查 Google Sheet 連線或稍後再試。")
-            return
+        with perf_section("shop.load_catalog"):
+            catalog = get_catalog_index()
+        df_products = catalog.df
+    except Exception as e:
+        st.error(f"無法載入產品資料，請檢查 Google Sheet 連線或稍後再試。 ({e})")
+        return
 
-        if 'Wholesale_Price' in df_products.columns:
-            df_products['Wholesale_Price'] = pd.to_numeric(df_products['Wholesale_Price'], errors='coerce').fillna(0)
-        else:
-            st.error("錯誤：找不到 'Wholesale_Price' 欄位，請檢查 Google Sheet 標題列是否正確。")
+    try:
+        missing_cols = missing_required(df_products, "Products")
+        if missing_cols:
+            st.error(f"錯誤：找不到 {missing_cols} 欄位，請檢查 Google Sheet 標題列是否正確。")
             st.write("目前欄位:", df_products.columns.tolist())
             return
-
-        if 'Retail_Price' in df_products.columns:
-            df_products['Retail_Price'] = pd.to_numeric(df_products['Retail_Price'], errors='coerce').fillna(0)
-        
-        allowed_brands_str = str(user.get('Allowed_Brands', ''))
-        if pd.notna(allowed_brands_str) and allowed_brands_str.strip() != "" and allowed_brands_str.lower() != "nan":
-            allowed_list = [b.strip() for b in allowed_brands_str.split(',') if b.strip()]
-            if allowed_list and "All" not in allowed_list:
-                df_products = df_products[df_products['Brand'].isin(allowed_list)]
+        skipped_rows = df_products.attrs.get("invalid_rows")
+        if skipped_rows and user['Username'] in ADMIN_USERS:
+            st.warning(f"⚠️ Products 有 {len(skipped_rows)} 個價格不是整數，這些商品暫不顯示，請修正 Sheet: {'; '.join(skipped_rows[:5])}")
+
+        # 相同權限的經銷商共用同一份已過濾的目錄
+        allowed_brands = parse_allowed_brands(user.get('Allowed_Brands', ''))
+        with perf_section("shop.permission_filter"):
+            df_products = catalog.view(allowed_brands)
                 
     except Exception as e:
         st.error(f"處理產品資料時發生錯誤: {e}")
@@ -467,10 +1354,8 @@ def main_app(user):
                 st.rerun()
         return
 
-    if 'current_product_name' not in st.session_state:
-        st.session_state.current_product_name = df_products['Name'].unique()[0]
-    elif st.session_state.current_product_name not in df_products['Name'].unique():
-        st.session_state.current_product_name = df_products['Name'].unique()[0]
+    if not catalog.has(st.session_state.get('current_product_name'), allowed_brands):
+        st.session_state.current_product_name = df_products['Name'].iloc[0]
 
     with st.sidebar:
         logo_url = "https://raw.githubusercontent.com/Bluebulous/product-images/main/LOGO-white-01.png"
@@ -481,21 +1366,19 @@ def main_app(user):
         st.caption(f"單位: {user['Dealer_Name']}")
         st.divider()
         
-        if st.session_state.cart:
-            total_qty = sum(item['qty'] for item in st.session_state.cart.values())
-            st.info(f"🛒 購物車內有 {total_qty} 件商品")
-            if st.button("前往結帳 (查看詳情)", type="primary", use_container_width=True):
-                 st.toast("請往下滑動查看完整購物車", icon="👇")
-        else:
-            st.caption("🛒 購物車是空的")
+        cart_badge()
             
         st.divider()
         
         if st.button("🔄 重整產品資料", use_container_width=True):
-            st.cache_data.clear()
-            st.toast("資料已更新！正在重新載入...", icon="🔄")
-            time.sleep(1)
-            st.rerun()
+            # 只檢查產品相關的資料集，內容沒變就不重建 (30 秒內剛確認過的直接略過)
+            changed = [name for name in ("Products", "BrandRules", "Announcements") if refresh_snapshot(name, min_interval=30)]
+            if changed:
+                st.toast(f"資料已更新 ({', '.join(changed)})，正在重新載入...", icon="🔄")
+                time.sleep(1)
+                st.rerun()
+            else:
+                st.toast("資料已是最新", icon="✅")
 
         if st.button("開始訂購", use_container_width=True):
             st.session_state.page = 'shop'
@@ -520,13 +1403,16 @@ def main_app(user):
         if st.session_state.page == 'shop':
             st.divider()
             st.markdown('<div class="nav-section-title">FOR DOGS</div>', unsafe_allow_html=True)
-            categories = list(df_products['Category'].unique())
+            categories = catalog.category_list(allowed_brands)
             selected_cat = st.radio("Category", categories, label_visibility="collapsed")
-            df_filtered = df_products[df_products['Category'] == selected_cat]
-            product_list = df_filtered['Name'].unique()
+            product_list = catalog.category_names(selected_cat, allowed_brands)
             if st.session_state.current_product_name not in product_list and len(product_list) > 0:
                 st.session_state.current_product_name = product_list[0]
     
+    # 結帳後的確認訊息 (訂單已寫入本地，背景同步)
+    notice = st.session_state.pop('checkout_notice', None)
+    if notice: st.success(notice)
+
     # 1. 歷史訂單頁
     if st.session_state.page == 'history':
         st.title("歷史訂單")
@@ -539,20 +1425,20 @@ def main_app(user):
                 orders['Extra_Discount'] = pd.to_numeric(orders['Extra_Discount'], errors='coerce').fillna(0).astype(int)
 
                 my_orders = orders[orders['Email'] == user['Username']].sort_values("Order_Time", ascending=False)
+                order_items = get_order_items(orders)
+                sync_states = get_order_store().sync_states(my_orders['Order_ID'])
                 
                 if not my_orders.empty:
                     for index, row in my_orders.iterrows():
                         status_str = str(row['Status'])
-                        status_icon = ""
-                        if "已完成" in status_str: status_icon = "✅"
-                        elif "已出貨" in status_str: status_icon = "🚚"
-                        elif "處理中" in status_str: status_icon = "⏳"
-                        if "未付款" in status_str: status_icon += "🔴"
-                        elif "已付款" in status_str: status_icon += "💰"
+                        status_icon = order_status_icon(status_str)
 
                         expander_title = f"{status_icon} {status_str} | {row['Order_Time']} | ${row['Total']}"
+                        synced = sync_states.get(str(row['Order_ID']), True)
+                        if not synced: expander_title += " | ⏳ 同步中"
                         with st.expander(expander_title):
                             st.markdown(f"### 狀態: {display_status_badges(row['Status'])}", unsafe_allow_html=True)
+                            st.caption(order_sync_label(synced))
                             st.divider()
                             c1, c2 = st.columns([1, 1])
                             with c1:
@@ -569,12 +1455,12 @@ def main_app(user):
                                     st.warning(f"📝 **賣家備註:** {row['Admin_Note']}")
                             with c2:
                                 st.markdown("**訂購內容:**")
-                                try:
-                                    items = json.loads(row['Items_Json'])
-                                    for item in items.values():
-                                        st.text(f"• {item['name']} ({item['spec']}) x{item['qty']}")
-                                except:
+                                items = order_items.for_order(row['Order_ID'])
+                                if items is None:
                                     st.error("內容讀取失敗")
+                                else:
+                                    for item in items:
+                                        st.text(f"• {item['Name']} ({item['Spec']}) x{item['Qty']}")
                 else:
                     st.info("目前沒有訂單紀錄")
             except Exception as e:
@@ -599,15 +1485,7 @@ def main_app(user):
                 
                 if st.form_submit_button("更新 Email 設定", type="primary"):
                     try:
-                        users_df = get_data("Users")
-                        if 'Contact_Email' not in users_df.columns:
-                            users_df['Contact_Email'] = ""
-                        
-                        user_idx = users_df[users_df['Username'] == user['Username']].index
-                        if not user_idx.empty:
-                            idx = user_idx[0]
-                            users_df.at[idx, 'Contact_Email'] = new_contact_email
-                            update_data("Users", users_df)
+                        if update_user(user['Username'], {'Contact_Email': new_contact_email}):
                             st.session_state['user']['Contact_Email'] = new_contact_email
                             st.success("✅ Email 設定已更新！")
                             time.sleep(1)
@@ -625,7 +1503,7 @@ def main_app(user):
                 new_pwd = st.text_input("新密碼", type="password")
                 confirm_pwd = st.text_input("確認新密碼", type="password")
                 if st.form_submit_button("更新密碼", type="primary", use_container_width=True):
-                    if str(current_pwd) != str(user['Password']):
+                    if not get_user_directory().verify(user['Username'], current_pwd):
                         st.error("❌ 目前密碼輸入錯誤")
                     elif new_pwd != confirm_pwd:
                         st.error("❌ 兩次新密碼輸入不一致")
@@ -633,13 +1511,8 @@ def main_app(user):
                         st.error("❌ 新密碼不得為空")
                     else:
                         try:
-                            users_df = get_data("Users")
-                            user_index = users_df[users_df['Username'] == user['Username']].index
-                            if not user_index.empty:
-                                idx = user_index[0]
-                                users_df.at[idx, 'Password'] = new_pwd
-                                update_data("Users", users_df)
-                                st.session_state['user']['Password'] = new_pwd
+                            # 新密碼以雜湊保存
+                            if update_user(user['Username'], {'Password': new_pwd}):
                                 st.success("✅ 密碼修改成功！")
                             else: st.error("❌ 找不到使用者資料")
                         except Exception as e: st.error(f"❌ 更新失敗: {e}")
@@ -654,10 +1527,12 @@ def main_app(user):
             return
 
         st.title("🔧 管理員後台")
-        # [修改] 新增第五個 Tab: 公告管理
-        tab1, tab2, tab3, tab4, tab5 = st.tabs(["📦 訂單管理", "⚙️ 品牌門檻設定", "👥 用戶權限管理", "📊 銷售數據中心", "📢 公告管理"])
+        st.caption(f"📡 資料快照：{snapshot_status()}")
+        st.caption(f"📝 寫入佇列：{write_queue_status()}")
+        # [修改] 新增第五個 Tab: 公告管理；第六個 Tab: 效能
+        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📦 訂單管理", "⚙️ 品牌門檻設定", "👥 用戶權限管理", "📊 銷售數據中心", "📢 公告管理", "⏱️ 效能"])
         
-        with tab1:
+        with tab1, perf_section("admin.orders"):
             with st.container(border=True):
                 try:
                     orders = get_data("Orders")
@@ -669,21 +1544,42 @@ def main_app(user):
                     if not orders.empty:
                         all_orders = orders.sort_values("Order_Time", ascending=False)
                         st.markdown(f"共 {len(all_orders)} 筆訂單")
+                        order_items = get_order_items(orders)
+                        if not order_items.errors.empty:
+                            with st.expander(f"⚠️ {len(order_items.errors)} 筆訂單的內容 (Items_Json) 無法解析"):
+                                st.dataframe(order_items.errors, use_container_width=True, hide_index=True)
+                        bulk_box = st.container()
+                        st.divider()
+
+                        # 篩選 + 分頁：只渲染目前頁面的訂單
+                        filtered_orders = order_filters(all_orders, order_items)
+                        page_orders = paginate(filtered_orders, key="admin_orders")
+                        with bulk_box:
+                            bulk_order_actions(all_orders, page_orders)
+                        if filtered_orders.empty: st.info("沒有符合條件的訂單")
                         
-                        for index, row in all_orders.iterrows():
+                        for row in page_orders.to_dict('records'):
                             status_str = str(row['Status'])
-                            status_icon = ""
-                            if "已完成" in status_str: status_icon += "✅"
-                            elif "已出貨" in status_str: status_icon += "🚚"
-                            elif "處理中" in status_str: status_icon += "⏳"
-                            if "未付款" in status_str: status_icon += "🔴"
-                            elif "已付款" in status_str: status_icon += "💰"
+                            status_icon = order_status_icon(status_str)
+                            expander_title = f"{status_icon} {status_str} | {row['Order_Time']} | {row['Customer_Name']} (${row['Total']})"
+
+                            # 只有正在編輯的訂單才建立完整的編輯表單
+                            if st.session_state.get('admin_open_order') != row['Order_ID']:
+                                r1, r2 = st.columns([6, 1], vertical_alignment="center")
+                                r1.markdown(f"{expander_title} · `{row['Order_ID']}`")
+                                if r2.button("開啟", key=f"open_{row['Order_ID']}", use_container_width=True):
+                                    st.session_state.admin_open_order = row['Order_ID']
+                                    st.rerun()
+                                continue
 
                             status_badges = display_status_badges(row['Status'])
-                            expander_title = f"{status_icon} {status_str} | {row['Order_Time']} | {row['Customer_Name']} (${row['Total']})"
                             
-                            with st.expander(expander_title):
-                                st.markdown(f"### 目前狀態: {status_badges}", unsafe_allow_html=True)
+                            with st.expander(expander_title, expanded=True):
+                                h1, h2 = st.columns([6, 1], vertical_alignment="center")
+                                h1.markdown(f"### 目前狀態: {status_badges}", unsafe_allow_html=True)
+                                if h2.button("收合", key=f"close_{row['Order_ID']}", use_container_width=True):
+                                    st.session_state.admin_open_order = None
+                                    st.rerun()
                                 
                                 c1, c2, c3 = st.columns([1.5, 2, 1])
                                 with c1:
@@ -692,11 +1588,11 @@ def main_app(user):
                                     st.markdown(f"**Email:** {row['Email']}")
                                 with c2:
                                     st.markdown("**訂購內容:**")
-                                    try:
-                                        items = json.loads(row['Items_Json'])
-                                        for item in items.values():
-                                            st.text(f"• {item['name']} ({item['spec']}) x{item['qty']}")
-                                    except: st.error("JSON 解析失敗")
+                                    items = order_items.for_order(row['Order_ID'])
+                                    if items is None: st.error("JSON 解析失敗")
+                                    else:
+                                        for item in items:
+                                            st.text(f"• {item['Name']} ({item['Spec']}) x{item['Qty']}")
                                 with c3:
                                     st.markdown(f"**小計:** ${row['Subtotal']}")
                                     st.markdown(f"**稅金:** ${row['Tax']}")
@@ -725,20 +1621,15 @@ def main_app(user):
                                 logi_key = f"logi_{row['Order_ID']}"
                                 pay_key = f"pay_{row['Order_ID']}"
                                 
-                                current_status = str(row['Status'])
-                                default_logi_idx = 0
-                                if "已完成" in current_status: default_logi_idx = 4
-                                elif "已部分出貨" in current_status: default_logi_idx = 3
-                                elif "已出貨" in current_status: default_logi_idx = 2
-                                elif "處理中" in current_status: default_logi_idx = 1
-                                
-                                default_pay_idx = 1 if "已付款" in current_status else 0
+                                current_logi, current_pay = split_status(row['Status'])
+                                default_logi_idx = LOGISTICS_OPTIONS.index(current_logi)
+                                default_pay_idx = PAYMENT_OPTIONS.index(current_pay)
 
                                 col_s1, col_s2 = st.columns(2)
                                 with col_s1:
-                                    new_logistics = st.selectbox("物流狀態", ["待處理", "處理中", "已出貨", "已部分出貨", "已完成"], index=default_logi_idx, key=logi_key)
+                                    new_logistics = st.selectbox("物流狀態", LOGISTICS_OPTIONS, index=default_logi_idx, key=logi_key)
                                 with col_s2:
-                                    new_payment = st.selectbox("金流狀態", ["未付款", "已付款"], index=default_pay_idx, key=pay_key)
+                                    new_payment = st.selectbox("金流狀態", PAYMENT_OPTIONS, index=default_pay_idx, key=pay_key)
 
                                 ic1, ic2, ic3 = st.columns([2, 3, 1.5], vertical_alignment="bottom")
                                 new_track = ic1.text_input("物流單號", value=str(row['Tracking_Number']) if pd.notna(row['Tracking_Number']) else "", key=track_key)
@@ -753,35 +1644,29 @@ def main_app(user):
                                         
                                         final_status_str = ", ".join(final_status_list)
 
-                                        df_curr = get_data("Orders")
-                                        t_idx = df_curr[df_curr['Order_ID'] == row['Order_ID']].index
-                                        if not t_idx.empty:
-                                            idx = t_idx[0]
-                                            df_curr.at[idx, 'Status'] = final_status_str
-                                            df_curr.at[idx, 'Tracking_Number'] = new_track
-                                            df_curr.at[idx, 'Admin_Note'] = new_note
-                                            df_curr.at[idx, 'Extra_Discount'] = new_discount
-                                            
-                                            org_sub = df_curr.at[idx, 'Subtotal']
-                                            org_tax = df_curr.at[idx, 'Tax']
-                                            org_ship = df_curr.at[idx, 'Shipping']
-                                            new_total = org_sub + org_tax + org_ship - new_discount
-                                            df_curr.at[idx, 'Total'] = new_total
-                                            
-                                            update_data("Orders", df_curr)
-                                            st.success(f"訂單已更新！狀態：[{final_status_str}]")
+                                        # 只寫入這次修改的欄位 (其他人同時修改的欄位保留)；總額依寫入當下的最新小計計算
+                                        edited = changed_fields(row, {
+                                            'Status': final_status_str, 'Tracking_Number': new_track,
+                                            'Admin_Note': new_note, 'Extra_Discount': new_discount
+                                        })
+                                        def with_total(rec, edited=edited):
+                                            discount = edited.get('Extra_Discount', rec.get('Extra_Discount') or 0)
+                                            return dict(edited, Total=order_total(rec['Subtotal'], rec['Tax'], rec['Shipping'], discount))
+
+                                        if patch_order(row['Order_ID'], with_total):
+                                            curr = get_order_store().get(row['Order_ID'])
+                                            st.success(f"訂單已更新！狀態：[{curr['Status']}]")
                                             
                                             o_data = {
-                                                "Order_ID": row['Order_ID'], "Customer_Name": row['Customer_Name'],
-                                                "Email": row['Email'], "Status": final_status_str,
-                                                "Total": new_total, "Tracking_Number": new_track, "Admin_Note": new_note,
-                                                "Extra_Discount": new_discount
+                                                "Order_ID": row['Order_ID'], "Customer_Name": curr['Customer_Name'],
+                                                "Email": curr['Email'], "Status": curr['Status'],
+                                                "Total": curr['Total'], "Tracking_Number": curr.get('Tracking_Number') or "",
+                                                "Admin_Note": curr.get('Admin_Note') or "", "Extra_Discount": curr.get('Extra_Discount') or 0
                                             }
-                                            c_items = json.loads(row['Items_Json'])
+                                            c_items = json.loads(curr['Items_Json'])
                                             
-                                            with st.spinner("正在寄送通知信..."):
-                                                send_order_email(o_data, c_items, is_update=True)
-                                                st.toast("信件已寄出！", icon="📧")
+                                            if send_order_email(o_data, c_items, is_update=True):
+                                                st.toast("通知信已排入寄送佇列", icon="📧")
                                             
                                             time.sleep(1)
                                             st.rerun()
@@ -791,7 +1676,7 @@ def main_app(user):
                     else: st.info("目前無任何訂單")
                 except Exception as e: st.error(f"讀取失敗: {e}")
 
-        with tab2:
+        with tab2, perf_section("admin.brand_rules"):
             st.subheader("設定各品牌門檻與折扣")
             st.info("💡 Wholesale_Threshold: 批發門檻 | Shipping_Threshold: 免運門檻 | Discount: 零售折扣")
             _, df_rules = get_brand_rules()
@@ -808,24 +1693,22 @@ def main_app(user):
                 try:
                     update_data("BrandRules", edited_df)
                     st.success("設定已更新！")
-                    get_brand_rules.clear()
                     time.sleep(1)
                     st.rerun()
                 except Exception as e: st.error(f"儲存失敗: {e}")
         
-        with tab3:
+        with tab3, perf_section("admin.users"):
             st.subheader("👥 用戶權限管理")
             
             try:
-                all_brands_list = sorted(get_products_data()['Brand'].dropna().unique().tolist())
+                all_brands_list = sorted(get_catalog_index().df['Brand'].dropna().unique().tolist())
             except:
                 all_brands_list = []
 
             try:
-                users_df = get_data("Users", ttl=5) 
+                users_df = get_user_directory().to_dataframe()
                 
-                required_cols = ['Username', 'Dealer_Name']
-                missing_cols = [c for c in required_cols if c not in users_df.columns]
+                missing_cols = missing_required(users_df, "Users")
                 
                 if missing_cols:
                     st.error(f"❌ Google Sheet 資料表缺少欄位: {missing_cols}")
@@ -881,11 +1764,7 @@ def main_app(user):
                             else:
                                 final_str = ", ".join(selected_brands)
                             
-                            idx = users_df[users_df['Username'] == target_user].index[0]
-                            users_df.at[idx, 'Allowed_Brands'] = final_str
-                            users_df.at[idx, 'Contact_Email'] = admin_edit_email 
-                            
-                            update_data("Users", users_df)
+                            update_user(target_user, {'Allowed_Brands': final_str, 'Contact_Email': admin_edit_email}, base=current_row)
                             st.success(f"✅ 用戶 {target_user} 資料已更新！")
                             time.sleep(1)
                             st.rerun()
@@ -895,48 +1774,28 @@ def main_app(user):
             except Exception as e:
                 st.error(f"讀取用戶資料失敗: {e}")
 
-        with tab4:
+        with tab4, perf_section("admin.sales"):
             st.subheader("📊 數據戰情室")
             st.info("💡 這裡展示即時的銷售數據分析，協助您判斷通路價值與熱銷商品。")
             
             try:
-                orders = get_data("Orders")
-                if orders.empty:
+                # 直接讀取增量維護的統計表，不必每次重算全部訂單
+                rollups = built_sales_rollups()
+                r1, r2 = st.columns([4, 1], vertical_alignment="center")
+                if rollups.built_at is not None:
+                    r1.caption(f"統計自 {rollups.built_at.strftime('%Y-%m-%d %H:%M:%S')} 完整計算後持續更新")
+                if r2.button("🔄 重新計算", key="rebuild_rollups", use_container_width=True):
+                    with st.spinner("正在重新計算..."):
+                        orders = get_data("Orders")
+                        order_items = get_order_items(orders)
+                        rollups.rebuild(orders, order_items.table)
+                    if not order_items.errors.empty:
+                        st.warning(f"⚠️ {len(order_items.errors)} 筆訂單的內容無法解析，未列入商品統計: {', '.join(order_items.errors['Order_ID'])}")
+
+                total_rev, total_orders, avg_order_value = rollups.kpis()
+                if total_orders == 0:
                     st.warning("目前沒有訂單數據可供分析。")
                 else:
-                    # 1. 資料前處理
-                    orders['Order_Date'] = pd.to_datetime(orders['Order_Time'])
-                    orders['Month'] = orders['Order_Date'].dt.strftime('%Y-%m')
-                    orders['Total'] = pd.to_numeric(orders['Total'], errors='coerce').fillna(0)
-                    
-                    df_prods = get_products_data()
-                    prod_cat_map = {}
-                    if not df_prods.empty and 'Name' in df_prods.columns and 'Category' in df_prods.columns:
-                        prod_cat_map = dict(zip(df_prods['Name'], df_prods['Category']))
-
-                    all_items_list = []
-                    for _, row in orders.iterrows():
-                        try:
-                            items = json.loads(row['Items_Json'])
-                            for item in items.values():
-                                all_items_list.append({
-                                    'Order_ID': row['Order_ID'],
-                                    'Dealer': row['Customer_Name'],
-                                    'Month': row['Order_Date'].strftime('%Y-%m'),
-                                    'Brand': item.get('brand', 'Unknown'),
-                                    'Product': item.get('name', 'Unknown'),
-                                    'Category': prod_cat_map.get(item.get('name'), 'Unknown'),
-                                    'Qty': int(item.get('qty', 0)),
-                                    'Subtotal': int(item.get('final_subtotal', 0))
-                                })
-                        except: pass
-                    
-                    df_items = pd.DataFrame(all_items_list)
-
-                    total_rev = int(orders['Total'].sum())
-                    total_orders = len(orders)
-                    avg_order_value = int(total_rev / total_orders) if total_orders > 0 else 0
-                    
                     k1, k2, k3 = st.columns(3)
                     k1.metric("💰 總營業額 (Total Revenue)", f"${total_rev:,}")
                     k2.metric("📦 總訂單數 (Total Orders)", f"{total_orders}")
@@ -948,37 +1807,32 @@ def main_app(user):
                     
                     with c_chart1:
                         st.markdown("##### 🏆 經銷商貢獻度排行 (Top Dealers)")
-                        dealer_sales = orders.groupby('Customer_Name')['Total'].sum().sort_values(ascending=False).head(10)
-                        st.bar_chart(dealer_sales, color="#ff5500")
+                        st.bar_chart(rollups.dealer_sales(10), color="#ff5500")
                         st.caption("前 10 名貢獻營收最高的經銷商")
 
                     with c_chart2:
                         st.markdown("##### 📅 每月營收走勢 (Monthly Revenue)")
-                        monthly_sales = orders.groupby('Month')['Total'].sum()
-                        st.line_chart(monthly_sales, color="#3498db")
+                        st.line_chart(rollups.monthly_sales(), color="#3498db")
                         st.caption("觀察銷售季節性變化")
 
                     st.divider()
                     
                     c_chart3, c_chart4 = st.columns(2)
+                    top_products = rollups.top_products(20)
                     
-                    if not df_items.empty:
+                    if not top_products.empty:
                         with c_chart3:
                             st.markdown("##### 🏷️ 品牌銷售佔比 (Sales by Brand)")
-                            brand_sales = df_items.groupby('Brand')['Subtotal'].sum().sort_values(ascending=False)
-                            st.bar_chart(brand_sales, horizontal=True)
+                            st.bar_chart(rollups.brand_sales(), horizontal=True)
 
                         with c_chart4:
                             st.markdown("##### 📂 產品分類佔比 (Sales by Category)")
-                            cat_sales = df_items.groupby('Category')['Subtotal'].sum().sort_values(ascending=False)
-                            st.bar_chart(cat_sales, color="#2ecc71")
+                            st.bar_chart(rollups.category_sales(), color="#2ecc71")
                     
                     st.divider()
                     
                     st.markdown("##### 🔥 熱銷商品 TOP 20")
-                    if not df_items.empty:
-                        top_products = df_items.groupby(['Product', 'Brand', 'Category'])[['Qty', 'Subtotal']].sum().reset_index()
-                        top_products = top_products.sort_values('Subtotal', ascending=False).head(20)
+                    if not top_products.empty:
                         st.dataframe(
                             top_products,
                             column_config={
@@ -995,7 +1849,7 @@ def main_app(user):
                 st.error(f"數據分析載入失敗: {e}")
 
         # [新增] 第五個 Tab: 公告管理
-        with tab5:
+        with tab5, perf_section("admin.announcements"):
             st.subheader("📢 置頂公告設定")
             
             try:
@@ -1012,312 +1866,69 @@ def main_app(user):
                     announcement_df = pd.DataFrame([{"Message": new_msg}])
                     update_data("Announcements", announcement_df)
                     st.success("公告已更新！請重新整理頁面查看效果。")
-                    get_announcement.clear() # 清除快取
                     
             except Exception as e:
                 st.error(f"讀取公告失敗: {e}")
 
+        with tab6:
+            # 只看這個程序 (這台主機) 最近的紀錄；重新啟動後清空
+            perf = get_perf()
+            scheduler = getattr(get_storage().backend, "scheduler", None)
+            if scheduler is not None:
+                stat = scheduler.stats()
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Sheets 請求總數", stat['calls'])
+                m2.metric("合併的讀取", stat['coalesced'])
+                m3.metric("429 次數", stat['throttled'])
+                m4.metric("剩餘額度", f"{stat['tokens']:.0f}", help=f"排隊中 {stat['waiting']} 個，暫停 {stat['paused_for']} 秒")
+            st.subheader("📈 每分鐘 API 請求數 (最近 30 分鐘)")
+            st.bar_chart(perf.calls_per_minute(30))
+            st.subheader("📄 各分頁讀寫耗時")
+            api_summary = perf.summary("api", by=("worksheet", "op"))
+            if api_summary.empty: st.info("尚無紀錄")
+            else: st.dataframe(api_summary, hide_index=True, use_container_width=True)
+            st.subheader("🧩 頁面區塊耗時")
+            section_summary = perf.summary("section")
+            if section_summary.empty: st.info("尚無紀錄")
+            else: st.dataframe(section_summary, hide_index=True, use_container_width=True)
+            queue_stats = get_write_queue().stats()
+            if queue_stats:
+                st.subheader("📝 延遲寫入佇列")
+                st.dataframe(pd.DataFrame.from_dict(queue_stats, orient="index").rename_axis("worksheet").reset_index(), hide_index=True, use_container_width=True)
+            st.caption(f"保留最近 {perf.capacity} 筆事件 (目前 {len(perf.events())} 筆)；時間單位：毫秒，backoff / queued 為秒")
+
         return
 
     # 3. 商店頁
     # [修正] 給購物車更多空間 (2.0) 並使用 [2.5, 1.5, 0.5, 1.2] 的欄位比例
     col_visual, col_select, col_cart = st.columns([1.5, 1.5, 2.0], gap="medium")
     current_name = st.session_state.current_product_name
-    current_product_data = df_products[df_products['Name'] == current_name]
+    current_product_data = catalog.variants(current_name)
 
-    with col_select:
-        with st.container(border=True):
-            st.markdown(f"<div style='font-size: 20px; font-weight: bold; margin-bottom: 10px;'>{current_name}</div>", unsafe_allow_html=True)
-            st.caption(f"Brand: {current_product_data.iloc[0]['Brand']}")
-            st.markdown("---")
-            available_colors = current_product_data['Color'].unique()
-            selected_color = st.selectbox("顏色", available_colors, key=f"color_sel_{current_name}")
-            variants = current_product_data[current_product_data['Color'] == selected_color]
-            st.markdown("<br>", unsafe_allow_html=True)
-            h1, h2, h3, h4, h5 = st.columns([1.2, 2.2, 1.5, 1.5, 1.5], vertical_alignment="center")
-            h1.markdown("**尺寸**")
-            h2.markdown("**數量**")
-            h3.markdown("**批發價**\n(未稅)")
-            h4.markdown("**零售價**\n(含稅)")
-            h5.markdown("") 
-
-            def add_to_cart_callback(p_id, p_name, p_spec, p_w, p_r, q_key, p_brand):
-                qty = st.session_state[q_key]
-                if qty <= 0: return
-                if p_id in st.session_state.cart:
-                    st.session_state.cart[p_id]['qty'] += qty
-                else:
-                    st.session_state.cart[p_id] = {
-                        "id": p_id, "name": p_name, "spec": p_spec,
-                        "wholesale_price": int(p_w), "retail_price": int(p_r),
-                        "brand": p_brand, "qty": qty
-                    }
-                st.toast(f"已加入 {p_name} x {qty}", icon="🛒")
-                st.session_state[q_key] = 1
-
-            for i, (_, sku) in enumerate(variants.iterrows()):
-                c_row = st.container()
-                c1, c2, c3, c4, c5 = c_row.columns([1.2, 2.2, 1.5, 1.5, 1.5], vertical_alignment="center")
-                with c1: st.markdown(f"<div style='font-weight:bold;'>{str(sku['Size'])}</div>", unsafe_allow_html=True)
-                with c2:
-                    qty_key = f"qty_input_{sku['Product_ID']}_{selected_color}_{i}"
-                    st.number_input("Qty", min_value=1, value=1, step=1, key=qty_key, label_visibility="collapsed")
-                with c3: st.markdown(f"<div style='color:#ff5500; font-weight:bold;'>${int(sku['Wholesale_Price'])}</div>", unsafe_allow_html=True)
-                with c4: st.markdown(f"<div style='color:#666;'>${int(sku['Retail_Price'])}</div>", unsafe_allow_html=True)
-                with c5:
-                    st.button("ADD", key=f"add_{sku['Product_ID']}_{selected_color}_{i}", type="primary", use_container_width=True,
-                        on_click=add_to_cart_callback,
-                        args=(sku['Product_ID'], current_name, f"{selected_color} / {str(sku['Size'])}", sku['Wholesale_Price'], sku['Retail_Price'], qty_key, current_product_data.iloc[0]['Brand']))
-
-    with col_visual:
+    with col_select, perf_section("shop.variants"):
+        variant_selector(catalog, current_name)
+    available_colors = catalog.colors(current_name)
+    selected_color = st.session_state.get(f"color_sel_{current_name}")
+    if selected_color not in list(available_colors): selected_color = available_colors[0]
+
+    with col_visual, perf_section("shop.catalog"):
         with st.container(border=True):
-            img_row = current_product_data[current_product_data['Color'] == selected_color]
+            img_row = catalog.sizes(current_name, selected_color)
             if img_row.empty: img_row = current_product_data.iloc[0]
             else: img_row = img_row.iloc[0]
-            main_img = convert_drive_url(img_row['Image_URL'])
+            main_img = product_image(img_row['Image_URL'], "main")
             if main_img: st.image(main_img, use_container_width=True)
             else: st.warning("No Image")
             st.markdown("<br><h4>Related Products / 同系列商品</h4>", unsafe_allow_html=True)
-            current_category = current_product_data.iloc[0]['Category']
-            same_category_products = df_products[df_products['Category'] == current_category]['Name'].unique()
-            others = [p for p in same_category_products if p != current_name]
-            for i in range(0, len(others), 3):
-                cols = st.columns(3)
-                batch = others[i:i+3]
-                for idx, other_prod in enumerate(batch):
-                    row = df_products[df_products['Name'] == other_prod].iloc[0]
-                    thumb = convert_drive_url(row['Image_URL'])
-                    with cols[idx]:
-                        with st.container(border=True):
-                            if thumb: 
-                                st.image(thumb, use_container_width=True)
-                            else:
-                                st.markdown("<div style='height: 150px; background-color: #f0f0f0; display: flex; align-items: center; justify-content: center; color: #666;'>No Image</div>", unsafe_allow_html=True)
-                            
-                            if st.button(f" {other_prod}", key=f"view_{other_prod}_{i}_{idx}", use_container_width=True):
-                                st.session_state.current_product_name = other_prod
-                                st.rerun()
+            current_category = catalog.category_of(current_name)
+            same_category_products = catalog.category_names(current_category, allowed_brands)
+            others = list(same_category_products)
+            if current_name in others: others.remove(current_name)
+            related_products_grid(catalog, others, current_category)
             if not others: st.caption("此分類下無其他商品")
 
-    # [購物車欄位優化]
-    def update_item_qty(item_id):
-        # Callback function for number input
-        new_val = st.session_state[f"cart_qty_{item_id}"]
-        if item_id in st.session_state.cart:
-            st.session_state.cart[item_id]['qty'] = new_val
-
     with col_cart:
-        with st.container(border=True):
-            st.markdown("<h3 style='font-size: 20px; font-weight: bold;'>🛒 購物車</h3>", unsafe_allow_html=True)
-            st.divider()
-            if st.session_state.cart:
-                BRAND_RULES, _ = get_brand_rules()
-                for item in st.session_state.cart.values():
-                    if 'brand' not in item: item['brand'] = "default"
-                    if 'wholesale_price' not in item: item['wholesale_price'] = item.get('Wholesale_Price', 0)
-                    if 'retail_price' not in item: item['retail_price'] = item.get('Retail_Price', 0)
-
-                brand_groups = {} 
-                for item in st.session_state.cart.values():
-                    b_name = item['brand']
-                    if b_name not in brand_groups:
-                        brand_groups[b_name] = {'items': [], 'raw_wholesale_total': 0, 'is_wholesale_qualified': False, 'is_shipping_qualified': False}
-                    brand_groups[b_name]['items'].append(item)
-                    brand_groups[b_name]['raw_wholesale_total'] += int(round(item['wholesale_price'] * item['qty']))
-
-                is_order_free_shipping = False 
-                grand_total_subtotal = 0
-                grand_total_tax = 0
-                
-                for b_name, data in brand_groups.items():
-                    safe_default = {"wholesale_threshold": 10000, "shipping_threshold": 10000, "discount_rate": 0.7}
-                    rule = BRAND_RULES.get(b_name, BRAND_RULES.get("default", safe_default))
-                    d_rate = rule.get('discount_rate', 0.7)
-                    w_threshold = rule.get('wholesale_threshold', 10000)
-                    s_threshold = rule.get('shipping_threshold', 10000)
-                    
-                    if data['raw_wholesale_total'] >= w_threshold:
-                        data['is_wholesale_qualified'] = True
-                        brand_subtotal = data['raw_wholesale_total']
-                        brand_tax = int(round(brand_subtotal * TAX_RATE))
-                    else:
-                        data['is_wholesale_qualified'] = False
-                        brand_subtotal = 0
-                        brand_tax = 0
-                        for item in data['items']:
-                            brand_subtotal += int(round(item['retail_price'] * d_rate)) * item['qty']
-
-                    if data['raw_wholesale_total'] >= s_threshold:
-                        data['is_shipping_qualified'] = True
-                        is_order_free_shipping = True
-                    
-                    grand_total_subtotal += brand_subtotal
-                    grand_total_tax += brand_tax
-                    for item in data['items']:
-                        if data['is_wholesale_qualified']: item['final_unit_price'] = item['wholesale_price']
-                        else: item['final_unit_price'] = int(round(item['retail_price'] * d_rate))
-                        item['final_subtotal'] = item['final_unit_price'] * item['qty']
-
-                for b_name, data in brand_groups.items():
-                    safe_default = {"wholesale_threshold": 10000, "shipping_threshold": 10000, "discount_rate": 0.7}
-                    rule = BRAND_RULES.get(b_name, BRAND_RULES.get("default", safe_default))
-                    d_rate = rule.get('discount_rate', 0.7)
-                    w_threshold = rule.get('wholesale_threshold', 10000)
-                    
-                    if data['is_wholesale_qualified']:
-                        msg = f"**{b_name}** | 小計 ${data['raw_wholesale_total']} (已達門檻 ${w_threshold}) ➝ **批發價**"
-                        if data['is_shipping_qualified']: msg += " | 🚚 免運"
-                        st.success(msg, icon="✅")
-                    else:
-                        msg = f"**{b_name}** | 小計 ${data['raw_wholesale_total']} (未達門檻 ${w_threshold}) ➝ **零售{int(d_rate*10)}折**"
-                        if data['is_shipping_qualified']: msg += " | 🚚 免運"
-                        st.warning(msg, icon="⚠️")
-
-                    for item in data['items']:
-                        # [關鍵修正] 使用 [2.5, 1.5, 0.5, 1.2] 的比例，確保有足夠空間顯示按鈕
-                        c_name, c_qty, c_del, c_price = st.columns([2.5, 1.5, 0.5, 1.2], vertical_alignment="center")
-                        
-                        with c_name:
-                            # Product Name and Spec (Color/Size)
-                            st.markdown(f"<div style='line-height:1.2; font-weight:bold;'>{item['name']}</div><div style='color:#cccccc; font-size:12px; margin-top:2px;'>{item['spec']}</div>", unsafe_allow_html=True)
-                        
-                        with c_qty:
-                            # 這裡的寬度現在夠大了，按鈕應該會出現
-                            st.number_input(
-                                "Qty",
-                                min_value=1,
-                                value=int(item['qty']),
-                                step=1,
-                                key=f"cart_qty_{item['id']}",
-                                label_visibility="collapsed",
-                                on_change=update_item_qty,
-                                args=(item['id'],)
-                            )
-                        
-                        with c_del:
-                            # Delete Button
-                            if st.button("✖", key=f"cart_del_{item['id']}", type="secondary", help="移除此商品"):
-                                del st.session_state.cart[item['id']]
-                                st.rerun()
-                        
-                        with c_price:
-                            # Price
-                            st.markdown(f"<div style='text-align:right; font-weight:bold;'>${item['final_subtotal']}</div>", unsafe_allow_html=True)
-                    st.divider()
-
-                if is_order_free_shipping:
-                    shipping = 0
-                    shipping_msg = "✅ 符合免運資格"
-                else:
-                    shipping = SHIPPING_FEE
-                    shipping_msg = f"運費 ${SHIPPING_FEE}"
-
-                grand_total = grand_total_subtotal + grand_total_tax + shipping
-                
-                r1, r2 = st.columns(2)
-                r1.text("小計 (Subtotal)")
-                r2.text(f"${grand_total_subtotal}")
-                r1.text("稅金 (Tax)")
-                r2.text(f"${grand_total_tax}")
-                r1.text("運費 (Shipping)")
-                r2.text(shipping_msg)
-                r1.markdown("#### 總計(含稅)")
-                r2.markdown(f"#### ${grand_total}")
-                
-                if is_order_free_shipping: st.info("🎉 訂單已享免運優惠！")
-                else: st.warning(f"⚠️ 全單未達免運標準，需付運費 ${SHIPPING_FEE}")
-                
-                is_editing = st.session_state.get('editing_order_id') is not None
-                if is_editing:
-                    btn_text = "💾 確認修改並儲存 (Admin Update)"
-                    client_name = st.session_state.get('editing_customer_info', {}).get('Customer_Name', 'Unknown')
-                    st.warning(f"🔧 正在修改客戶 [{client_name}] 的訂單：{st.session_state.editing_order_id}")
-                else: 
-                    # 結帳前 Email 輸入框
-                    st.markdown("---")
-                    
-                    default_checkout_email = str(user.get('Contact_Email', '')).replace('nan', '')
-                    if not default_checkout_email and "@" in str(user['Username']):
-                        default_checkout_email = user['Username']
-                    
-                    contact_email_input = st.text_input("📧 接收訂單通知 Email (必填)", value=default_checkout_email, help="訂單確認信將寄送至此信箱")
-                    
-                    btn_text = "CHECKOUT / 送出訂單"
-
-                # 按鈕啟用邏輯
-                disable_btn = (not is_editing) and (not contact_email_input)
-                
-                if st.button(btn_text, type="primary", use_container_width=True, disabled=disable_btn):
-                    if is_editing:
-                        order_id = st.session_state.editing_order_id
-                        saved_info = st.session_state.get('editing_customer_info', {})
-                        c_name = saved_info.get('Customer_Name', user['Dealer_Name'])
-                        c_email = saved_info.get('Email', user['Username']) # Edit mode uses old email
-                        c_phone = saved_info.get('Phone', user['Phone'])
-                        c_status = "賣方已修改"
-                    else:
-                        order_id = f"ORD-{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                        c_name = user['Dealer_Name']
-                        c_email = contact_email_input # Use input email
-                        c_phone = user['Phone']
-                        c_status = "待處理"
-                        
-                        # 自動更新使用者 Email
-                        try:
-                            if c_email != str(user.get('Contact_Email', '')):
-                                users_d = get_data("Users")
-                                u_idx = users_d[users_d['Username'] == user['Username']].index
-                                if not u_idx.empty:
-                                    users_d.at[u_idx[0], 'Contact_Email'] = c_email
-                                    update_data("Users", users_d)
-                                    st.session_state['user']['Contact_Email'] = c_email
-                        except: pass 
-
-                    final_cart_data = st.session_state.cart.copy()
-                    order_data = {
-                        "Order_ID": order_id, "Order_Time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "Customer_Name": c_name, "Email": c_email, "Phone": c_phone,
-                        "Items_Json": json.dumps(final_cart_data, ensure_ascii=False),
-                        "Subtotal": grand_total_subtotal, "Tax": grand_total_tax, 
-                        "Shipping": shipping, "Total": grand_total, "Status": c_status,
-                        "Extra_Discount": 0 
-                    }
-                    if 'Tracking_Number' not in order_data: order_data['Tracking_Number'] = ""
-                    if 'Admin_Note' not in order_data: order_data['Admin_Note'] = ""
-
-                    try:
-                        old_orders = get_data("Orders")
-                        if is_editing:
-                            target_idx = old_orders[old_orders['Order_ID'] == order_id].index
-                            if not target_idx.empty:
-                                idx = target_idx[0]
-                                for key, value in order_data.items():
-                                    old_orders.at[idx, key] = value
-                                update_data("Orders", old_orders)
-                                st.success(f"訂單 {order_id} 修改完成！")
-                                with st.spinner("正在寄送通知信給客戶..."):
-                                    if send_order_email(order_data, final_cart_data, is_update=True):
-                                        st.toast("📧 確認信已寄出！", icon="✅")
-                                    else: st.error("信件寄送失敗")
-                            else: st.error("找不到原始訂單")
-                        else:
-                            updated = pd.concat([old_orders, pd.DataFrame([order_data])], ignore_index=True)
-                            update_data("Orders", updated)
-                            st.success(f"訂單 {order_id} 已送出!")
-                            with st.spinner("正在寄送確認信..."):
-                                if send_order_email(order_data, final_cart_data):
-                                    st.toast("📧 確認信已寄出！", icon="✅")
-                                else: st.warning("訂單已成立，但信件寄送失敗")
-
-                        st.session_state.cart = {}
-                        st.session_state.editing_order_id = None
-                        st.session_state.editing_customer_info = None
-                        time.sleep(1)
-                        if user['Username'] in ADMIN_USERS: st.session_state.page = 'admin_orders'
-                        else: st.session_state.page = 'shop'
-                        st.rerun()
-                    except Exception as e: st.error(f"訂單處理失敗: {e}")
-            else: st.info("購物車是空的")
+        cart_panel(user)
 
 def login_page():
     col1, col2, col3 = st.columns([1, 1, 1])
@@ -1329,12 +1940,31 @@ def login_page():
             u = st.text_input("Username / Email")
             p = st.text_input("Password", type="password")
             if st.form_submit_button("Login", use_container_width=True, type="primary"):
-                users = get_data("Users")
-                match = users[users['Username'] == u]
-                if not match.empty and str(match.iloc[0]['Password']) == p:
-                    st.session_state['user'] = match.iloc[0]
+                # 直接查使用者目錄 (不讀 Sheet)；找不到帳號時才重新載入一次 (例如剛在 Sheet 新增的經銷商)
+                guard = get_login_guard()
+                locked = guard.locked_for(u)
+                if locked:
+                    st.error(f"登入失敗次數過多，請於 {int(locked // 60) + 1} 分鐘後再試")
+                    return
+                try:
+                    directory = get_user_directory()
+                    if u not in directory:
+                        refresh_snapshot("Users", min_interval=60)
+                        directory = get_user_directory()
+                except Exception as e:
+                    st.error(f"無法載入使用者資料，請稍後再試。 ({e})")
+                    return
+                if directory.verify(u, p):
+                    guard.success(u)
+                    if directory.needs_rehash(u):
+                        # 舊的明碼密碼：登入成功時改存雜湊 (背景寫入)
+                        try: update_user(u, {'Password': p}, wait=False)
+                        except Exception as e: print(f"Password Rehash Error: {e}")
+                    st.session_state['user'] = directory.get(u)
                     st.rerun()
-                else: st.error("帳號或密碼錯誤")
+                else:
+                    guard.failure(u)
+                    st.error("帳號或密碼錯誤")
 
 if __name__ == "__main__":
     if 'user' not in st.session_state:
@@ -0,0 +1,291 @@
+# 資料層效能測試
+# 以合成的 Products / Orders / BrandRules 資料，量測各熱點路徑的執行時間、吞吐量與記憶體高峰，
+# 並可與先前存下的基準比較。完全離線執行，不需要 Google Sheets 或 Streamlit。
+#
+# 用法:
+#   python benchmark.py                       # 完整尺寸 (Products 1k~100k, Orders 1k~200k)
+#   python benchmark.py --quick               # 小尺寸，快速檢查
+#   python benchmark.py --save-baseline bench_baseline.json
+#   python benchmark.py --baseline bench_baseline.json --threshold 1.25
+#   python benchmark.py --export csv:staging --products 10000 --orders 50000
+#       (寫出一份合成資料，於 secrets.toml 設定 [storage] backend = "csv", path = "staging" 即可用它啟動 app)
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from analytics import SalesRollups
+from catalog import CatalogIndex, parse_allowed_brands
+from order_items import build_line_items
+from pricing import price_cart
+from schema import apply_schema
+from sheet_sync import diff_frames
+from storage import open_local_backend
+
+TAX_RATE = 0.05
+SHIPPING_FEE = 125
+
+COLORS = ["Red", "Blue", "Black", "Green", "Pink", "Navy", "Grey", "Orange"]
+SIZES = ["XS", "S", "M", "L", "XL", "2XL"]
+
+
+# --- 合成資料 ---
+def make_products(n_skus, n_brands=20, n_categories=12, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    i = 0
+    while len(rows) < n_skus:
+        name = f" Product {i} "
+        brand = f"Brand{rng.randrange(n_brands)} "
+        category = f" Category{rng.randrange(n_categories)}"
+        for color in rng.sample(COLORS, rng.randint(1, 4)):
+            for size in SIZES[:rng.randint(2, len(SIZES))]:
+                price = rng.randint(100, 3000)
+                rows.append({
+                    "Product_ID": f"P{i:06d}-{color}-{size}",
+                    "Name": name, "Brand": brand, "Category": category,
+                    "Color": f"{color} ", "Size": f" {size}",
+                    "Wholesale_Price": str(price), "Retail_Price": str(int(price * 1.8)),
+                    "Image_URL": f"https://drive.google.com/file/d/img{i}/view",
+                })
+        i += 1
+    return pd.DataFrame(rows[:n_skus])
+
+
+def make_brand_rules(n_brands=20, seed=1):
+    rng = random.Random(seed)
+    rows = [{"Brand": "default", "Wholesale_Threshold": 10000, "Shipping_Threshold": 10000, "Discount": 0.7}]
+    for b in range(n_brands):
+        rows.append({
+            "Brand": f"Brand{b}",
+            "Wholesale_Threshold": rng.choice([3000, 5000, 10000, 20000]),
+            "Shipping_Threshold": rng.choice([2000, 5000, 10000]),
+            "Discount": rng.choice([0.6, 0.7, 0.8, 0.9]),
+        })
+    df = pd.DataFrame(rows)
+    rules = {
+        r["Brand"]: {"wholesale_threshold": r["Wholesale_Threshold"], "shipping_threshold": r["Shipping_Threshold"], "discount_rate": r["Discount"]}
+        for r in rows
+    }
+    return rules, df
+
+
+def make_cart(products, n_items, seed=1):
+    rng = random.Random(seed)
+    cart = {}
+    for rec in products.sample(n=min(n_items, len(products)), random_state=seed).to_dict("records"):
+        cart[rec["Product_ID"]] = {
+            "id": rec["Product_ID"], "name": rec["Name"], "spec": f"{rec['Color']} / {rec['Size']}",
+            "wholesale_price": int(rec["Wholesale_Price"]), "retail_price": int(rec["Retail_Price"]),
+            "brand": rec["Brand"], "qty": rng.randint(1, 20),
+        }
+    return cart
+
+
+def make_orders(n_orders, products, n_dealers=300, seed=1):
+    rng = random.Random(seed)
+    catalog = products[["Product_ID", "Name", "Brand", "Color", "Size", "Wholesale_Price", "Retail_Price"]].to_dict("records")
+    start = pd.Timestamp("2024-01-01").value // 10**9
+    rows = []
+    for i in range(n_orders):
+        items = {}
+        subtotal = 0
+        for rec in rng.sample(catalog, rng.randint(1, 8)):
+            qty = rng.randint(1, 12)
+            unit = int(rec["Wholesale_Price"])
+            items[rec["Product_ID"]] = {
+                "id": rec["Product_ID"], "name": rec["Name"], "spec": f"{rec['Color']} / {rec['Size']}",
+                "wholesale_price": unit, "retail_price": int(rec["Retail_Price"]), "brand": rec["Brand"],
+                "qty": qty, "final_unit_price": unit, "final_subtotal": unit * qty,
+            }
+            subtotal += unit * qty
+        tax = int(round(subtotal * TAX_RATE))
+        ts = pd.Timestamp(start + rng.randrange(2 * 365 * 86400), unit="s")
+        rows.append({
+            "Order_ID": f"ORD-{ts.strftime('%Y%m%d%H%M%S')}-{i}", "Order_Time": ts.strftime("%Y-%m-%d %H:%M:%S"),
+            "Customer_Name": f"Dealer {rng.randrange(n_dealers)}", "Email": f"dealer{i % n_dealers}@example.com",
+            "Phone": "0912345678", "Items_Json": json.dumps(items, ensure_ascii=False),
+            "Subtotal": subtotal, "Tax": tax, "Shipping": 0, "Total": subtotal + tax,
+            "Status": "待處理, 未付款", "Extra_Discount": 0, "Tracking_Number": "", "Admin_Note": "",
+        })
+    return pd.DataFrame(rows)
+
+
+def make_users(n_dealers=300, n_brands=20, seed=1):
+    rng = random.Random(seed)
+    rows = [{"Username": "admin", "Password": "admin", "Dealer_Name": "Bluebulous", "Contact_Person": "Admin",
+             "Phone": "0900000000", "Address": "", "Allowed_Brands": "All", "Contact_Email": ""}]
+    for d in range(n_dealers):
+        brands = ", ".join(f"Brand{b}" for b in rng.sample(range(n_brands), rng.randint(1, 5)))
+        rows.append({
+            "Username": f"dealer{d}@example.com", "Password": f"pw{d}", "Dealer_Name": f"Dealer {d}",
+            "Contact_Person": f"Contact {d}", "Phone": f"09{d:08d}", "Address": f"Street {d}",
+            "Allowed_Brands": brands, "Contact_Email": f"dealer{d}@example.com",
+        })
+    return pd.DataFrame(rows)
+
+
+def export_dataset(target, n_products, n_orders):
+    # target: "csv:路徑" / "parquet:路徑" / "sqlite:路徑.db"
+    kind, _, path = target.partition(":")
+    backend = open_local_backend(kind, path)
+    products = make_products(n_products)
+    _, rules = make_brand_rules()
+    backend.update("Products", products)
+    backend.update("BrandRules", rules)
+    backend.update("Users", make_users())
+    backend.update("Orders", make_orders(n_orders, apply_schema(products, "Products")))
+    backend.update("Announcements", pd.DataFrame([{"Message": "測試環境 (合成資料)"}]))
+    print(f"已寫出合成資料到 {kind}: {backend.path} (Products {n_products}, Orders {n_orders})")
+
+
+# --- 量測 ---
+def measure(fn, repeat):
+    fn()  # 暖身
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def bench_cases(product_sizes, order_sizes, cart_sizes):
+    rules, _ = make_brand_rules()
+    cases = []
+    largest_products = None
+
+    for n in product_sizes:
+        raw = make_products(n)
+        cases.append(("products_load", n, "rows", lambda raw=raw: apply_schema(raw, "Products")))
+        clean = apply_schema(raw, "Products")
+        cases.append(("catalog_index_build", n, "rows", lambda clean=clean: CatalogIndex(clean)))
+        index = CatalogIndex(clean)
+        names = index.names
+        brands = parse_allowed_brands("Brand1, Brand2, Brand3")
+
+        def lookups(index=index, names=names, brands=brands):
+            # 模擬一次商店頁重新整理：權限目錄 + 產品、顏色、尺寸、同系列查詢
+            index.view(brands)
+            for name in names[:200]:
+                index.variants(name)
+                colors = index.colors(name)
+                index.sizes(name, colors[0])
+                for other in index.category_names(index.category_of(name), brands)[:30]:
+                    index.first_row(other)
+        cases.append(("catalog_rerun_lookups", n, "reruns", lookups))
+        largest_products = clean
+
+    for n in cart_sizes:
+        cart = make_cart(largest_products, n)
+        cases.append(("cart_pricing", n, "items", lambda cart=cart: price_cart(cart, rules, TAX_RATE, SHIPPING_FEE)))
+
+    for n in order_sizes:
+        orders = make_orders(n, largest_products)
+        cases.append(("items_json_parse", n, "orders", lambda orders=orders: build_line_items(orders)))
+        items, _ = build_line_items(orders)
+        cat_map = dict(zip(largest_products["Name"], largest_products["Category"]))
+
+        def rollup_rebuild(orders=orders, items=items, cat_map=cat_map):
+            SalesRollups(category_of=cat_map.get).rebuild(orders, items)
+        cases.append(("analytics_rebuild", n, "orders", rollup_rebuild))
+
+        def analytics_groupbys(orders=orders, items=items, cat_map=cat_map):
+            # 原本數據戰情室的 groupby 計算 (對照用)
+            df = orders.assign(Month=pd.to_datetime(orders["Order_Time"]).dt.strftime("%Y-%m"))
+            df.groupby("Customer_Name")["Total"].sum().sort_values(ascending=False).head(10)
+            df.groupby("Month")["Total"].sum()
+            it = items.assign(Category=items["Name"].map(cat_map))
+            it.groupby("Brand")["Subtotal"].sum()
+            it.groupby("Category")["Subtotal"].sum()
+            it.groupby(["Name", "Brand", "Category"])[["Qty", "Subtotal"]].sum().nlargest(20, "Subtotal")
+        cases.append(("analytics_groupbys", n, "orders", analytics_groupbys))
+
+        edited = orders.copy()
+        edited.loc[len(edited) // 2, "Status"] = "已出貨, 已付款"
+        cases.append(("sheet_delta_diff", n, "orders", lambda orders=orders, edited=edited: diff_frames(orders, edited)))
+    return cases
+
+
+def run(args):
+    if args.quick:
+        product_sizes, order_sizes, cart_sizes = [1000, 5000], [1000, 5000], [5, 50]
+    else:
+        product_sizes, order_sizes, cart_sizes = [1000, 10000, 100000], [1000, 20000, 200000], [5, 50, 200]
+
+    results = {}
+    print(f"{'case':<24}{'size':>9}{'median ms':>12}{'throughput':>18}{'peak MB':>10}")
+    for name, size, unit, fn in bench_cases(product_sizes, order_sizes, cart_sizes):
+        seconds, peak = measure(fn, args.repeat)
+        rate = (1 / seconds if unit == "reruns" else size / seconds) if seconds > 0 else float("inf")
+        key = f"{name}[{size}]"
+        results[key] = {"seconds": seconds, "throughput": rate, "unit": unit, "peak_bytes": peak}
+        print(f"{name:<24}{size:>9}{seconds * 1000:>12.2f}{rate:>12.0f} {unit + '/s':<6}{peak / 2**20:>9.1f}")
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, cur in results.items():
+        base = baseline.get("results", {}).get(key)
+        if not base or base["seconds"] <= 0:
+            continue
+        ratio = cur["seconds"] / base["seconds"]
+        if ratio > threshold:
+            regressions.append((key, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="B2B 資料層效能測試")
+    parser.add_argument("--quick", action="store_true", help="只跑小尺寸")
+    parser.add_argument("--repeat", type=int, default=3, help="每個案例重複次數 (取中位數)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把結果存成基準檔")
+    parser.add_argument("--baseline", metavar="PATH", help="與基準檔比較")
+    parser.add_argument("--threshold", type=float, default=1.25, help="比基準慢超過此倍數視為退步")
+    parser.add_argument("--export", metavar="KIND:PATH", help="只寫出合成資料到本地後端 (csv / parquet / sqlite)")
+    parser.add_argument("--products", type=int, default=10000, help="--export 的產品 SKU 數")
+    parser.add_argument("--orders", type=int, default=20000, help="--export 的訂單數")
+    args = parser.parse_args(argv)
+
+    if args.export:
+        export_dataset(args.export, args.products, args.orders)
+        return 0
+
+    results = run(args)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(), "pandas": pd.__version__,
+                "machine": platform.platform(), "results": results,
+            }, f, indent=2)
+        print(f"\n基準已儲存: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n⚠️ 效能退步 (> {args.threshold:.2f}x):")
+            for key, ratio in regressions:
+                print(f"  {key}: {ratio:.2f}x")
+            return 1
+        print("\n✅ 沒有超過門檻的效能退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
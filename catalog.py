@@ -0,0 +1,148 @@
+# 產品目錄索引
+# 每次重新載入 Products 後建立一次，所有 session 共用。
+# 商店頁的查詢 (依名稱、顏色、分類) 都改用字典查表，不再對整張產品表做布林篩選。
+
+import threading
+
+import pandas as pd
+
+PRICE_COLUMNS = ["Wholesale_Price", "Retail_Price"]
+
+
+def parse_allowed_brands(value):
+    # 使用者的 Allowed_Brands 字串 -> frozenset；空白 / nan / All 代表全部品牌 (None)
+    if value is None or pd.isna(value):
+        return None
+    text = str(value).strip()
+    if text == "" or text.lower() == "nan":
+        return None
+    brands = [b.strip() for b in text.split(",") if b.strip()]
+    if not brands or any(b.lower() == "all" for b in brands):
+        return None
+    return frozenset(brands)
+
+
+class CatalogIndex:
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        for col in PRICE_COLUMNS:
+            if col in df.columns and not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+        self.df = df
+        # 依品牌權限過濾後的目錄 (frozenset -> DataFrame)，相同權限的使用者共用
+        self._views = {}
+        # 依品牌權限過濾後的分類商品名稱 ((分類, frozenset) -> tuple)，同上
+        self._category_views = {}
+        # 取出過的資料列 (df.iloc 的成本隨類別欄位大小增加，同一個商品只取一次)
+        self._rows = {}
+        self._views_lock = threading.Lock()
+
+        self._by_id = {}
+        if "Product_ID" in df.columns:
+            for pos, pid in enumerate(df["Product_ID"]):
+                self._by_id.setdefault(pid, pos)
+
+        self._by_name = {}
+        self._by_name_color = {}
+        self._colors = {}
+        self._brand = {}
+        self._category = {}
+        self._by_category = {}
+        self._categories_by_brand = {}
+
+        if "Name" not in df.columns:
+            return
+
+        names = df["Name"].tolist()
+        colors = df["Color"].tolist() if "Color" in df.columns else [None] * len(df)
+        brands = df["Brand"].tolist() if "Brand" in df.columns else [None] * len(df)
+        cats = df["Category"].tolist() if "Category" in df.columns else [None] * len(df)
+
+        for pos, (name, color, brand, cat) in enumerate(zip(names, colors, brands, cats)):
+            self._by_name.setdefault(name, []).append(pos)
+            self._by_name_color.setdefault((name, color), []).append(pos)
+            if name not in self._brand:
+                # 以第一筆資料為代表 (與原本 .iloc[0] 相同)
+                self._brand[name] = brand
+                self._category[name] = cat
+                self._colors[name] = []
+            if color not in self._colors[name]:
+                self._colors[name].append(color)
+            cat_names = self._by_category.setdefault(cat, {})
+            cat_names.setdefault(name, None)
+            self._categories_by_brand.setdefault(brand, {}).setdefault(cat, None)
+
+    # --- 基本查詢 ---
+    @property
+    def names(self):
+        return list(self._by_name)
+
+    @property
+    def categories(self):
+        return list(self._by_category)
+
+    def has(self, name, brands=None):
+        if name not in self._by_name:
+            return False
+        return brands is None or self._brand.get(name) in brands
+
+    def row(self, product_id):
+        pos = self._by_id.get(product_id)
+        return None if pos is None else self.df.iloc[pos]
+
+    def _take(self, key, positions):
+        # 回傳共用的 DataFrame / Series，呼叫端不可修改
+        cached = self._rows.get(key)
+        if cached is None:
+            cached = self._rows.setdefault(key, self.df.iloc[positions])
+        return cached
+
+    def variants(self, name):
+        return self._take(("variants", name), self._by_name.get(name, []))
+
+    def sizes(self, name, color):
+        return self._take(("sizes", name, color), self._by_name_color.get((name, color), []))
+
+    def colors(self, name):
+        return list(self._colors.get(name, []))
+
+    def first_row(self, name):
+        positions = self._by_name.get(name)
+        return self._take(("first", name), positions[0]) if positions else None
+
+    def brand_of(self, name):
+        return self._brand.get(name)
+
+    def category_of(self, name):
+        return self._category.get(name)
+
+    # --- 依品牌權限過濾 (brands 為 None 代表全部) ---
+    def category_list(self, brands=None):
+        if brands is None:
+            return self.categories
+        allowed = {}
+        for b in brands:
+            allowed.update(self._categories_by_brand.get(b, {}))
+        return [c for c in self._by_category if c in allowed]
+
+    def category_names(self, category, brands=None):
+        # 回傳 tuple (共用，不可修改)；每個 (分類, 權限) 只過濾一次
+        key = (category, brands)
+        cached = self._category_views.get(key)
+        if cached is None:
+            names = self._by_category.get(category, {})
+            cached = tuple(names if brands is None else (n for n in names if self._brand.get(n) in brands))
+            with self._views_lock:
+                cached = self._category_views.setdefault(key, cached)
+        return cached
+
+    def view(self, brands=None):
+        # brands 需先經過 parse_allowed_brands 正規化
+        if brands is None or "Brand" not in self.df.columns:
+            return self.df
+        with self._views_lock:
+            cached = self._views.get(brands)
+            if cached is None:
+                cached = self.df[self.df["Brand"].isin(brands)]
+                self._views[brands] = cached
+            return cached
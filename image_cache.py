@@ -0,0 +1,332 @@
+# 商品圖片快取
+# 每張來源圖片只下載一次，轉成固定尺寸 (例如小圖 / 主圖) 的 WebP 存在本地磁碟，
+# 超過容量上限時刪除最久沒用到的檔案。可另外啟動一個小型 HTTP 服務，以長效快取標頭提供圖片。
+# Pillow 為選用套件：沒有安裝時直接保存原圖，不做縮圖。
+
+import base64
+import hashlib
+import hmac
+import io
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+DRIVE_ID = re.compile(r"(?:/file/d/|[?&]id=)([\w-]+)")
+CONTENT_TYPES = {"webp": "image/webp", "jpg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+
+
+def _sniff(data):
+    # 由檔頭判斷圖片格式
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    raise ValueError("不是可辨識的圖片格式")
+
+
+def url_fetcher(timeout=20):
+    def fetch(url):
+        req = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.read()
+    return fetch
+
+
+def local_drive_fetcher(folder, fallback=None):
+    # 測試用：Google Drive 的檔案 ID 對應到本地資料夾裡的 <ID>.<副檔名>；其他網址交給 fallback
+    def fetch(url):
+        m = DRIVE_ID.search(url)
+        if m and "drive.google.com" in url:
+            for name in os.listdir(folder):
+                if os.path.splitext(name)[0] == m.group(1):
+                    with open(os.path.join(folder, name), "rb") as f:
+                        return f.read()
+            raise FileNotFoundError(f"本地 Drive 資料夾沒有檔案: {m.group(1)}")
+        if fallback is None:
+            raise FileNotFoundError(url)
+        return fallback(url)
+    return fetch
+
+
+class ImageCache:
+    # sizes: {"tile": 320, "main": 1000} (寬度，像素)；budget_bytes: 磁碟容量上限
+    # grace: 最近幾秒內用過的檔案不會被刪除 (已交給頁面、還沒送到瀏覽器的圖片)
+    def __init__(self, root, sizes, fetch=None, budget_bytes=500 * 2**20, quality=80, retry_after=600, grace=60):
+        self.root = root
+        self.sizes = dict(sizes)
+        self.fetch = fetch or url_fetcher()
+        self.budget_bytes = budget_bytes
+        self.quality = quality
+        self.retry_after = retry_after
+        self.grace = grace
+        self.format = "webp" if Image is not None and features.check("webp") else "jpg"
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._failed = {}  # key -> 失敗時間 (一段時間內不再重試)
+        self._index = OrderedDict()  # 檔名 -> 大小 (LRU 順序)
+        self._used = {}  # 檔名 -> 最後使用時間
+        self._pinned = set()  # 正在產生各尺寸的 key，這些檔案不會被刪除
+        self._total = 0
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._worker = None
+
+        os.makedirs(root, exist_ok=True)
+        files = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif os.path.isfile(path):
+                st = os.stat(path)
+                files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._index[name] = size
+            self._total += size
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:20]
+
+    # --- 磁碟與 LRU ---
+    def _find(self, prefix):
+        with self._lock:
+            for ext in CONTENT_TYPES:
+                name = f"{prefix}.{ext}"
+                if name in self._index:
+                    self._index.move_to_end(name)
+                    self._used[name] = time.time()
+                    return name
+        return None
+
+    def _touch(self, name):
+        try:
+            os.utime(os.path.join(self.root, name))
+        except OSError:
+            pass
+
+    def _store(self, name, data):
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        with self._lock:
+            self._total += len(data) - self._index.pop(name, 0)
+            self._index[name] = len(data)
+            self._used[name] = now
+            # 超過容量：從最久沒用到的開始刪；正在產生的圖片與最近用過的檔案保留 (暫時超出上限)
+            for old in list(self._index):
+                if self._total <= self.budget_bytes:
+                    break
+                if old.split("-")[0] in self._pinned or now - self._used.get(old, 0) < self.grace:
+                    continue
+                self._total -= self._index.pop(old)
+                self._used.pop(old, None)
+                try:
+                    os.remove(os.path.join(self.root, old))
+                except OSError:
+                    pass
+
+    def usage(self):
+        with self._lock:
+            return {"files": len(self._index), "bytes": self._total, "budget": self.budget_bytes,
+                    "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+    # --- 縮圖 ---
+    def _resize(self, data, width):
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+        if self.format == "jpg" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGBA")
+        out = io.BytesIO()
+        if self.format == "webp":
+            img.save(out, "WEBP", quality=self.quality, method=4)
+        else:
+            img.save(out, "JPEG", quality=self.quality, optimize=True)
+        return out.getvalue()
+
+    # --- 查詢 ---
+    def cached(self, url, size):
+        # 已經有檔案就回傳路徑 (不會下載)
+        if size not in self.sizes:
+            raise KeyError(size)
+        key = self.key(url)
+        name = self._find(f"{key}-{size}") if Image is not None else self._find(f"{key}-src")
+        if name is None:
+            return None
+        self.hits += 1
+        self._touch(name)
+        return os.path.join(self.root, name)
+
+    def get(self, url, size):
+        # 回傳指定尺寸的檔案路徑；需要時下載來源並產生所有尺寸
+        path = self.cached(url, size)
+        if path is not None:
+            return path
+        key = self.key(url)
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+            failed_at = self._failed.get(key)
+        if failed_at is not None and time.time() - failed_at < self.retry_after:
+            raise LookupError(f"圖片最近下載失敗，稍後再試: {url}")
+        with lock:
+            path = self.cached(url, size)
+            if path is not None:
+                return path
+            self.misses += 1
+            with self._lock:
+                self._pinned.add(key)
+            try:
+                src_name = self._find(f"{key}-src")
+                if src_name is not None:
+                    with open(os.path.join(self.root, src_name), "rb") as f:
+                        data = f.read()
+                else:
+                    data = self.fetch(url)
+                    src_name = f"{key}-src.{_sniff(data)}"
+                    self._store(src_name, data)
+                result = src_name
+                if Image is not None:
+                    for name, width in self.sizes.items():
+                        found = self._find(f"{key}-{name}")
+                        if found is None:
+                            found = f"{key}-{name}.{self.format}"
+                            self._store(found, self._resize(data, width))
+                        if name == size:
+                            result = found
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    self._failed[key] = time.time()
+                raise
+            finally:
+                with self._lock:
+                    self._pinned.discard(key)
+            with self._lock:
+                self._failed.pop(key, None)
+        # 直接回傳剛寫入的檔案 (不再查一次索引)
+        return os.path.join(self.root, result)
+
+    # --- 背景預先下載 ---
+    def prefetch(self, url):
+        with self._lock:
+            failed_at = self._failed.get(self.key(url))
+            if url in self._pending or (failed_at is not None and time.time() - failed_at < self.retry_after):
+                return
+            self._pending.add(url)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="image-prefetch", daemon=True)
+                self._worker.start()
+        self._queue.put(url)
+
+    def _run(self):
+        while True:
+            url = self._queue.get()
+            try:
+                self.get(url, next(iter(self.sizes)))
+            except Exception as e:
+                print(f"Image Prefetch Error: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(url)
+
+
+class ImageServer:
+    # 圖片服務：GET /img/<尺寸>/<來源網址(base64)>.<簽章>；只接受本服務產生的網址
+    def __init__(self, cache, host="0.0.0.0", port=8502, public_url=None, secret=None, max_age=31536000):
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.public_url = (public_url or f"http://localhost:{port}").rstrip("/")
+        self.secret = (secret or os.urandom(16).hex()).encode("utf-8")
+        self.max_age = max_age
+        self._httpd = None
+
+    def _sign(self, token):
+        return hmac.new(self.secret, token.encode("ascii"), hashlib.sha256).hexdigest()[:16]
+
+    def url_for(self, source_url, size):
+        token = base64.urlsafe_b64encode(source_url.encode("utf-8")).decode("ascii").rstrip("=")
+        return f"{self.public_url}/img/{size}/{token}.{self._sign(token)}"
+
+    def resolve(self, path):
+        # 路徑 -> (來源網址, 尺寸)；不合法時回傳 None
+        parts = path.split("?")[0].strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "img" or parts[1] not in self.cache.sizes:
+            return None
+        token, _, sig = parts[2].partition(".")
+        if not hmac.compare_digest(sig, self._sign(token)):
+            return None
+        source = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8")
+        return source, parts[1]
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                resolved = server.resolve(self.path)
+                if resolved is None:
+                    self.send_error(404)
+                    return
+                try:
+                    path = server.cache.get(*resolved)
+                    etag = f'"{os.path.basename(path)}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    with open(path, "rb") as f:
+                        data = f.read()
+                except Exception:
+                    # 下載失敗，或檔案剛好被刪除
+                    self.send_error(502)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPES.get(path.rsplit(".", 1)[-1], "application/octet-stream"))
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", f"public, max-age={server.max_age}, immutable")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, name="image-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
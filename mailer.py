@@ -0,0 +1,137 @@
+# 非同步寄信佇列
+# 頁面只負責把信件放進佇列就返回；背景執行緒沿用已登入的 SMTP 連線寄送，
+# 連線中斷時自動重連，失敗以指數退避重試，並限制每分鐘寄送數量。
+
+import heapq
+import itertools
+import smtplib
+import threading
+import time
+
+
+def _notify(on_done, ok, error):
+    if on_done is None:
+        return
+    try:
+        on_done(ok, error)
+    except Exception as e:
+        print(f"Email Callback Error: {e}")
+
+
+class SmtpOutbox:
+    def __init__(self, host, port, username=None, password=None, use_tls=True,
+                 per_minute=20, max_attempts=5, backoff=2, idle_timeout=120,
+                 smtp_factory=smtplib.SMTP):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.min_interval = 60.0 / per_minute if per_minute else 0
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.smtp_factory = smtp_factory
+
+        self.sent = 0
+        self.failed = 0
+        self.last_error = None
+
+        self._heap = []  # (ready_at, seq, attempt, msg, on_done)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._server = None
+        self._last_used = 0
+        self._last_sent = 0
+        self._thread = threading.Thread(target=self._run, name="smtp-outbox", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    # --- 佇列 ---
+    def enqueue(self, msg, on_done=None):
+        # on_done(ok, error) 於寄送成功或放棄重試後呼叫 (在背景執行緒)
+        with self._cond:
+            heapq.heappush(self._heap, (time.time(), next(self._seq), 0, msg, on_done))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)
+                    self._cond.wait(wait)
+                else:
+                    # 閒置太久就關閉連線
+                    if not self._cond.wait(self.idle_timeout):
+                        self._close()
+
+    # --- SMTP 連線 ---
+    def _connect(self):
+        server = self.smtp_factory(self.host, self.port, timeout=30)
+        if self.use_tls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        self._server = server
+
+    def _close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def _ensure_connection(self):
+        if self._server is not None and time.time() - self._last_used > self.idle_timeout:
+            # 閒置過久的連線多半已被伺服器關閉，先確認
+            try:
+                if self._server.noop()[0] != 250:
+                    self._close()
+            except Exception:
+                self._close()
+        if self._server is None:
+            self._connect()
+
+    def _send(self, msg):
+        self._ensure_connection()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # 連線被伺服器中斷：重連一次
+            self._server = None
+            self._connect()
+            self._server.send_message(msg)
+        self._last_used = time.time()
+
+    # --- 背景執行緒 ---
+    def _run(self):
+        while True:
+            ready_at, seq, attempt, msg, on_done = self._next_job()
+            wait = self._last_sent + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self._send(msg)
+                self._last_sent = time.time()
+                self.sent += 1
+                _notify(on_done, True, None)
+            except Exception as e:
+                self._close()
+                self.last_error = str(e)
+                print(f"Email Error: {e}")
+                if isinstance(e, smtplib.SMTPRecipientsRefused) or attempt + 1 >= self.max_attempts:
+                    self.failed += 1
+                    _notify(on_done, False, str(e))
+                    continue
+                with self._cond:
+                    retry_at = time.time() + self.backoff * (2 ** attempt)
+                    heapq.heappush(self._heap, (retry_at, seq, attempt + 1, msg, on_done))
@@ -0,0 +1,61 @@
+# 訂單編號
+# 新格式 ORD-<YYYYmmddHHMMSS>-<節點>-<序號>：同一個程序內遞增，不同程序 (多台主機) 以節點代號區分，
+# 不需要讀取 Orders 就能保證不重複。舊格式 ORD-<YYYYmmddHHMMSS> 仍可解析。
+
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+_ORDER_ID = re.compile(r"^ORD-(\d{14})(?:-([0-9A-Z]+)-(\d+))?$")
+_NODE_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"  # 不含容易混淆的 I / L / O / U
+
+
+def random_node_id(length=4):
+    return "".join(_NODE_ALPHABET[b % 32] for b in os.urandom(length))
+
+
+def normalize_order_id(value):
+    return str(value or "").strip().upper()
+
+
+def parse_order_id(value):
+    # 回傳 {"time", "node", "seq"}；舊格式 node / seq 為 None；不是訂單編號回傳 None
+    m = _ORDER_ID.match(normalize_order_id(value))
+    if not m:
+        return None
+    stamp, node, seq = m.groups()
+    try:
+        ts = datetime.strptime(stamp, "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return {"time": ts, "node": node, "seq": None if seq is None else int(seq)}
+
+
+class OrderIdAllocator:
+    # node_id: 每個程序 (每台主機) 不同的代號；未指定時隨機產生
+    def __init__(self, node_id=None, clock=time.time):
+        node_id = normalize_order_id(node_id) or random_node_id()
+        if not re.fullmatch(r"[0-9A-Z]+", node_id):
+            raise ValueError(f"節點代號只能包含英數字: {node_id}")
+        self.node_id = node_id
+        self.clock = clock
+        self._lock = threading.Lock()
+        # 從啟動後的下一秒開始編號：同一個節點重新啟動時不會與上一個程序最後一秒的編號重複
+        self._stamp = self._format(clock() + 1)
+        self._seq = -1
+
+    @staticmethod
+    def _format(seconds):
+        return datetime.fromtimestamp(int(seconds)).strftime("%Y%m%d%H%M%S")
+
+    def next(self):
+        with self._lock:
+            stamp = self._format(self.clock())
+            if stamp > self._stamp:
+                self._stamp, self._seq = stamp, 0
+            else:
+                # 同一秒 (或時鐘倒退)：沿用上一個時間，序號遞增
+                self._seq += 1
+            return f"ORD-{self._stamp}-{self.node_id}-{self._seq:03d}"
@@ -0,0 +1,109 @@
+# 訂單明細表
+# 把 Orders 的 Items_Json 一次展開成一張正規化的明細表，以內容雜湊為 key 快取，
+# 歷史訂單、管理後台與數據分析共用同一份；無法解析的訂單會列在 errors。
+
+import hashlib
+import json
+import threading
+
+import pandas as pd
+
+ITEM_COLUMNS = ["Order_ID", "Product_ID", "Name", "Spec", "Brand", "Qty", "Unit_Price", "Subtotal"]
+
+
+def orders_fingerprint(orders):
+    if orders.empty or "Items_Json" not in orders.columns:
+        return "empty"
+    hashed = pd.util.hash_pandas_object(orders[["Order_ID", "Items_Json"]].astype(str), index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+
+def _to_int(value):
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_items(raw):
+    # 單筆訂單的 Items_Json -> [(Product_ID, Name, Spec, Brand, Qty, Unit_Price, Subtotal)]；格式錯誤時拋出例外
+    # 明細表與銷售統計的增量更新都用這個函式，兩邊的金額一致
+    items = json.loads(raw)
+    if not isinstance(items, dict):
+        raise ValueError("Items_Json 不是物件格式")
+    rows = []
+    for key, item in items.items():
+        qty = _to_int(item.get("qty", 0))
+        unit = item.get("final_unit_price", item.get("wholesale_price", 0))
+        subtotal = item.get("final_subtotal")
+        rows.append((
+            str(item.get("id", key)),
+            item.get("name", "Unknown"),
+            item.get("spec", ""),
+            item.get("brand", "Unknown"),
+            qty,
+            _to_int(unit),
+            _to_int(subtotal) if subtotal is not None else _to_int(unit) * qty,
+        ))
+    return rows
+
+
+def build_line_items(orders):
+    rows = []
+    errors = []
+    if orders.empty or "Items_Json" not in orders.columns:
+        return pd.DataFrame(columns=ITEM_COLUMNS), pd.DataFrame(columns=["Order_ID", "Error"])
+    for order_id, raw in zip(orders["Order_ID"].astype(str), orders["Items_Json"]):
+        try:
+            rows.extend((order_id, *row) for row in parse_items(raw))
+        except Exception as e:
+            errors.append((order_id, f"{type(e).__name__}: {e}"))
+    table = pd.DataFrame.from_records(rows, columns=ITEM_COLUMNS)
+    table["Qty"] = table["Qty"].astype("int32")
+    table["Unit_Price"] = table["Unit_Price"].astype("int32")
+    table["Subtotal"] = table["Subtotal"].astype("int64")
+    return table, pd.DataFrame.from_records(errors, columns=["Order_ID", "Error"])
+
+
+class OrderItems:
+    def __init__(self, orders):
+        self.fingerprint = orders_fingerprint(orders)
+        self.table, self.errors = build_line_items(orders)
+        self._bad = set(self.errors["Order_ID"])
+        self._by_order = self.table.groupby("Order_ID", sort=False).indices if not self.table.empty else {}
+
+    def for_order(self, order_id):
+        # 回傳該訂單的明細 (list of dict)；解析失敗回傳 None
+        order_id = str(order_id)
+        if order_id in self._bad:
+            return None
+        positions = self._by_order.get(order_id)
+        if positions is None:
+            return []
+        return self.table.iloc[positions].to_dict("records")
+
+    def orders_with_brands(self, brands):
+        return set(self.table.loc[self.table["Brand"].isin(brands), "Order_ID"])
+
+
+class OrderItemsCache:
+    # 以內容雜湊快取最近幾份明細表 (process-wide)
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, orders):
+        key = orders_fingerprint(orders)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                # 移到最後 (最近使用)
+                self._entries[key] = self._entries.pop(key)
+                return cached
+        built = OrderItems(orders)
+        with self._lock:
+            self._entries[key] = built
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        return built
@@ -0,0 +1,419 @@
+# 本地訂單儲存 (SQLite)
+# 訂單以本地資料庫為主，結帳 / 修改只寫入單筆資料，
+# 再由背景執行緒把變更同步回 Google Sheet 的 "Orders" 分頁。
+# 每筆訂單有版本號 (rev)：修改時只有版本沒變才寫入 (樂觀並行控制)，
+# 其他程序搶先修改時以最新資料重新合併再試，不需要全域鎖也不會蓋掉別人的修改。
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from sheet_sync import changed_fields
+
+ORDER_COLUMNS = [
+    "Order_ID", "Order_Time", "Customer_Name", "Email", "Phone", "Items_Json",
+    "Subtotal", "Tax", "Shipping", "Total", "Status", "Extra_Discount",
+    "Tracking_Number", "Admin_Note",
+]
+
+
+def _plain(value):
+    # numpy / pandas 型別轉成可 JSON 序列化的 Python 原生型別
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def _compact(rec):
+    return {k: v for k, v in rec.items() if v is not None}
+
+
+class ConflictError(Exception):
+    # 重試多次仍與其他寫入者衝突
+    pass
+
+
+class OrderStore:
+    def __init__(self, path, retries=10):
+        self.path = path
+        self.retries = retries
+        self.conflicts = 0  # 條件式寫入失敗 (被其他寫入者搶先) 的次數
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # 訂單先寫入本地才回應客戶：每次提交都確實寫入磁碟
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS orders ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " order_id TEXT UNIQUE NOT NULL,"
+            " data TEXT NOT NULL,"
+            " rev INTEGER NOT NULL DEFAULT 1,"
+            " synced_rev INTEGER NOT NULL DEFAULT 0,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # 每次寫入遞增，供快取判斷資料是否有變
+        self.version = 0
+
+    # --- meta ---
+    def _get_meta(self, key, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def columns(self):
+        return self._get_meta("columns", list(ORDER_COLUMNS))
+
+    def _merge_columns(self, keys):
+        cols = self.columns()
+        new_cols = [k for k in keys if k not in cols]
+        if new_cols:
+            self._set_meta("columns", cols + new_cols)
+
+    def is_seeded(self):
+        return bool(self._get_meta("seeded", False))
+
+    def _set_sheet_base(self, df):
+        self._set_meta("sheet_base", {
+            "columns": [str(c) for c in df.columns],
+            "rows": [[_plain(v) for v in row] for row in df.itertuples(index=False, name=None)],
+        })
+
+    def sheet_base(self):
+        # 最後一次同步時 Sheet 上的 Orders (三方合併的基準)；保存在資料庫裡，重新啟動後仍然可用
+        with self._lock:
+            base = self._get_meta("sheet_base")
+        return None if base is None else pd.DataFrame(base["rows"], columns=base["columns"])
+
+    # --- 寫入 ---
+    def seed(self, df):
+        # 第一次啟動時從 Sheet 匯入既有訂單 (視為已同步)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("DELETE FROM orders")
+                cols = [str(c) for c in df.columns] if df is not None else []
+                self._set_meta("columns", list(dict.fromkeys(cols + ORDER_COLUMNS)))
+                if df is not None and not df.empty:
+                    rows = []
+                    for rec in df.to_dict("records"):
+                        rec = {k: _plain(v) for k, v in rec.items()}
+                        if not rec.get("Order_ID"):
+                            continue
+                        rows.append((str(rec["Order_ID"]), json.dumps(rec, ensure_ascii=False), now))
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO orders (order_id, data, rev, synced_rev, updated_at) VALUES (?, ?, 1, 1, ?)",
+                        rows,
+                    )
+                self._set_meta("seeded", True)
+                if df is not None:
+                    self._set_sheet_base(df)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self.version += 1
+
+    def append(self, order):
+        rec = {k: _plain(v) for k, v in order.items()}
+        with self._lock:
+            self._merge_columns(rec.keys())
+            self._db.execute(
+                "INSERT INTO orders (order_id, data, updated_at) VALUES (?, ?, ?)",
+                (str(rec["Order_ID"]), json.dumps(rec, ensure_ascii=False), time.time()),
+            )
+            self.version += 1
+
+    def _load(self, order_id):
+        row = self._db.execute("SELECT data, rev FROM orders WHERE order_id = ?", (str(order_id),)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+    def _write_if_unchanged(self, order_id, rec, rev):
+        # 條件式寫入：版本仍是 rev 才寫入，回傳是否成功
+        cur = self._db.execute(
+            "UPDATE orders SET data = ?, rev = rev + 1, updated_at = ? WHERE order_id = ? AND rev = ?",
+            (json.dumps(rec, ensure_ascii=False), time.time(), str(order_id), rev),
+        )
+        if cur.rowcount == 1:
+            return True
+        self.conflicts += 1
+        return False
+
+    def _fields(self, change, rec):
+        # change: {欄位: 值} 或 change(最新資料) -> {欄位: 值}
+        fields = change(dict(rec)) if callable(change) else change
+        return {k: _plain(v) for k, v in fields.items()}
+
+    def update(self, order_id, fields, base=None):
+        # 修改單筆訂單；base 為呼叫端當初讀到的資料時，只寫入實際修改過的欄位。
+        # 版本衝突時以最新資料重新套用 (fields 可為函式，依最新資料計算)
+        if base is not None and not callable(fields):
+            fields = changed_fields(base, fields)
+        with self._lock:
+            for _ in range(self.retries):
+                rec, rev = self._load(order_id)
+                if rec is None:
+                    return False
+                changes = self._fields(fields, rec)
+                if not changes:
+                    return True
+                self._merge_columns(changes.keys())
+                rec.update(changes)
+                if self._write_if_unchanged(order_id, rec, rev):
+                    self.version += 1
+                    return True
+        raise ConflictError(f"訂單 {order_id} 同時被多處修改，請稍後再試")
+
+    def update_many(self, updates):
+        # updates: {order_id: {欄位: 值} 或函式}，同一個交易內完成；回傳實際更新的訂單編號
+        # 交易期間有其他程序寫入時整批以最新資料重來
+        with self._lock:
+            for _ in range(self.retries):
+                done = []
+                ok = True
+                self._db.execute("BEGIN")
+                try:
+                    for order_id, change in updates.items():
+                        rec, rev = self._load(order_id)
+                        if rec is None:
+                            continue
+                        changes = self._fields(change, rec)
+                        self._merge_columns(changes.keys())
+                        rec.update(changes)
+                        if not self._write_if_unchanged(order_id, rec, rev):
+                            ok = False
+                            break
+                        done.append(order_id)
+                    self._db.execute("COMMIT" if ok else "ROLLBACK")
+                except sqlite3.OperationalError as e:
+                    # WAL 模式下，交易開始後其他程序已寫入時無法提交 (database is locked)
+                    self._db.execute("ROLLBACK")
+                    if "locked" not in str(e) and "busy" not in str(e):
+                        raise
+                    self.conflicts += 1
+                    ok = False
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+                if ok:
+                    if done:
+                        self.version += 1
+                    return done
+        raise ConflictError("訂單同時被多處修改，請稍後再試")
+
+    def replace_all(self, df):
+        # 相容舊的整表寫入：逐筆 upsert，有變動的列才標記為待同步
+        with self._lock:
+            keep = set()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                current = {oid: json.loads(data) for oid, data in self._db.execute("SELECT order_id, data FROM orders")}
+                self._merge_columns([str(c) for c in df.columns])
+                for rec in df.to_dict("records"):
+                    rec = {k: _plain(v) for k, v in rec.items()}
+                    if not rec.get("Order_ID"):
+                        continue
+                    oid = str(rec["Order_ID"])
+                    keep.add(oid)
+                    payload = json.dumps(rec, ensure_ascii=False)
+                    if oid not in current:
+                        self._db.execute(
+                            "INSERT INTO orders (order_id, data, updated_at) VALUES (?, ?, ?)",
+                            (oid, payload, time.time()),
+                        )
+                    elif _compact(current[oid]) != _compact(rec):
+                        self._db.execute(
+                            "UPDATE orders SET data = ?, rev = rev + 1, updated_at = ? WHERE order_id = ?",
+                            (payload, time.time(), oid),
+                        )
+                removed = [oid for oid in current if oid not in keep]
+                if removed:
+                    self._db.executemany("DELETE FROM orders WHERE order_id = ?", [(oid,) for oid in removed])
+                    self._set_meta("needs_full_sync", True)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self.version += 1
+
+    def absorb(self, df):
+        # 套用 Sheet 合併後的內容 (其他程序新增 / 修改 / 刪除的訂單)；本地尚未同步的訂單不動
+        # df 同時存成下一次合併的基準
+        changed = False
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                local = {oid: (json.loads(data), rev, synced)
+                         for oid, data, rev, synced in self._db.execute("SELECT order_id, data, rev, synced_rev FROM orders")}
+                self._merge_columns([str(c) for c in df.columns])
+                seen = set()
+                now = time.time()
+                for rec in df.to_dict("records"):
+                    rec = {k: _plain(v) for k, v in rec.items()}
+                    if not rec.get("Order_ID"):
+                        continue
+                    oid = str(rec["Order_ID"])
+                    seen.add(oid)
+                    if oid not in local:
+                        self._db.execute(
+                            "INSERT INTO orders (order_id, data, rev, synced_rev, updated_at) VALUES (?, ?, 1, 1, ?)",
+                            (oid, json.dumps(rec, ensure_ascii=False), now),
+                        )
+                        changed = True
+                        continue
+                    old, rev, synced = local[oid]
+                    if rev == synced and changed_fields(old, rec):
+                        self._db.execute(
+                            "UPDATE orders SET data = ?, updated_at = ? WHERE order_id = ? AND rev = ?",
+                            (json.dumps(rec, ensure_ascii=False), now, oid, rev),
+                        )
+                        changed = True
+                removed = [(oid,) for oid, (_, rev, synced) in local.items() if oid not in seen and rev == synced]
+                if removed:
+                    self._db.executemany("DELETE FROM orders WHERE order_id = ? AND rev = synced_rev", removed)
+                    changed = True
+                self._set_sheet_base(df)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if changed:
+                self.version += 1
+        return changed
+
+    # --- 讀取 ---
+    def get(self, order_id):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM orders WHERE order_id = ?", (str(order_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def to_dataframe(self):
+        with self._lock:
+            records = [json.loads(d) for (d,) in self._db.execute("SELECT data FROM orders ORDER BY seq")]
+            cols = self.columns()
+        df = pd.DataFrame.from_records(records)
+        return df.reindex(columns=cols + [c for c in df.columns if c not in cols])
+
+    # --- 同步狀態 ---
+    def pending(self):
+        # 回傳尚未同步的 (order_id, rev)
+        with self._lock:
+            rows = self._db.execute("SELECT order_id, rev FROM orders WHERE rev > synced_rev ORDER BY seq").fetchall()
+            if self._get_meta("needs_full_sync", False) and not rows:
+                rows = [(None, 0)]
+            return rows
+
+    def sync_states(self, order_ids=None):
+        # {order_id: True (已同步到 Sheet) / False (尚未同步)}
+        with self._lock:
+            rows = self._db.execute("SELECT order_id, rev <= synced_rev FROM orders").fetchall()
+        if order_ids is not None:
+            wanted = set(map(str, order_ids))
+            rows = [r for r in rows if r[0] in wanted]
+        return {oid: bool(synced) for oid, synced in rows}
+
+    def mark_synced(self, revs):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE orders SET synced_rev = ? WHERE order_id = ? AND rev = ?",
+                [(rev, oid, rev) for oid, rev in revs if oid is not None],
+            )
+            self._set_meta("needs_full_sync", False)
+
+
+class OrderSyncWorker:
+    # 背景執行緒：把本地訂單變更寫回 Sheet，失敗時指數退避重試
+    # queue: 延遲寫入佇列 (WriteBehindQueue)；有提供時 notify() 交給佇列，短時間內的多筆變更合併成一次寫入
+    # pull(): 讀取 Sheet 目前的 Orders；每 pull_interval 秒套用回本地 (Sheet 上直接修改、其他程序新增的訂單)
+    # on_change(): 本地訂單因 Sheet 內容而改變時呼叫 (例如重新計算統計)
+    def __init__(self, store, push, interval=5, max_backoff=300, queue=None, pull=None, pull_interval=60, on_change=None):
+        self.store = store
+        self.push = push
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.queue = queue
+        self.pull = pull
+        self.pull_interval = pull_interval
+        self.on_change = on_change
+        self.last_error = None
+        self.last_sync = None
+        self.last_pull = None
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="order-sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def notify(self):
+        # 有佇列時回傳 PendingWrite (可等待確認已寫入 Sheet)
+        if self.queue is not None:
+            return self.queue.submit("Orders", self.sync_once)
+        self._wake.set()
+
+    def sync_once(self):
+        # push(df) 可回傳合併後的完整內容 (含其他程序的修改)，會再套用回本地
+        with self._sync_lock:
+            revs = self.store.pending()
+            if not revs:
+                return False
+            try:
+                merged = self.push(self.store.to_dataframe())
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+            self.store.mark_synced(revs)
+            changed = merged is not None and self.store.absorb(merged)
+            self.last_sync = self.last_pull = time.time()
+            self.last_error = None
+        if changed and self.on_change is not None:
+            self.on_change()
+        return True
+
+    def pull_once(self):
+        # 有待同步的修改時略過 (下一次寫入前本來就會讀取並合併)
+        with self._sync_lock:
+            if self.pull is None or self.store.pending():
+                return False
+            changed = self.store.absorb(self.pull())
+            self.last_pull = time.time()
+        if changed and self.on_change is not None:
+            self.on_change()
+        return changed
+
+    def _pull_due(self):
+        return self.pull is not None and time.time() - (self.last_pull or 0) >= self.pull_interval
+
+    def _run(self):
+        backoff = self.interval
+        while True:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                self.sync_once()
+                if self._pull_due():
+                    self.pull_once()
+                backoff = self.interval
+            except Exception as e:
+                print(f"Order Sync Error: {e}")
+                backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,148 @@
+# 效能紀錄
+# 頁面各區塊的執行時間與每一次 Sheets 讀寫 (含重試、429、退避等待、實際送出的請求數) 都記成一筆事件，
+# 保存在程序內的環狀緩衝區 (只留最近 capacity 筆)，同時以 JSON 一行一筆寫入 log，
+# 供管理員頁面計算 p50 / p95 與每分鐘 API 呼叫數。
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from storage import StorageBackend
+
+logger = logging.getLogger("b2b.perf")
+
+
+class PerfMonitor:
+    # log_path: 另外把事件寫入檔案 (JSON Lines)；未設定時只送到 "b2b.perf" logger
+    def __init__(self, capacity=5000, log_path=None):
+        self.capacity = capacity
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        if log_path and not any(getattr(h, "baseFilename", None) == log_path for h in logger.handlers):
+            handler = logging.FileHandler(log_path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+
+    def record(self, kind, name, seconds, **fields):
+        event = {"ts": round(time.time(), 3), "kind": kind, "name": name, "ms": round(seconds * 1000, 2), **fields}
+        with self._lock:
+            self._events.append(event)
+        logger.info(json.dumps(event, ensure_ascii=False))
+        return event
+
+    @contextmanager
+    def section(self, name):
+        # 計時一段程式；st.rerun / st.stop 等流程控制不算失敗
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except Exception:
+            ok = False
+            raise
+        finally:
+            self.record("section", name, time.perf_counter() - start, ok=ok)
+
+    def events(self, kind=None, since=None):
+        with self._lock:
+            events = list(self._events)
+        return [e for e in events if (kind is None or e["kind"] == kind) and (since is None or e["ts"] >= since)]
+
+    def frame(self, kind=None, since=None):
+        return pd.DataFrame(self.events(kind, since))
+
+    def summary(self, kind, by=("name",), since=None):
+        # 依 by 分組：次數、p50 / p95 / 最大值 (毫秒)；API 事件另外加總重試、429 與退避秒數
+        # 由快取回應或合併到別人讀取的事件只計入次數，不算進耗時 (否則 p50 會被幾乎 0 毫秒的快取壓低)
+        df = self.frame(kind, since)
+        if df.empty:
+            return pd.DataFrame()
+        by = [c for c in by if c in df.columns]
+        shared = pd.Series(False, index=df.index)
+        for col in ("cached", "coalesced"):
+            if col in df.columns:
+                shared |= df[col].fillna(False).astype(bool)
+        grouped = df[~shared].groupby(by, dropna=False)["ms"]
+        out = pd.DataFrame({
+            "count": df.groupby(by, dropna=False).size(),
+            "p50_ms": grouped.quantile(0.5).round(1),
+            "p95_ms": grouped.quantile(0.95).round(1),
+            "max_ms": grouped.max().round(1),
+        })
+        for col in ("requests", "retries", "rate_limited", "backoff", "queued", "cached", "coalesced", "errors"):
+            if col in df.columns:
+                out[col] = df.groupby(by, dropna=False)[col].sum()
+        return out.reset_index().sort_values("p95_ms", ascending=False)
+
+    def calls_per_minute(self, minutes=30):
+        # 最近 minutes 分鐘，每分鐘實際送出的 API 請求數 (含重試；快取回應、合併到別人的讀取都沒有送出請求)
+        now = time.time()
+        df = self.frame("api", since=now - minutes * 60)
+        # 以本機時間顯示 (與訂單時間一致)
+        index = pd.date_range(end=pd.Timestamp(datetime.fromtimestamp(now)).floor("min"), periods=minutes, freq="min")
+        if df.empty:
+            return pd.Series(0, index=index, name="calls")
+        df = df[df["network"].astype(bool)]
+        minute = pd.to_datetime(df["ts"].map(datetime.fromtimestamp)).dt.floor("min")
+        return df["requests"].groupby(minute).sum().reindex(index, fill_value=0).rename("calls")
+
+
+class InstrumentedBackend(StorageBackend):
+    # 記錄每一次讀寫的分頁、耗時與結果；排程器後端另外提供重試 / 429 / 等待時間
+    def __init__(self, backend, monitor):
+        self.backend = backend
+        self.monitor = monitor
+        self.kind = backend.kind
+        self.key = backend.key
+
+    def _timed(self, op, worksheet, fn):
+        start = time.perf_counter()
+        ok = True
+        try:
+            return fn()
+        except Exception:
+            ok = False
+            raise
+        finally:
+            info = self.backend.last_call()
+            # requests: 實際送出的 API 請求數 (一次 update 是好幾個請求)；沒有排程器統計時，
+            # Sheets 以每個操作的請求數估計，本地檔案不經過網路
+            requests = info.get("requests", self.backend.api_calls(op) if self.kind == "sheets" else 0)
+            self.monitor.record(
+                "api", f"{op}:{worksheet}", time.perf_counter() - start, op=op, worksheet=worksheet,
+                errors=0 if ok else 1, attempts=info.get("attempts", 1), retries=max(info.get("attempts", 1) - 1, 0),
+                requests=requests, network=requests > 0, cached=bool(info.get("cached", False)),
+                rate_limited=info.get("rate_limited", 0), backoff=round(info.get("backoff", 0.0), 3),
+                queued=round(info.get("queued", 0.0), 3), coalesced=bool(info.get("coalesced", False)),
+            )
+
+    def read(self, worksheet, ttl=3600):
+        return self._timed("read", worksheet, lambda: self.backend.read(worksheet, ttl=ttl))
+
+    def update(self, worksheet, df):
+        return self._timed("update", worksheet, lambda: self.backend.update(worksheet, df))
+
+    def append_rows(self, worksheet, df):
+        return self._timed("append", worksheet, lambda: self.backend.append_rows(worksheet, df))
+
+    def update_cells(self, worksheet, ranges, n_rows):
+        return self._timed("update_cells", worksheet, lambda: self.backend.update_cells(worksheet, ranges, n_rows))
+
+    def background(self):
+        return self.backend.background()
+
+    def last_call(self):
+        return self.backend.last_call()
+
+    def cached(self, worksheet, ttl):
+        return self.backend.cached(worksheet, ttl)
+
+    def api_calls(self, op):
+        return self.backend.api_calls(op)
@@ -0,0 +1,231 @@
+# Google Sheets 請求排程
+# 全站共用一個 token bucket (依專案配額)，所有讀寫都經過這裡：
+# 同一分頁同時間的讀取合併成一次請求，寫入優先於背景重新整理，
+# 遇到 429 時全站一起暫停退避，而不是每個 session 各自 sleep 重試。
+# 每次操作依實際送出的 API 請求數扣額度；由快取回應的讀取不扣。
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from storage import StorageBackend, ttl_seconds
+
+# 優先順序 (數字小的先執行)
+WRITE, READ, BACKGROUND = 0, 1, 2
+
+
+def is_rate_limited(error):
+    text = str(error)
+    return "429" in text or "Quota exceeded" in text or "RATE_LIMIT_EXCEEDED" in text
+
+
+class _Flight:
+    # 進行中的讀取；同一分頁的其他讀取等待並共用結果
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.started = False  # 請求是否已送出 (還在排隊時加入的呼叫端一定拿到呼叫之後的內容)
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class RequestScheduler:
+    # per_minute: 每分鐘可用的請求數 (Sheets API 預設每位使用者每分鐘 60 次)；burst: 可累積的額度
+    def __init__(self, per_minute=60, burst=10, max_retries=5, backoff=2, max_backoff=64, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+
+        self.calls = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._waiting = []  # (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._inflight = {}
+        self._local = threading.local()
+
+    # --- 優先順序 ---
+    @contextmanager
+    def background(self):
+        # 在此區塊內 (同一執行緒) 的讀取以背景優先順序排隊
+        previous = getattr(self._local, "priority", None)
+        self._local.priority = BACKGROUND
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _priority(self, priority):
+        if priority is not None:
+            return priority
+        return getattr(self._local, "priority", None) or READ
+
+    # --- token bucket ---
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=READ, cost=1):
+        # 排隊直到輪到自己、且有 cost 個可用額度 (cost 不超過 burst)
+        cost = min(max(cost, 1), self.capacity)
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    wait = None  # 還沒輪到：等前面的人通知
+                    if self._waiting[0] == ticket:
+                        wait = self._paused_until - now
+                        if wait <= 0:
+                            if self._tokens >= cost:
+                                self._tokens -= cost
+                                self.calls += cost
+                                heapq.heappop(self._waiting)
+                                self._cond.notify_all()
+                                return
+                            wait = (cost - self._tokens) / self.rate
+                    self._cond.wait(wait)
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def _throttle(self, attempt):
+        # 收到 429：全站暫停一段時間 (指數退避 + 隨機抖動)，並清空累積的額度
+        with self._cond:
+            self.throttled += 1
+            delay = min(self.backoff * (2 ** attempt), self.max_backoff) + random.random()
+            self._paused_until = max(self._paused_until, self.clock() + delay)
+            self._tokens = 0.0
+            self._cond.notify_all()
+
+    # --- 執行 ---
+    def last_call(self):
+        # 這個執行緒最近一次 call / read 的統計：嘗試次數、429 次數、排隊與退避等待秒數、是否合併到別人的讀取
+        return dict(getattr(self._local, "last", None) or {})
+
+    def call(self, fn, priority=None, cost=1):
+        # cost: 這個操作實際送出的 API 請求數
+        priority = self._priority(priority)
+        info = self._local.last = {"attempts": 0, "requests": 0, "rate_limited": 0, "queued": 0.0, "backoff": 0.0, "coalesced": False}
+        for attempt in range(self.max_retries):
+            started = self.clock()
+            self.acquire(priority, cost)
+            info["backoff" if attempt else "queued"] += self.clock() - started
+            info["attempts"] += 1
+            info["requests"] += cost
+            try:
+                return fn()
+            except Exception as e:
+                if is_rate_limited(e):
+                    info["rate_limited"] += 1
+                if not is_rate_limited(e) or attempt == self.max_retries - 1:
+                    raise
+                self._throttle(attempt)
+
+    def bypass(self, fn):
+        # 不送出請求的操作 (例如由快取回應的讀取)：不排隊、不扣額度
+        self._local.last = {"attempts": 0, "requests": 0, "rate_limited": 0, "queued": 0.0, "backoff": 0.0, "coalesced": False, "cached": True}
+        return fn()
+
+    def read(self, key, fn, priority=None, cost=1, fresh=False):
+        # 同一個 key 同時間只送出一次請求，其他呼叫端共用結果
+        # fresh: 需要呼叫當下之後的內容 (例如寫入後重讀)：只加入還在排隊、尚未送出的請求，
+        # 已經送出的請求可能早於最近一次寫入，改為送出新的請求 (之後到的 fresh 讀取再加入這一個)
+        with self._cond:
+            flight = self._inflight.get(key)
+            leader = flight is None or (fresh and flight.started)
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            self._local.last = {"attempts": 0, "requests": 0, "rate_limited": 0, "queued": 0.0, "backoff": 0.0, "coalesced": True}
+            return flight.wait()
+        def fetch():
+            with self._cond:
+                flight.started = True
+            return fn()
+        try:
+            flight.result = self.call(fetch, priority, cost)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._cond:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._cond:
+            self._refill(self.clock())
+            return {
+                "tokens": round(self._tokens, 2),
+                "waiting": len(self._waiting),
+                "paused_for": round(max(self._paused_until - self.clock(), 0), 1),
+                "inflight": len(self._inflight),
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "throttled": self.throttled,
+            }
+
+
+class ScheduledBackend(StorageBackend):
+    # 讓儲存後端的所有請求經過排程器：讀取合併、寫入優先
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.kind = backend.kind
+        self.key = backend.key
+
+    def read(self, worksheet, ttl=3600):
+        fetch = lambda: self.backend.read(worksheet, ttl=ttl)
+        if ttl_seconds(ttl) <= 0:
+            # 要求最新內容：只合併呼叫之後才送出的讀取 (不加入已送出、可能早於最近一次寫入的讀取)
+            return self.scheduler.read((worksheet, 0), fetch, cost=self.backend.api_calls("read"), fresh=True)
+        if self.backend.cached(worksheet, ttl):
+            return self.scheduler.bypass(fetch)
+        return self.scheduler.read((worksheet, ttl_seconds(ttl)), fetch, cost=self.backend.api_calls("read"))
+
+    def background(self):
+        return self.scheduler.background()
+
+    def last_call(self):
+        return self.scheduler.last_call()
+
+    def cached(self, worksheet, ttl):
+        return self.backend.cached(worksheet, ttl)
+
+    def api_calls(self, op):
+        return self.backend.api_calls(op)
+
+    def update(self, worksheet, df):
+        return self.scheduler.call(lambda: self.backend.update(worksheet, df), WRITE, self.backend.api_calls("update"))
+
+    def append_rows(self, worksheet, df):
+        return self.scheduler.call(lambda: self.backend.append_rows(worksheet, df), WRITE, self.backend.api_calls("append"))
+
+    def update_cells(self, worksheet, ranges, n_rows):
+        return self.scheduler.call(lambda: self.backend.update_cells(worksheet, ranges, n_rows), WRITE, self.backend.api_calls("update_cells"))
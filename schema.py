@@ -0,0 +1,141 @@
+# 各分頁的欄位定義
+# dtype: "str" 字串 (去除前後空白)、"category" 類別、"int" 整數、"float" 浮點數、
+#        "price" 整數價格 (有小數的列整列略過並記錄在 df.attrs["invalid_rows"]，不自動四捨五入)
+# required: 缺少時由呼叫端顯示錯誤；其他缺少的欄位以 default 補上
+
+import pandas as pd
+
+SCHEMAS = {
+    "Products": {
+        "columns": {
+            "Product_ID": "str",
+            "Name": "str",
+            "Brand": "category",
+            "Category": "category",
+            "Color": "category",
+            "Size": "category",
+            "Wholesale_Price": "price",
+            "Retail_Price": "price",
+            "Image_URL": "str",
+        },
+        "required": ["Product_ID", "Name", "Wholesale_Price"],
+        "defaults": {"Brand": "default", "Category": "", "Color": "", "Size": "", "Retail_Price": 0, "Image_URL": ""},
+    },
+    "Orders": {
+        "columns": {
+            "Order_ID": "str",
+            "Order_Time": "str",
+            "Customer_Name": "str",
+            "Email": "str",
+            "Phone": "str",
+            "Items_Json": "str",
+            "Subtotal": "int",
+            "Tax": "int",
+            "Shipping": "int",
+            "Total": "int",
+            "Status": "str",
+            "Extra_Discount": "int",
+            "Tracking_Number": "str",
+            "Admin_Note": "str",
+        },
+        "required": ["Order_ID", "Items_Json"],
+        "defaults": {"Extra_Discount": 0, "Tracking_Number": "", "Admin_Note": ""},
+    },
+    "Users": {
+        "columns": {
+            "Username": "str",
+            "Password": "str",
+            "Dealer_Name": "str",
+            "Contact_Person": "str",
+            "Phone": "str",
+            "Address": "str",
+            "Allowed_Brands": "str",
+            "Contact_Email": "str",
+        },
+        "required": ["Username", "Dealer_Name"],
+        "defaults": {"Password": "", "Contact_Person": "", "Phone": "", "Address": "", "Allowed_Brands": "", "Contact_Email": ""},
+    },
+    "BrandRules": {
+        "columns": {
+            "Brand": "str",
+            "Wholesale_Threshold": "int",
+            "Shipping_Threshold": "int",
+            "Discount": "float",
+        },
+        "required": ["Brand"],
+        "defaults": {"Wholesale_Threshold": 10000, "Shipping_Threshold": 10000, "Discount": 0.7},
+    },
+}
+
+# int 欄位使用的實際型別 (價格、金額都在 int32 範圍內)
+INT_DTYPE = "int32"
+
+
+def _as_str(s, default=""):
+    if pd.api.types.is_float_dtype(s):
+        # 數字被 Sheet 讀成 float 時 (例如 1234.0)，還原成 "1234"
+        return s.map(lambda v: default if pd.isna(v) else (str(int(v)) if float(v).is_integer() else str(v)))
+    out = s.astype(object).where(s.notna(), default)
+    return out.astype(str).str.strip()
+
+
+def _convert(s, dtype, default):
+    if dtype == "str":
+        return _as_str(s, "" if default is None else str(default))
+    if dtype == "category":
+        return _as_str(s, "" if default is None else str(default)).astype("category")
+    num = pd.to_numeric(s, errors="coerce")
+    if dtype == "price":
+        # 有小數的列已由 apply_schema 略過
+        return num.fillna(default or 0).astype(INT_DTYPE)
+    if dtype == "int":
+        return num.fillna(default or 0).round().astype(INT_DTYPE)
+    return num.fillna(default or 0.0).astype("float64")
+
+
+def _fractional_prices(df, columns):
+    # 價格必須是整數：四捨五入會讓報價與 Sheet 上的價格不一致，有小數的列不載入
+    # 回傳 (要略過的列, 說明)；只影響那幾列，不讓一格錯誤擋住整張表
+    bad = pd.Series(False, index=df.index)
+    notes = []
+    for col, dtype in columns.items():
+        if dtype != "price" or col not in df.columns:
+            continue
+        num = pd.to_numeric(df[col], errors="coerce")
+        fractional = num.notna() & (num != num.round())
+        for pos in fractional.to_numpy().nonzero()[0]:
+            notes.append(f"第 {pos + 2} 列 {col}={df[col].iloc[pos]}")  # 第 1 列是標題
+        bad |= fractional
+    return bad, notes
+
+
+def missing_required(df, name):
+    schema = SCHEMAS.get(name)
+    if schema is None:
+        return []
+    return [c for c in schema["required"] if c not in df.columns]
+
+
+def apply_schema(df, name):
+    # 一次處理：欄名去空白、各欄轉型與清洗、補上預設欄位；未定義的字串欄位也去空白
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.strip()
+    schema = SCHEMAS.get(name, {"columns": {}, "required": [], "defaults": {}})
+    columns = schema["columns"]
+    defaults = schema["defaults"]
+    bad, notes = _fractional_prices(df, columns)
+    if notes:
+        print(f"Schema Warning ({name}): 略過 {int(bad.sum())} 列非整數價格: {'; '.join(notes[:5])}")
+        df = df[~bad].reset_index(drop=True)
+    df.attrs["invalid_rows"] = notes
+    for col in df.columns:
+        dtype = columns.get(col)
+        if dtype is not None:
+            df[col] = _convert(df[col], dtype, defaults.get(col))
+        elif df[col].dtype == "object" or pd.api.types.is_string_dtype(df[col]):
+            stripped = df[col].str.strip()
+            df[col] = stripped.where(stripped.notna(), df[col])
+    for col, default in defaults.items():
+        if col not in df.columns:
+            df[col] = _convert(pd.Series([default] * len(df), index=df.index, dtype=object), columns[col], default)
+    return df
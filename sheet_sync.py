@@ -0,0 +1,220 @@
+# Sheet 差異同步
+# 保留每個分頁最後一次寫入 (或讀取) 的快照，寫入時只送出有變動的儲存格範圍，
+# 以一次 batch update 完成，寫入量與修改幅度成正比，而不是與整張表大小成正比。
+# 指定主鍵欄位的分頁 (例如 Orders / Users) 寫入前會先讀取最新內容做三方合併，
+# 多個程序同時寫入同一分頁時不會互相覆蓋對方修改過的資料列。
+
+import math
+import threading
+
+import pandas as pd
+
+HEADER_ROWS = 1  # 第 1 列是標題，資料從第 2 列開始
+
+
+def col_letter(idx):
+    # 0 -> A, 25 -> Z, 26 -> AA
+    letters = ""
+    idx += 1
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def cell_value(value):
+    # 轉成可寫入 Sheet 的值 (與 gspread_dataframe 相同：空值寫成空字串)
+    if hasattr(value, "item"):
+        value = value.item()
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def _cell_key(value):
+    # 比對用：1250 與 1250.0 視為相同
+    value = cell_value(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def changed_fields(base, fields):
+    # 只保留與 base (呼叫端當初讀到的資料) 不同的欄位；沒動過的欄位不寫入，保留其他人同時做的修改
+    return {k: v for k, v in fields.items() if _cell_key(base.get(k)) != _cell_key(v)}
+
+
+def _rows(df):
+    return [[_cell_key(v) for v in row] for row in df.itertuples(index=False, name=None)]
+
+
+def diff_frames(old, new):
+    # 回傳 gspread batch_update 格式的範圍清單；欄位不同時回傳 None (需整表重寫)
+    if old is None or [str(c) for c in old.columns] != [str(c) for c in new.columns]:
+        return None
+    old_rows = _rows(old)
+    new_keys = _rows(new)
+    new_values = [[cell_value(v) for v in row] for row in new.itertuples(index=False, name=None)]
+    n_cols = len(new.columns)
+    ranges = []
+    for r, keys in enumerate(new_keys):
+        prev = old_rows[r] if r < len(old_rows) else None
+        sheet_row = r + 1 + HEADER_ROWS
+        if prev is None:
+            ranges.append({
+                "range": f"A{sheet_row}:{col_letter(n_cols - 1)}{sheet_row}",
+                "values": [new_values[r]],
+            })
+            continue
+        c = 0
+        while c < n_cols:
+            if keys[c] == prev[c]:
+                c += 1
+                continue
+            start = c
+            while c < n_cols and keys[c] != prev[c]:
+                c += 1
+            ranges.append({
+                "range": f"{col_letter(start)}{sheet_row}:{col_letter(c - 1)}{sheet_row}",
+                "values": [new_values[r][start:c]],
+            })
+    if len(old_rows) > len(new_keys):
+        # 多出來的舊資料列清空
+        first = len(new_keys) + 1 + HEADER_ROWS
+        last = len(old_rows) + HEADER_ROWS
+        ranges.append({
+            "range": f"A{first}:{col_letter(n_cols - 1)}{last}",
+            "values": [[""] * n_cols for _ in range(last - first + 1)],
+        })
+    return ranges
+
+
+def _records(df, key):
+    # 主鍵 -> 資料列 (dict)；主鍵空白或重複的列略過
+    out = {}
+    if df is None or key not in df.columns:
+        return out
+    for rec in df.to_dict("records"):
+        k = _cell_key(rec.get(key))
+        if k and k not in out:
+            out[k] = rec
+    return out
+
+
+def _same_row(a, b, columns):
+    return all(_cell_key(a.get(c)) == _cell_key(b.get(c)) for c in columns)
+
+
+def _merge_row(base, ours, theirs, columns):
+    # 回傳合併後的資料列；None 代表刪除
+    if ours is None and theirs is None:
+        return None
+    if base is None:
+        # 沒有基準 (新增的列，或基準遺失)：只有一邊有就用那一邊；兩邊都有時無法判斷我方改了什麼，以 Sheet 為準
+        return ours if theirs is None else theirs
+    if ours is None:
+        # 我方刪除：對方沒改過才刪
+        return None if _same_row(base, theirs, columns) else theirs
+    if theirs is None:
+        return None if _same_row(base, ours, columns) else ours
+    # 兩邊都在：我方改過的儲存格用我方，其餘用對方 (同一格兩邊都改時以我方為準)
+    return {c: ours.get(c) if _cell_key(ours.get(c)) != _cell_key(base.get(c)) else theirs.get(c) for c in columns}
+
+
+def merge_frames(base, ours, theirs, key):
+    # 三方合併：base = 上次同步時的內容、ours = 本程序要寫入的內容、theirs = Sheet 目前的內容
+    # 資料列以 key 欄位對應；對方新增的列保留在原位置，我方新增的列接在後面
+    # Sheet 上主鍵空白或重複的列無法對應，原樣保留在原位置
+    columns = [str(c) for c in theirs.columns] + [str(c) for c in ours.columns if str(c) not in set(map(str, theirs.columns))]
+    b, o, t = _records(base, key), _records(ours, key), _records(theirs, key)
+    rows = []
+    seen = set()
+    for rec in theirs.to_dict("records"):
+        k = _cell_key(rec.get(key)) if key in theirs.columns else ""
+        if not k or k in seen:
+            rows.append(rec)
+            continue
+        seen.add(k)
+        row = _merge_row(b.get(k), o.get(k), t[k], columns)
+        if row is not None:
+            rows.append(row)
+    for k in o:
+        if k not in t:
+            row = _merge_row(b.get(k), o[k], None, columns)
+            if row is not None:
+                rows.append(row)
+    return pd.DataFrame(rows, columns=columns)
+
+
+def count_cells(ranges):
+    return sum(len(row) for r in ranges for row in r["values"])
+
+
+class DeltaSync:
+    # write_full(worksheet, df)：整表覆寫
+    # write_ranges(worksheet, ranges, n_rows)：批次寫入指定範圍
+    # read(worksheet)：沒有快照時先讀一次 Sheet 當基準
+    # keys: {分頁: 主鍵欄位}；這些分頁每次寫入前都讀取最新內容，與上次同步的快照做三方合併後再寫入
+    def __init__(self, write_full, write_ranges, read=None, full_ratio=0.5, keys=None):
+        self.write_full = write_full
+        self.write_ranges = write_ranges
+        self.read = read
+        self.full_ratio = full_ratio
+        self.keys = dict(keys or {})
+        self.merges = 0  # 合併到其他寫入者修改的次數
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._ws_locks = {}
+
+    def _ws_lock(self, worksheet):
+        with self._lock:
+            return self._ws_locks.setdefault(worksheet, threading.Lock())
+
+    def prime(self, worksheet, df):
+        with self._lock:
+            self._snapshots[worksheet] = df.copy()
+
+    def forget(self, worksheet):
+        with self._lock:
+            self._snapshots.pop(worksheet, None)
+
+    def snapshot(self, worksheet):
+        with self._lock:
+            return self._snapshots.get(worksheet)
+
+    def write(self, worksheet, df):
+        # 回傳 ("full" | "delta" | "noop", 寫入的儲存格數)；合併後實際寫入的內容可由 snapshot() 取得
+        with self._ws_lock(worksheet):
+            old = self.snapshot(worksheet)
+            key = self.keys.get(worksheet)
+            if key is not None and self.read is not None:
+                # 讀取失敗就不寫入 (不在不知道最新內容的情況下覆蓋)
+                current = self.read(worksheet)
+                merged = merge_frames(old, df, current, key)
+                if list(merged.columns) != [str(c) for c in df.columns] or _rows(merged) != _rows(df):
+                    self.merges += 1
+                df, old = merged, current
+            elif old is None and self.read is not None:
+                try:
+                    old = self.read(worksheet)
+                except Exception:
+                    old = None
+            ranges = diff_frames(old, df)
+            total_cells = max(len(df) * len(df.columns), 1)
+            try:
+                if ranges is None or count_cells(ranges) > total_cells * self.full_ratio:
+                    self.write_full(worksheet, df)
+                    mode, cells = "full", total_cells
+                elif ranges:
+                    self.write_ranges(worksheet, ranges, len(df) + HEADER_ROWS)
+                    mode, cells = "delta", count_cells(ranges)
+                else:
+                    mode, cells = "noop", 0
+            except Exception:
+                # 寫入結果不確定，下次重新讀取基準
+                self.forget(worksheet)
+                raise
+            self.prime(worksheet, df)
+            return mode, cells
@@ -0,0 +1,137 @@
+# 快照式快取 (stale-while-revalidate)
+# 資料一律由最後一次成功載入的快照立即回應；快照過期時由背景執行緒重新載入，
+# 載入成功後整份置換 (讀取端不會看到一半的資料)，失敗則保留舊快照稍後再試。
+# 重新載入時先比對來源內容的雜湊，內容沒變就只更新檢查時間，不重建資料、不增加版本。
+
+import hashlib
+import threading
+import time
+from contextlib import nullcontext
+
+import pandas as pd
+
+
+def frame_fingerprint(df):
+    # 內容雜湊 (欄名 + 每一格)，用來判斷來源資料是否有變
+    h = hashlib.sha1("\x1f".join(str(c) for c in df.columns).encode("utf-8"))
+    if len(df):
+        h.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    return h.hexdigest()
+
+
+class Snapshot:
+    # fetch(): 讀取來源資料 (失敗時拋出例外)；build(raw): 轉成快照內容 (省略時直接使用 raw)
+    # background(): 背景載入時使用的 context (例如降低請求優先順序)
+    def __init__(self, name, fetch, build=None, max_age=3600, retry_after=60, background=None, fingerprint=frame_fingerprint):
+        self.name = name
+        self.fetch = fetch
+        self.build = build or (lambda raw: raw)
+        self.fingerprint = fingerprint
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.background = background or nullcontext
+
+        self.version = 0  # 內容有變才增加
+        self.loaded_at = None  # 最後一次確認與來源一致的時間
+        self.changed_at = None
+        self.last_error = None
+        self._digest = None
+        self._value = None
+        self._next_try = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _swap(self, value, digest):
+        with self._lock:
+            self._value = value
+            self._digest = digest
+            self.version += 1
+            self.changed_at = self.loaded_at = time.time()
+            self.last_error = None
+
+    def _touch(self):
+        # 來源沒有變動：只記錄確認時間
+        with self._lock:
+            self.loaded_at = time.time()
+            self.last_error = None
+
+    def _reload(self, min_interval=0):
+        # 回傳內容是否有變
+        with self._load_lock:
+            return self._load(min_interval)
+
+    def _load(self, min_interval=0):
+        # 呼叫端須持有 _load_lock
+        if self.loaded_at is not None and time.time() - self.loaded_at < min_interval:
+            return False
+        try:
+            raw = self.fetch()
+            digest = self.fingerprint(raw)
+            if self.loaded_at is not None and digest == self._digest:
+                self._touch()
+                return False
+            value = self.build(raw)
+        except Exception as e:
+            with self._lock:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self._next_try = time.time() + self.retry_after
+            raise
+        self._swap(value, digest)
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            with self.background():
+                self._reload()
+        except Exception as e:
+            print(f"Snapshot Refresh Error ({self.name}): {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            value, loaded_at = self._value, self.loaded_at
+            stale = loaded_at is not None and time.time() - loaded_at > self.max_age
+            start = stale and not self._refreshing and time.time() >= self._next_try
+            if start:
+                self._refreshing = True
+        if loaded_at is None:
+            # 第一次使用：只能同步載入 (同時間的其他呼叫端等待同一次載入，不各自讀取)
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self._load()
+                return self._value
+        if start:
+            threading.Thread(target=self._refresh_in_background, name=f"refresh-{self.name}", daemon=True).start()
+        return value
+
+    def refresh_later(self, min_interval=0):
+        # 在背景重新載入，不等待結果；min_interval 秒內剛確認過、或已在載入中就略過。回傳是否有啟動
+        with self._lock:
+            recent = self.loaded_at is not None and time.time() - self.loaded_at < min_interval
+            if recent or self._refreshing:
+                return False
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name=f"refresh-{self.name}", daemon=True).start()
+        return True
+
+    def refresh(self, min_interval=0):
+        # 立即同步重新載入 (例如管理員修改資料後)；min_interval 秒內剛確認過就略過。回傳內容是否有變
+        return self._reload(min_interval)
+
+    def invalidate(self):
+        # 快照可能與來源不一致 (例如回寫失敗)：下次使用時在背景重新載入並重建
+        with self._lock:
+            self._digest = None
+            if self.loaded_at is not None:
+                self.loaded_at = 0
+
+    def age(self):
+        loaded_at = self.loaded_at
+        return None if loaded_at is None else time.time() - loaded_at
+
+    @property
+    def refreshing(self):
+        return self._refreshing
@@ -0,0 +1,291 @@
+# 資料儲存後端
+# 所有分頁的讀寫都經過同一組介面：read / update (整表覆寫) / append_rows / update_cells (batch 範圍)。
+# 預設使用 Google Sheets；也可以改用本地 CSV、Parquet 或 SQLite 副本，方便壓力測試、效能分析與測試環境。
+
+import hashlib
+import numbers
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+import pandas as pd
+
+from sheet_sync import HEADER_ROWS, cell_value
+
+_A1 = re.compile(r"^([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+
+def col_index(letters):
+    # A -> 0, Z -> 25, AA -> 26
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + (ord(ch) - 64)
+    return idx - 1
+
+
+def parse_range(a1):
+    # "B5:D7" -> (5, 1, 7, 3)：Sheet 列號 (含標題列) 與 0 起算的欄位
+    m = _A1.match(a1.split("!")[-1].replace("$", ""))
+    if not m:
+        raise ValueError(f"無法解析的範圍: {a1}")
+    c0, r0, c1, r1 = m.groups()
+    return int(r0), col_index(c0), int(r1 or r0), col_index(c1 or c0)
+
+
+def ttl_seconds(ttl):
+    # read() 的 ttl 可以是秒數或 timedelta；None / 0 代表不使用快取
+    if isinstance(ttl, timedelta):
+        return ttl.total_seconds()
+    return float(ttl or 0)
+
+
+def _is_blank(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+
+def apply_ranges(df, ranges):
+    # 把 batch update 範圍套用到 DataFrame (本地後端用)；尾端全空的列視為已刪除
+    n_cols = len(df.columns)
+    rows = [list(r) for r in df.astype(object).itertuples(index=False, name=None)]
+    for r in ranges:
+        top, left, _, _ = parse_range(r["range"])
+        for i, values in enumerate(r["values"]):
+            pos = top - 1 - HEADER_ROWS + i
+            while len(rows) <= pos:
+                rows.append([None] * n_cols)
+            for j, value in enumerate(values):
+                if left + j < n_cols:
+                    rows[pos][left + j] = value
+    while rows and all(_is_blank(v) for v in rows[-1]):
+        rows.pop()
+    return pd.DataFrame(rows, columns=df.columns)
+
+
+def tidy_frame(df):
+    # 寫入本地檔案前整理：空字串視為空值；全是數字的欄位存成數字，其他存成字串 (與 Sheet 讀回來的樣子一致)
+    out = df.copy()
+    out.columns = [str(c) for c in out.columns]
+    for col in out.columns:
+        if out[col].dtype != object and not pd.api.types.is_string_dtype(out[col]):
+            continue
+        s = out[col].astype(object).map(lambda v: None if _is_blank(v) else cell_value(v))
+        values = s.dropna()
+        if len(values) and all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in values):
+            out[col] = pd.to_numeric(s)
+        else:
+            out[col] = s.map(lambda v: None if v is None else str(v))
+    return out
+
+
+class StorageBackend:
+    # 各後端實作以下方法；worksheet 為分頁名稱 (Products, Orders, Users...)
+    kind = "base"
+    key = "base"  # 區分不同資料來源 (例如本地訂單資料庫的檔名)
+
+    def read(self, worksheet, ttl=3600):
+        raise NotImplementedError
+
+    def update(self, worksheet, df):
+        # 整表覆寫
+        raise NotImplementedError
+
+    def append_rows(self, worksheet, df):
+        raise NotImplementedError
+
+    def update_cells(self, worksheet, ranges, n_rows):
+        # ranges: gspread batch_update 格式 [{"range": "B5:D5", "values": [[...]]}]
+        raise NotImplementedError
+
+    def background(self):
+        # 背景重新整理時使用 (有排程器的後端會降低優先順序)
+        return nullcontext()
+
+    def cached(self, worksheet, ttl):
+        # read(worksheet, ttl) 是否會直接由快取回應 (不送出請求)
+        return False
+
+    def api_calls(self, op):
+        # 一次 read / update / append / update_cells 實際送出的 API 請求數 (排程器依此扣額度)
+        return 1
+
+    def last_call(self):
+        # 這個執行緒最近一次請求的統計 (有排程器的後端才有：attempts / rate_limited / queued / backoff 秒數 / coalesced)
+        return {}
+
+
+class SheetsBackend(StorageBackend):
+    kind = "sheets"
+    # 每個操作實際的 API 請求數：開啟試算表、取得分頁各 1 次，再加上
+    # read: 讀取值 1 次；update: 清空、調整大小、寫入、格式 4 次；append / update_cells: 寫入 1 次
+    API_CALLS = {"read": 3, "update": 6, "append": 3, "update_cells": 3}
+
+    def __init__(self, conn, spreadsheet):
+        # conn: st.connection("gsheets", type=GSheetsConnection)
+        self.conn = conn
+        self.spreadsheet = spreadsheet
+        self.key = "sheets"
+        self._fetched = {}  # (分頁, ttl) -> 最後一次實際讀取的時間 (conn.read 的快取在 ttl 內有效)
+        self._lock = threading.Lock()
+
+    def _worksheet(self, worksheet):
+        return self.conn.client._select_worksheet(spreadsheet=self.spreadsheet, worksheet=worksheet)
+
+    def cached(self, worksheet, ttl):
+        seconds = ttl_seconds(ttl)
+        with self._lock:
+            fetched = self._fetched.get((worksheet, seconds))
+        return seconds > 0 and fetched is not None and time.monotonic() - fetched < seconds
+
+    def api_calls(self, op):
+        return self.API_CALLS[op]
+
+    def read(self, worksheet, ttl=3600):
+        cached = self.cached(worksheet, ttl)
+        df = self.conn.read(spreadsheet=self.spreadsheet, worksheet=worksheet, ttl=ttl)
+        if not cached and ttl_seconds(ttl) > 0:
+            with self._lock:
+                self._fetched[(worksheet, ttl_seconds(ttl))] = time.monotonic()
+        return df
+
+    def update(self, worksheet, df):
+        self.conn.update(spreadsheet=self.spreadsheet, worksheet=worksheet, data=df)
+
+    def append_rows(self, worksheet, df):
+        values = [[cell_value(v) for v in row] for row in df.itertuples(index=False, name=None)]
+        self._worksheet(worksheet).append_rows(values, value_input_option="USER_ENTERED")
+
+    def update_cells(self, worksheet, ranges, n_rows):
+        # 只寫入有變動的儲存格 (一次 batch update)
+        ws = self._worksheet(worksheet)
+        if ws.row_count < n_rows:
+            ws.add_rows(n_rows - ws.row_count)
+        ws.batch_update(ranges, value_input_option="USER_ENTERED")
+
+
+class LocalBackend(StorageBackend):
+    # 本地副本共用邏輯：子類別只需實作 _load / _save；不存在的分頁視為空表
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.key = f"{self.kind}-{hashlib.sha1(self.path.encode('utf-8')).hexdigest()[:8]}"
+        self._lock = threading.RLock()
+
+    def _load(self, worksheet):
+        raise NotImplementedError
+
+    def _save(self, worksheet, df):
+        raise NotImplementedError
+
+    def read(self, worksheet, ttl=3600):
+        with self._lock:
+            df = self._load(worksheet)
+        return pd.DataFrame() if df is None else df
+
+    def update(self, worksheet, df):
+        with self._lock:
+            self._save(worksheet, tidy_frame(df))
+
+    def append_rows(self, worksheet, df):
+        with self._lock:
+            old = self._load(worksheet)
+            merged = df if old is None or old.empty else pd.concat([old, df], ignore_index=True)
+            self._save(worksheet, tidy_frame(merged))
+
+    def update_cells(self, worksheet, ranges, n_rows):
+        with self._lock:
+            old = self._load(worksheet)
+            if old is None:
+                raise KeyError(f"找不到分頁: {worksheet}")
+            self._save(worksheet, tidy_frame(apply_ranges(old, ranges)))
+
+
+class _FileBackend(LocalBackend):
+    # 每個分頁一個檔案：<path>/<worksheet>.<ext>；寫入先寫暫存檔再置換，避免讀到一半的檔案
+    ext = ""
+
+    def __init__(self, path):
+        super().__init__(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, worksheet):
+        return os.path.join(self.path, f"{worksheet}.{self.ext}")
+
+    def _load(self, worksheet):
+        file = self._file(worksheet)
+        if not os.path.exists(file):
+            return None
+        return self._read_file(file)
+
+    def _save(self, worksheet, df):
+        file = self._file(worksheet)
+        tmp = f"{file}.tmp"
+        self._write_file(df, tmp)
+        os.replace(tmp, file)
+
+
+class CsvBackend(_FileBackend):
+    kind = "csv"
+    ext = "csv"
+
+    def _read_file(self, file):
+        # 全部以字串讀入 (保留電話等開頭的 0)，型別交給 apply_schema
+        return pd.read_csv(file, dtype=str)
+
+    def _write_file(self, df, file):
+        df.to_csv(file, index=False)
+
+
+class ParquetBackend(_FileBackend):
+    kind = "parquet"
+    ext = "parquet"
+
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet 後端需要安裝 pyarrow (pip install pyarrow)")
+        super().__init__(path)
+
+    def _read_file(self, file):
+        return pd.read_parquet(file)
+
+    def _write_file(self, df, file):
+        df.to_parquet(file, index=False)
+
+
+class SqliteBackend(LocalBackend):
+    # 每個分頁一張資料表 (單一 .db 檔)
+    kind = "sqlite"
+
+    def __init__(self, path):
+        super().__init__(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _load(self, worksheet):
+        exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (worksheet,)).fetchone()
+        if not exists:
+            return None
+        return pd.read_sql_query(f'SELECT * FROM "{worksheet}"', self._db)
+
+    def _save(self, worksheet, df):
+        with self._db:
+            df.to_sql(worksheet, self._db, if_exists="replace", index=False)
+
+
+LOCAL_BACKENDS = {"csv": CsvBackend, "parquet": ParquetBackend, "sqlite": SqliteBackend}
+
+
+def open_local_backend(kind, path):
+    if kind not in LOCAL_BACKENDS:
+        raise ValueError(f"未知的儲存後端: {kind} (可用: sheets, {', '.join(LOCAL_BACKENDS)})")
+    return LOCAL_BACKENDS[kind](path)
+
+
+def copy_worksheets(source, target, worksheets):
+    # 把分頁整份複製到另一個後端 (例如把正式 Sheet 匯出成本地測試副本)
+    for worksheet in worksheets:
+        target.update(worksheet, source.read(worksheet, ttl=0))
@@ -0,0 +1,76 @@
+# ImageCache 容量上限與 LRU 刪除測試 (python -m pytest -q)
+
+import os
+
+import pytest
+
+from image_cache import ImageCache, local_drive_fetcher
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def drive(tmp_path, n):
+    # 本地 Drive 資料夾：id0.png ~ id{n-1}.png (大小相同的圖片)
+    folder = tmp_path / "drive"
+    folder.mkdir()
+    for i in range(n):
+        Image.new("RGB", (64, 48), (40 * i, 80, 120)).save(folder / f"id{i}.png")
+    return str(folder), [f"https://drive.google.com/file/d/id{i}/view" for i in range(n)]
+
+
+def image_cache(tmp_path, folder, budget_bytes, grace):
+    return ImageCache(str(tmp_path / "cache"), {"tile": 32}, fetch=local_drive_fetcher(folder),
+                      budget_bytes=budget_bytes, grace=grace)
+
+
+def file_sizes(tmp_path, folder, urls):
+    # 每個檔案 (原圖、各尺寸) 的大小：{(第幾張, "src" / "tile"): bytes}
+    probe = image_cache(tmp_path / "probe", folder, 2**30, 0)
+    root = tmp_path / "probe" / "cache"
+    sizes = {}
+    for i, url in enumerate(urls):
+        probe.get(url, "tile")
+        for name in os.listdir(root):
+            key, _, rest = name.partition("-")
+            if key == probe.key(url):
+                sizes[i, rest.split(".")[0]] = os.path.getsize(root / name)
+    return sizes
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    folder, urls = drive(tmp_path, 3)
+    sizes = file_sizes(tmp_path, folder, urls)
+    # 容量剛好放得下 A 的小圖與 C 的全部檔案：比 A 的小圖更久沒用到的 (A 原圖、B) 都要刪除
+    budget = sizes[0, "tile"] + sizes[2, "src"] + sizes[2, "tile"]
+    cache = image_cache(tmp_path, folder, budget_bytes=budget, grace=0)
+    cache.get(urls[0], "tile")
+    cache.get(urls[1], "tile")
+    cache.get(urls[0], "tile")  # 用過 A 的小圖：B 變成比它更久沒用到
+    cache.get(urls[2], "tile")
+    assert cache.cached(urls[0], "tile") is not None
+    assert cache.cached(urls[1], "tile") is None
+    assert cache.cached(urls[2], "tile") is not None
+    assert cache.usage()["bytes"] <= budget
+    assert not [name for name in os.listdir(tmp_path / "cache") if name.startswith(cache.key(urls[1]))]
+
+
+def test_keeps_recently_served_images_within_grace(tmp_path):
+    # 剛交給頁面的圖片還沒送到瀏覽器：暫時超出容量也不刪除
+    folder, urls = drive(tmp_path, 3)
+    sizes = file_sizes(tmp_path, folder, urls)
+    budget = sizes[0, "src"] + sizes[0, "tile"]
+    cache = image_cache(tmp_path, folder, budget_bytes=budget, grace=60)
+    paths = [cache.get(url, "tile") for url in urls]
+    assert all(os.path.exists(path) for path in paths)
+    assert cache.usage()["bytes"] > budget
+
+
+def test_never_evicts_the_image_being_generated(tmp_path):
+    # 容量比一張圖片還小：正在產生的圖片保留，回傳的路徑一定存在
+    folder, urls = drive(tmp_path, 2)
+    cache = image_cache(tmp_path, folder, budget_bytes=1, grace=0)
+    first = cache.get(urls[0], "tile")
+    second = cache.get(urls[1], "tile")
+    assert os.path.exists(second)
+    assert not os.path.exists(first)
+    assert cache.cached(urls[1], "tile") == second
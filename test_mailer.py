@@ -0,0 +1,121 @@
+# SmtpOutbox 測試 (以假的 SMTP 取代真正的伺服器；python -m pytest -q)
+
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from mailer import SmtpOutbox
+
+
+class FakeSMTP:
+    # 記錄寄出的信件；failures: {收件人: [依序要拋出的例外]}
+    instances = []
+
+    def __init__(self, host, port, timeout=None):
+        self.host = host
+        self.port = port
+        self.logged_in = None
+        self.sent = []
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, username, password):
+        self.logged_in = username
+
+    def noop(self):
+        return (250, b"OK")
+
+    def send_message(self, msg):
+        failures = FakeSMTP.failures.get(msg["To"])
+        if failures:
+            raise failures.pop(0)
+        self.sent.append(msg)
+
+    def quit(self):
+        self.closed = True
+
+
+def outbox(failures=None, max_attempts=3):
+    FakeSMTP.instances = []
+    FakeSMTP.failures = failures or {}
+    return SmtpOutbox("smtp.test", 587, username="shop@test", password="pw", per_minute=0,
+                      max_attempts=max_attempts, backoff=0.01, smtp_factory=FakeSMTP).start()
+
+
+def message(to, subject="訂單確認"):
+    msg = MIMEMultipart()
+    msg["From"] = "shop@test"
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.attach(MIMEText("<p>感謝您的訂購</p>", "html"))
+    return msg
+
+
+def send_all(box, messages):
+    results = []
+    done = threading.Semaphore(0)
+
+    def on_done(ok, error):
+        results.append((ok, error))
+        done.release()
+
+    for msg in messages:
+        box.enqueue(msg, on_done)
+    for _ in messages:
+        assert done.acquire(timeout=5)
+    return results
+
+
+def sent_messages():
+    return [msg for smtp in FakeSMTP.instances for msg in smtp.sent]
+
+
+def test_sends_queued_messages_over_one_connection():
+    box = outbox()
+    results = send_all(box, [message(f"d{i}@test") for i in range(3)])
+    assert results == [(True, None)] * 3
+    assert len(FakeSMTP.instances) == 1
+    assert FakeSMTP.instances[0].logged_in == "shop@test"
+    sent = sent_messages()
+    assert [m["To"] for m in sent] == ["d0@test", "d1@test", "d2@test"]
+    assert sent[0]["Subject"] == "訂單確認"
+    assert "感謝您的訂購" in sent[0].get_payload()[0].get_payload(decode=True).decode("utf-8")
+    assert box.pending() == 0 and box.sent == 3 and box.failed == 0
+
+
+def test_retries_after_failure_and_reconnects():
+    box = outbox({"d1@test": [smtplib.SMTPDataError(451, b"try again")]})
+    results = send_all(box, [message("d1@test")])
+    assert results == [(True, None)]
+    assert len(FakeSMTP.instances) == 2  # 失敗後關閉連線，重試時重新連線
+    assert FakeSMTP.instances[0].closed
+    assert [m["To"] for m in sent_messages()] == ["d1@test"]
+
+
+def test_reconnects_once_when_server_disconnects():
+    box = outbox({"d1@test": [smtplib.SMTPServerDisconnected("closed")]})
+    assert send_all(box, [message("d1@test")]) == [(True, None)]
+    assert len(FakeSMTP.instances) == 2
+    assert box.sent == 1
+
+
+def test_gives_up_after_max_attempts_and_keeps_draining():
+    error = smtplib.SMTPDataError(451, b"try again")
+    box = outbox({"bad@test": [error, error, error]}, max_attempts=2)
+    results = send_all(box, [message("bad@test"), message("ok@test")])
+    assert results[0] == (True, None)  # 重試等待期間先寄出後面的信
+    assert results[1][0] is False
+    assert [m["To"] for m in sent_messages()] == ["ok@test"]
+    assert box.pending() == 0 and box.sent == 1 and box.failed == 1
+
+
+def test_refused_recipient_is_not_retried():
+    box = outbox({"nobody@test": [smtplib.SMTPRecipientsRefused({"nobody@test": (550, b"no such user")})]})
+    results = send_all(box, [message("nobody@test")])
+    assert results[0][0] is False
+    assert box.failed == 1 and box.pending() == 0
+    assert sent_messages() == []
@@ -0,0 +1,70 @@
+# 排程器讀取合併測試 (python -m pytest -q)
+
+import threading
+import time
+
+import pandas as pd
+
+from scheduler import RequestScheduler, ScheduledBackend
+from storage import StorageBackend
+
+
+class FakeSheets(StorageBackend):
+    kind = "sheets"
+    key = "sheets"
+
+    def __init__(self, gate=None):
+        self.fetches = 0
+        self.gate = gate
+        self.started = threading.Event()
+
+    def read(self, worksheet, ttl=3600):
+        self.fetches += 1
+        n = self.fetches
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return pd.DataFrame({"Order_ID": [f"ORD-{n}"]})
+
+
+def read_in_threads(backend, n, delay=0.0):
+    results = [None] * n
+
+    def run(i):
+        results[i] = backend.read("Orders", ttl=0)
+
+    threads = []
+    for i in range(n):
+        thread = threading.Thread(target=run, args=(i,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(delay)
+    return threads, results
+
+
+def test_concurrent_fresh_reads_share_one_fetch():
+    scheduler = RequestScheduler(per_minute=600, burst=1)
+    scheduler.acquire()  # 用掉額度：第一個讀取排隊約 0.1 秒，第二個讀取在送出前到達
+    fake = FakeSheets()
+    threads, results = read_in_threads(ScheduledBackend(fake, scheduler), 2, delay=0.02)
+    for thread in threads:
+        thread.join(5)
+    assert fake.fetches == 1
+    assert scheduler.coalesced == 1
+    assert results[0] is results[1]
+
+
+def test_fresh_read_does_not_join_a_fetch_already_sent():
+    # 已送出的讀取可能早於呼叫端最近一次寫入：要送出新的請求
+    gate = threading.Event()
+    fake = FakeSheets(gate)
+    backend = ScheduledBackend(fake, RequestScheduler(per_minute=600, burst=10))
+    first, results = read_in_threads(backend, 1)
+    assert fake.started.wait(5)
+    second, later = read_in_threads(backend, 1)
+    gate.set()
+    for thread in first + second:
+        thread.join(5)
+    assert fake.fetches == 2
+    assert results[0]["Order_ID"][0] == "ORD-1"
+    assert later[0]["Order_ID"][0] == "ORD-2"
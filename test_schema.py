@@ -0,0 +1,30 @@
+# apply_schema 價格欄位測試 (python -m pytest -q)
+
+import pandas as pd
+
+from schema import apply_schema
+
+
+def products(*prices):
+    return pd.DataFrame({
+        "Product_ID": [f"P{i}" for i in range(len(prices))],
+        "Name": [f"Prod {i}" for i in range(len(prices))],
+        "Wholesale_Price": list(prices),
+        "Retail_Price": [200] * len(prices),
+    })
+
+
+def test_integer_prices_load_as_int():
+    df = apply_schema(products("100", 150.0, None), "Products")
+    assert df["Wholesale_Price"].tolist() == [100, 150, 0]
+    assert str(df["Wholesale_Price"].dtype) == "int32"
+    assert df.attrs["invalid_rows"] == []
+
+
+def test_fractional_price_skips_only_that_row():
+    # 一格有小數不應讓整張 Products 載入失敗 (也不四捨五入)
+    df = apply_schema(products("100", "12.5", 300), "Products")
+    assert df["Product_ID"].tolist() == ["P0", "P2"]
+    assert df["Wholesale_Price"].tolist() == [100, 300]
+    assert list(df.index) == [0, 1]
+    assert df.attrs["invalid_rows"] == ["第 3 列 Wholesale_Price=12.5"]
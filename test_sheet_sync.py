@@ -0,0 +1,50 @@
+# merge_frames 三方合併測試 (python -m pytest -q)
+
+import pandas as pd
+
+from sheet_sync import merge_frames
+
+COLUMNS = ["Order_ID", "Status", "Tracking_Number"]
+
+
+def frame(*rows):
+    return pd.DataFrame([dict(zip(COLUMNS, row)) for row in rows], columns=COLUMNS)
+
+
+def rows(df):
+    return [tuple(r) for r in df[COLUMNS].itertuples(index=False, name=None)]
+
+
+def test_keeps_edits_from_both_sides():
+    base = frame(("A", "待處理, 未付款", ""))
+    ours = frame(("A", "待處理, 已付款", ""))
+    theirs = frame(("A", "待處理, 未付款", "T123"))
+    assert rows(merge_frames(base, ours, theirs, "Order_ID")) == [("A", "待處理, 已付款", "T123")]
+
+
+def test_without_base_theirs_wins_for_rows_on_both_sides():
+    # 重新啟動後沒有基準：不能把我方舊的內容當成修改，蓋掉 Sheet 上的出貨資料
+    ours = frame(("A", "待處理, 未付款", ""))
+    theirs = frame(("A", "已出貨, 未付款", "T123"))
+    assert rows(merge_frames(None, ours, theirs, "Order_ID")) == [("A", "已出貨, 未付款", "T123")]
+
+
+def test_without_base_keeps_rows_from_either_side():
+    ours = frame(("A", "待處理, 未付款", ""), ("B", "待處理, 未付款", ""))
+    theirs = frame(("C", "已出貨, 未付款", "T9"), ("A", "已出貨, 未付款", "T123"))
+    merged = merge_frames(None, ours, theirs, "Order_ID")
+    assert rows(merged) == [("C", "已出貨, 未付款", "T9"), ("A", "已出貨, 未付款", "T123"), ("B", "待處理, 未付款", "")]
+
+
+def test_deletes_only_unchanged_rows():
+    base = frame(("A", "待處理, 未付款", ""), ("B", "待處理, 未付款", ""))
+    ours = frame(("B", "待處理, 未付款", ""))
+    theirs = frame(("A", "待處理, 未付款", ""), ("B", "已出貨, 未付款", "T1"))
+    assert rows(merge_frames(base, ours, theirs, "Order_ID")) == [("B", "已出貨, 未付款", "T1")]
+
+
+def test_passes_through_rows_with_blank_or_duplicate_keys():
+    base = frame(("A", "待處理, 未付款", ""), ("", "備註列", ""), ("A", "重複", ""))
+    ours = frame(("A", "已出貨, 未付款", ""))
+    merged = merge_frames(base, ours, base, "Order_ID")
+    assert rows(merged) == [("A", "已出貨, 未付款", ""), ("", "備註列", ""), ("A", "重複", "")]
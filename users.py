@@ -0,0 +1,135 @@
+# 使用者目錄
+# Users 分頁載入一次後以 Username 建立索引，登入與個人資料都直接查表；
+# 修改時就地更新並回寫 Sheet。新設定的密碼以 PBKDF2 雜湊保存，舊的明碼密碼仍可登入 (登入成功後改存雜湊)。
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+import pandas as pd
+
+from sheet_sync import changed_fields
+
+HASH_PREFIX = "pbkdf2_sha256"
+HASH_ITERATIONS = 200_000
+
+
+def hash_password(password, iterations=HASH_ITERATIONS):
+    salt = os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac("sha256", str(password).encode("utf-8"), salt.encode("ascii"), iterations).hex()
+    return f"{HASH_PREFIX}${iterations}${salt}${digest}"
+
+
+def is_hashed(stored):
+    return str(stored or "").startswith(HASH_PREFIX + "$")
+
+
+def check_password(stored, password):
+    stored = "" if stored is None else str(stored)
+    if is_hashed(stored):
+        try:
+            _, iterations, salt, digest = stored.split("$")
+            candidate = hashlib.pbkdf2_hmac("sha256", str(password).encode("utf-8"), salt.encode("ascii"), int(iterations)).hex()
+        except ValueError:
+            return False
+        return hmac.compare_digest(candidate, digest)
+    # 舊資料：Sheet 上是明碼
+    return stored != "" and hmac.compare_digest(stored.encode("utf-8"), str(password).encode("utf-8"))
+
+
+class UserDirectory:
+    # df: 已套用 schema 的 Users 分頁
+    def __init__(self, df):
+        self.columns = [str(c) for c in df.columns]
+        self._records = {}
+        # 原本的列順序：使用者名稱，或 Username 空白 / 重複的資料列 (不能登入，回寫時原樣保留)
+        self._rows = []
+        for rec in df.to_dict("records"):
+            username = str(rec.get("Username", "")).strip()
+            if not username or username in self._records:
+                self._rows.append(rec)
+                continue
+            self._records[username] = rec
+            self._rows.append(username)
+        self._lock = threading.Lock()
+
+    def __contains__(self, username):
+        return str(username).strip() in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def usernames(self):
+        return list(self._records)
+
+    def get(self, username):
+        # 使用者資料 (不含密碼欄位)；找不到回傳 None
+        with self._lock:
+            rec = self._records.get(str(username).strip())
+            if rec is None:
+                return None
+            return {k: v for k, v in rec.items() if k != "Password"}
+
+    def verify(self, username, password):
+        with self._lock:
+            rec = self._records.get(str(username).strip())
+            stored = None if rec is None else rec.get("Password")
+        return rec is not None and check_password(stored, password)
+
+    def needs_rehash(self, username):
+        # 密碼仍是明碼 (舊資料)
+        with self._lock:
+            rec = self._records.get(str(username).strip())
+            return rec is not None and not is_hashed(rec.get("Password"))
+
+    def update(self, username, fields, base=None):
+        # 就地修改；密碼欄位會先雜湊。回傳是否找到使用者
+        # base: 呼叫端當初讀到的資料列，有提供時只套用與它不同的欄位 (不覆蓋其他人同時做的修改)
+        fields = dict(fields) if base is None else changed_fields(base, fields)
+        if "Password" in fields:
+            fields["Password"] = hash_password(fields["Password"])
+        with self._lock:
+            rec = self._records.get(str(username).strip())
+            if rec is None:
+                return False
+            for col in fields:
+                if col not in self.columns:
+                    self.columns.append(col)
+            rec.update(fields)
+            return True
+
+    def to_dataframe(self):
+        # 依 Sheet 原本的欄位與順序輸出 (回寫用)
+        with self._lock:
+            rows = [dict(self._records[row]) if isinstance(row, str) else dict(row) for row in self._rows]
+        return pd.DataFrame(rows, columns=self.columns)
+
+
+class LoginGuard:
+    # 連續登入失敗 max_failures 次後鎖定 lockout 秒 (與使用者目錄分開保存，目錄重新載入時不會歸零)
+    def __init__(self, max_failures=5, lockout=900):
+        self.max_failures = max_failures
+        self.lockout = lockout
+        self._failures = {}  # username -> (次數, 鎖定到期時間)
+        self._lock = threading.Lock()
+
+    def locked_for(self, username):
+        with self._lock:
+            _, until = self._failures.get(username, (0, 0))
+        return max(0, until - time.time())
+
+    def failure(self, username):
+        with self._lock:
+            count, until = self._failures.get(username, (0, 0))
+            if until and until <= time.time():
+                count = 0  # 上次鎖定已過期，重新計算
+            count += 1
+            until = time.time() + self.lockout if count >= self.max_failures else 0
+            self._failures[username] = (count, until)
+            return count
+
+    def success(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
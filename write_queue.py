@@ -0,0 +1,145 @@
+# 延遲寫入佇列 (write-behind)
+# 同一分頁在短時間內的多次修改只排一次寫入：第一筆修改進來後等 window 秒，
+# 期間的其他修改合併進同一次寫入 (寫入函式在送出當下才取最新的完整內容)。
+# 每次提交回傳 PendingWrite，呼叫端可以等待確認已寫入 (或取得失敗原因)。
+# 每個分頁有自己的背景執行緒：Orders 推送很慢時不會擋住 Users 等其他分頁的確認。
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class PendingWrite:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.error = None
+        self._done = threading.Event()
+
+    def _finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        # 等待寫入完成；寫入失敗時拋出原本的例外，逾時拋出 TimeoutError
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.worksheet} 寫入逾時")
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+class _Slot:
+    # 某個分頁等待寫入的內容
+    def __init__(self, due):
+        self.due = due
+        self.first_at = time.time()
+        self.writes = OrderedDict()  # key -> write()，同一個 key 只保留最後一次
+        self.waiters = []
+
+
+class WriteBehindQueue:
+    # window: 第一筆修改進來後最多等幾秒再寫入
+    def __init__(self, window=1.0):
+        self.window = window
+        self._cond = threading.Condition()
+        self._slots = {}  # worksheet -> _Slot
+        self._inflight = {}  # worksheet -> 寫入中的筆數
+        self._stats = {}
+        self._threads = {}  # worksheet -> 該分頁的寫入執行緒
+
+    def _stat(self, worksheet):
+        return self._stats.setdefault(worksheet, {
+            "submitted": 0, "flushes": 0, "errors": 0, "last_error": None,
+            "last_latency": None, "max_latency": 0.0, "total_latency": 0.0, "last_flush_at": None,
+        })
+
+    def submit(self, worksheet, write, key=None):
+        # write(): 實際寫入，在背景執行緒呼叫；同一分頁同一個 key 在 window 內只執行最後提交的那個
+        pending = PendingWrite(worksheet)
+        with self._cond:
+            slot = self._slots.get(worksheet)
+            if slot is None:
+                slot = self._slots[worksheet] = _Slot(time.time() + self.window)
+            slot.writes.pop(key, None)
+            slot.writes[key] = write
+            slot.waiters.append(pending)
+            self._stat(worksheet)["submitted"] += 1
+            if worksheet not in self._threads:
+                thread = threading.Thread(target=self._run, args=(worksheet,), name=f"write-behind-{worksheet}", daemon=True)
+                self._threads[worksheet] = thread
+                thread.start()
+            self._cond.notify_all()
+        return pending
+
+    def flush(self, worksheet=None):
+        # 不等 window，立即寫入 (worksheet 為 None 時全部)
+        with self._cond:
+            for name, slot in self._slots.items():
+                if worksheet is None or name == worksheet:
+                    slot.due = 0
+            self._cond.notify_all()
+
+    def _next_slot(self, worksheet):
+        # 等到這個分頁的內容到期；寫入中又進來的修改留在新的 slot，等這次寫完才處理
+        with self._cond:
+            while True:
+                slot = self._slots.get(worksheet)
+                now = time.time()
+                if slot is not None and slot.due <= now:
+                    del self._slots[worksheet]
+                    self._inflight[worksheet] = len(slot.waiters)
+                    return slot
+                self._cond.wait(None if slot is None else slot.due - now)
+
+    def _run(self, worksheet):
+        while True:
+            self._flush_slot(worksheet, self._next_slot(worksheet))
+
+    def _flush_slot(self, worksheet, slot):
+        error = None
+        try:
+            for write in slot.writes.values():
+                write()
+        except Exception as e:
+            error = e
+            print(f"Write Queue Error ({worksheet}): {e}")
+        latency = time.time() - slot.first_at
+        with self._cond:
+            self._inflight.pop(worksheet, None)
+            stat = self._stat(worksheet)
+            stat["flushes"] += 1
+            stat["last_latency"] = latency
+            stat["max_latency"] = max(stat["max_latency"], latency)
+            stat["total_latency"] += latency
+            stat["last_flush_at"] = time.time()
+            if error is not None:
+                stat["errors"] += 1
+                stat["last_error"] = f"{type(error).__name__}: {error}"
+        for pending in slot.waiters:
+            pending._finish(error)
+
+    def _depth(self, worksheet):
+        slot = self._slots.get(worksheet)
+        return (len(slot.waiters) if slot is not None else 0) + self._inflight.get(worksheet, 0)
+
+    def depth(self, worksheet=None):
+        # 尚未確認寫入的修改筆數 (含寫入中)
+        with self._cond:
+            names = [worksheet] if worksheet is not None else set(self._slots) | set(self._inflight)
+            return sum(self._depth(name) for name in names)
+
+    def stats(self):
+        # {分頁: {depth, submitted, flushes, avg_latency, last_latency, max_latency, errors, last_error, last_flush_at}}
+        with self._cond:
+            out = {}
+            for name, stat in self._stats.items():
+                row = dict(stat)
+                total = row.pop("total_latency")
+                row["avg_latency"] = total / row["flushes"] if row["flushes"] else None
+                row["depth"] = self._depth(name)
+                out[name] = row
+            return out